@@ -1,63 +1,468 @@
-from flask import Flask, render_template, request, jsonify
-from sports_captioner import SportsCaptioner
+import hashlib
+import json
+import logging
 import os
-from werkzeug.utils import secure_filename
+import threading
+import time
+from functools import wraps
+
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+
+from caption_engine import seed_from_bytes
+from config import LIMITER_CONFIG
+from scheduler import DeadlineExceeded, UnknownLane
+from services import (
+    MAX_CONTENT_LENGTH,
+    allowed_file,
+    embedding_response,
+    get_services,
+    lookup_response,
+    parse_timeout,
+)
+from structured_logging import (
+    current_request_id,
+    end_request,
+    log_access,
+    logging_stats,
+    setup_logging,
+    stage,
+    start_request,
+)
+from utils.embeddings import EMBEDDING_FORMATS
+from utils.singleflight import SingleFlight
+
+# Logging runs behind a queue so request threads never wait on log I/O
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config["UPLOAD_FOLDER"] = "uploads"
+app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
 
 # Create uploads directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+
+# Captioner, caption cache, priority scheduler and concurrency limiter,
+# shared with asgi.py when both run in one process
+services = get_services()
+captioner = services.captioner
+caption_cache = services.caption_cache
+inference_scheduler = services.inference_scheduler
+concurrency_limiter = services.concurrency_limiter
+
+# Coalesces concurrent uploads of identical images into one inference
+caption_flight = SingleFlight()
+
+
+@app.before_request
+def begin_request_logging():
+    """Tag log records of this request with its id (X-Request-ID if sent)."""
+    g.logging_tokens = start_request(request.headers.get("X-Request-ID"))
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def log_request(response):
+    response.headers["X-Request-ID"] = current_request_id()
+    # Streamed responses are logged when the stream starts
+    log_access(
+        logger,
+        request.method,
+        request.path,
+        response.status_code,
+        time.perf_counter() - g.request_start,
+    )
+    return response
 
-# Initialize the captioner
-captioner = SportsCaptioner()
 
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+@app.teardown_request
+def end_request_logging(exc):
+    end_request(g.pop("logging_tokens", None))
+
+
+def overloaded_response():
+    """503 response telling the client when to retry."""
+    response = jsonify({"error": "Server is overloaded, please retry"})
+    response.headers["Retry-After"] = str(LIMITER_CONFIG["retry_after"])
+    return response, 503
+
+
+def scheduling_options():
+    """
+    Priority lane and time budget of the request, from e.g.
+    X-Priority: batch and X-Request-Timeout: 5.
+    """
+    lane = request.headers.get("X-Priority") or request.form.get("priority")
+    return lane, parse_timeout(request.headers.get("X-Request-Timeout"))
+
+
+def limit_concurrency(view):
+    """Admit a request only while under the concurrency limit, else answer 503."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        start_time = concurrency_limiter.try_acquire()
+        if start_time is None:
+            return overloaded_response()
+        response, status = None, 500
+        try:
+            response = view(*args, **kwargs)
+            status = response[1] if isinstance(response, tuple) else 200
+            return response
+        finally:
+            # Only successes and overload failures say something about capacity
+            concurrency_limiter.release(
+                start_time, overloaded=status in (503, 504), measure=status == 200
+            )
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return wrapper
 
-@app.route('/')
+
+@app.route("/")
 def index():
-    return app.send_static_file('index.html')
+    return app.send_static_file("index.html")
+
 
-@app.route('/generate_caption', methods=['POST'])
+@app.route("/generate_caption", methods=["POST"])
+@limit_concurrency
 def generate_caption():
     # Check if the post request has the file part
-    if 'image' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['image']
-    
+    if "image" not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files["image"]
+
     # If user does not select file, browser also
     # submit an empty part without filename
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    
+    if file.filename == "":
+        return jsonify({"error": "No selected file"}), 400
+
     if file and allowed_file(file.filename):
-        # Save the file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
         try:
-            # Generate caption
-            caption = captioner.generate_caption(filepath)
-            
-            # Remove the temporary file
-            os.remove(filepath)
-            
-            return jsonify({'caption': caption})
-            
+            lane, timeout = scheduling_options()
+        except ValueError:
+            return jsonify({"error": "Invalid X-Request-Timeout"}), 400
+
+        with stage("read"):
+            data = file.read()
+            digest = hashlib.sha256(data).hexdigest()
+        # Decoded straight from memory, no temporary file
+        return coalesced_caption(digest, data, lane, timeout)
+
+    return jsonify({"error": "File type not allowed"}), 400
+
+
+@app.route("/generate_caption/raw", methods=["POST"])
+@limit_concurrency
+def generate_caption_raw():
+    """Caption an image sent as the raw request body, without multipart encoding."""
+    mimetype = request.mimetype
+    if mimetype != "application/octet-stream" and not mimetype.startswith("image/"):
+        return (
+            jsonify(
+                {"error": "Content-Type must be application/octet-stream or image/*"}
+            ),
+            415,
+        )
+
+    length = request.content_length
+    if length is None:
+        return jsonify({"error": "Content-Length required"}), 411
+    if length > app.config["MAX_CONTENT_LENGTH"]:
+        return jsonify({"error": "Image too large"}), 413
+    if length == 0:
+        return jsonify({"error": "Empty body"}), 400
+    try:
+        lane, timeout = scheduling_options()
+    except ValueError:
+        return jsonify({"error": "Invalid X-Request-Timeout"}), 400
+
+    with stage("read"):
+        data = read_body(length, app.config["MAX_CONTENT_LENGTH"])
+        if data is None:
+            return jsonify({"error": "Incomplete body"}), 400
+        digest = hashlib.sha256(data).hexdigest()
+
+    # Decoded straight from memory, no temporary file
+    return coalesced_caption(digest, data, lane, timeout)
+
+
+def read_body(length, max_size):
+    """
+    Read exactly `length` bytes of the WSGI input, or None if it ends early.
+
+    The buffer grows as data arrives instead of being sized from the
+    client's Content-Length, so a client announcing a large body holds
+    only the memory of what it has actually sent.
+
+    Raises:
+        ValueError: If `length` exceeds `max_size`
+    """
+    if length > max_size:
+        raise ValueError(f"Body of {length} bytes exceeds {max_size}")
+    buffer = bytearray()
+    stream = request.stream
+    while len(buffer) < length:
+        chunk = stream.read(min(length - len(buffer), 1024 * 1024))
+        if not chunk:
+            return None
+        buffer += chunk
+    return buffer
+
+
+def coalesced_caption(digest, data, lane=None, timeout=None):
+    """
+    Caption response for an image; cached, or one inference shared by
+    concurrent identical images.
+
+    Only requests in the same lane share an inference, so a batch request
+    never makes an interactive one wait at batch priority. Each request
+    waits for a shared inference at most its own timeout.
+    """
+    caption = caption_cache.get(digest, len(data))
+    if caption is None:
+        seed = seed_from_bytes(digest)
+        try:
+            lane = inference_scheduler.resolve_lane(lane)
+            caption, _ = caption_flight.do(
+                (digest, lane),
+                lambda: inference_scheduler.run(
+                    lambda: captioner.generate_caption(data, seed=seed), lane, timeout
+                ),
+                timeout,
+            )
+        except UnknownLane as e:
+            return jsonify({"error": str(e)}), 400
+        except (DeadlineExceeded, TimeoutError) as e:
+            return jsonify({"error": str(e)}), 504
         except Exception as e:
-            # Clean up the file in case of error
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({'error': str(e)}), 500
-    
-    return jsonify({'error': 'File type not allowed'}), 400
-
-if __name__ == '__main__':
+            return jsonify({"error": str(e)}), 500
+        if caption.startswith("Caption:"):
+            caption_cache.put(digest, len(data), caption)
+    response = jsonify({"caption": caption})
+    # The digest identifies the image, and with it the caption
+    response.set_etag(digest)
+    return response
+
+
+@app.route("/generate_caption/lookup", methods=["GET"])
+def lookup_caption():
+    """First step of the hash-first upload: the caption of an already seen image."""
+    status, payload, headers = lookup_response(
+        caption_cache,
+        request.args.get("sha256", ""),
+        request.args.get("size"),
+        request.headers.get("If-None-Match"),
+        app.config["MAX_CONTENT_LENGTH"],
+    )
+    response = jsonify(payload) if payload is not None else Response(status=status)
+    response.headers.update(headers)
+    return response, status
+
+
+@app.route("/generate_captions", methods=["POST"])
+def generate_captions():
+    """Caption many images, streaming one JSON line per image as results come in."""
+    files = request.files.getlist("images")
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+    try:
+        lane, timeout = scheduling_options()
+        lane = inference_scheduler.resolve_lane(lane)
+    except UnknownLane as e:
+        return jsonify({"error": str(e)}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid X-Request-Timeout"}), 400
+
+    # Read the uploads into memory before the request body goes away
+    jobs = []
+    for index, file in enumerate(files):
+        if not file.filename or not allowed_file(file.filename):
+            jobs.append((index, file.filename, None, None))
+            continue
+        data = file.read()
+        jobs.append((index, file.filename, data, hashlib.sha256(data).hexdigest()))
+
+    # The limiter slot is held until the stream ends or is closed, which
+    # also happens when the client goes away before the first line
+    start_time = concurrency_limiter.try_acquire()
+    if start_time is None:
+        return overloaded_response()
+    released = threading.Lock()
+
+    def release():
+        if released.acquire(blocking=False):
+            concurrency_limiter.release(start_time, measure=False)
+
+    try:
+        response = Response(
+            stream_with_context(
+                stream_captions(jobs, lane, timeout, start_time, release)
+            ),
+            mimetype="application/x-ndjson",
+        )
+    except BaseException:
+        release()
+        raise
+    response.call_on_close(release)
+    return response
+
+
+def batch_captions(batch, lane, timeout):
+    """
+    Captions of a batch of (index, filename, data, digest) jobs.
+
+    Cached captions are served from caption_cache; the other images are
+    captioned in one inference, shared with concurrent requests for the
+    same images in the same lane through caption_flight.
+    """
+    captions = [caption_cache.get(digest, len(data)) for _, _, data, digest in batch]
+    missing = [i for i, caption in enumerate(captions) if caption is None]
+    if not missing:
+        return captions
+    sources = {(batch[i][3], lane): batch[i][2] for i in missing}
+
+    def run(keys):
+        images = [sources[key] for key in keys]
+        seeds = [seed_from_bytes(digest) for digest, _ in keys]
+        return inference_scheduler.run(
+            lambda: captioner.generate_captions(images, seeds), lane, timeout
+        )
+
+    results = caption_flight.do_batch(
+        [(batch[i][3], lane) for i in missing], run, timeout
+    )
+    for i, (caption, _) in zip(missing, results):
+        captions[i] = caption
+        if caption.startswith("Caption:"):
+            caption_cache.put(batch[i][3], len(batch[i][2]), caption)
+    return captions
+
+
+def stream_captions(jobs, lane, timeout, start_time, release):
+    """
+    Yield one NDJSON line per job, captioning the valid ones in batches.
+
+    `release` frees the request's limiter slot once the last line is out;
+    the response also calls it on close.
+    """
+    try:
+        for index, filename, data, _ in jobs:
+            if data is None:
+                yield json.dumps(
+                    {
+                        "index": index,
+                        "filename": filename,
+                        "error": "File type not allowed",
+                    }
+                ) + "\n"
+
+        pending = [job for job in jobs if job[2] is not None]
+        batch_size = captioner.buffer_pool.batch_size
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            batch_start = time.monotonic()
+            try:
+                captions = batch_captions(batch, lane, timeout)
+                errors = [None] * len(batch)
+            except Exception as e:
+                captions, errors = [None] * len(batch), [str(e)] * len(batch)
+            timings = {
+                "batch_ms": round((time.monotonic() - batch_start) * 1000, 2),
+                "elapsed_ms": round((time.monotonic() - start_time) * 1000, 2),
+            }
+
+            for (index, filename, _, _), caption, error in zip(batch, captions, errors):
+                line = {"index": index, "filename": filename, "timings": timings}
+                if error is None and caption.startswith("Caption:"):
+                    line["caption"] = caption
+                else:
+                    line["error"] = error or caption
+                yield json.dumps(line) + "\n"
+
+    finally:
+        release()
+
+
+@app.route("/embeddings", methods=["POST"])
+@limit_concurrency
+def embeddings():
+    """Pooled backbone embeddings of one (`image`) or several (`images`) uploads.
+
+    Options (query string or form): format=base64|float16|npy, normalize=1
+    for L2-normalized vectors, captions=1 to add captions from the same
+    forward pass (base64 format only).
+    """
+    files = request.files.getlist("images") or request.files.getlist("image")
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+    fmt = request.values.get("format", "base64")
+    if fmt not in EMBEDDING_FORMATS:
+        return (
+            jsonify(
+                {
+                    "error": f"Unknown format '{fmt}'. "
+                    f"Available: {', '.join(EMBEDDING_FORMATS)}"
+                }
+            ),
+            400,
+        )
+    normalize = request.values.get("normalize", "").lower() in ("1", "true", "yes")
+    with_captions = request.values.get("captions", "").lower() in ("1", "true", "yes")
+    try:
+        lane, timeout = scheduling_options()
+    except ValueError:
+        return jsonify({"error": "Invalid X-Request-Timeout"}), 400
+
+    valid = [i for i, f in enumerate(files) if f.filename and allowed_file(f.filename)]
+    sources = [files[i].read() for i in valid]
+    seeds = [seed_from_bytes(hashlib.sha256(data).hexdigest()) for data in sources]
+    try:
+        captions, vectors = inference_scheduler.run(
+            lambda: captioner.generate_captions_with_embeddings(sources, seeds),
+            lane,
+            timeout,
+        )
+    except UnknownLane as e:
+        return jsonify({"error": str(e)}), 400
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e)}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    status, body, headers = embedding_response(
+        [f.filename for f in files],
+        valid,
+        captions,
+        vectors,
+        fmt,
+        normalize,
+        with_captions,
+    )
+    if isinstance(body, dict):
+        return jsonify(body), status
+    return Response(body, status=status, headers=headers)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness probe for load balancers and the router."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose request coalescing counters and per-lane queue statistics."""
+    payload = {
+        "coalescing": caption_flight.stats(),
+        "scheduler": inference_scheduler.stats(),
+        "limiter": concurrency_limiter.stats(),
+        "caption_cache": caption_cache.stats(),
+        "logging": logging_stats(),
+    }
+    if captioner.near_duplicates is not None:
+        payload["near_duplicates"] = captioner.near_duplicates.stats()
+    return jsonify(payload)
+
+
+if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,658 @@
+"""
+asyncio-native ASGI entry point for the Sports Captioner.
+
+Serves the same routes as app.py, but request bodies are received
+asynchronously, so a slow client upload holds only a coroutine instead
+of a worker thread, and no concurrency limiter slot: the slot is taken
+only while inference runs. Multipart parsing and hashing run on a bounded
+thread pool and inference goes through the shared priority scheduler,
+whose futures are awaited without blocking the event loop.
+
+Run with any ASGI server, e.g.:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+from caption_engine import seed_from_bytes
+from config import ASGI_CONFIG, LIMITER_CONFIG
+from scheduler import DeadlineExceeded, UnknownLane
+from services import (
+    MAX_CONTENT_LENGTH,
+    allowed_file,
+    embedding_response,
+    get_services,
+    lookup_response,
+    parse_timeout,
+)
+from structured_logging import (
+    current_request_id,
+    end_request,
+    log_access,
+    logging_stats,
+    setup_logging,
+    stage,
+    start_request,
+)
+from utils.embeddings import EMBEDDING_FORMATS
+from utils.singleflight import AsyncSingleFlight
+
+# Logging runs behind a queue so the event loop never waits on log I/O
+setup_logging()
+logger = logging.getLogger(__name__)
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# The same captioner, caches, scheduler and limiter as app.py, without
+# importing the Flask app
+services = get_services()
+captioner = services.captioner
+caption_cache = services.caption_cache
+inference_scheduler = services.inference_scheduler
+concurrency_limiter = services.concurrency_limiter
+
+# Bounded pool for CPU-bound request work (multipart parsing, hashing)
+decode_executor = ThreadPoolExecutor(
+    max_workers=ASGI_CONFIG["decode_workers"], thread_name_prefix="asgi-decode"
+)
+
+# Coalesces concurrent uploads of identical images into one inference
+caption_flight = AsyncSingleFlight()
+
+
+class HTTPError(Exception):
+    """Error answered with a JSON body and the given status."""
+
+    def __init__(
+        self,
+        status: int,
+        message: str,
+        headers: Optional[List[Tuple[bytes, bytes]]] = None,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or []
+
+
+class MultipartParser:
+    """Incremental parser of a multipart/form-data body."""
+
+    def __init__(self, boundary: bytes):
+        """
+        Args:
+            boundary: Multipart boundary from the Content-Type header
+        """
+        self.decoder = MultipartDecoder(boundary)
+        self.parts: Dict[str, List[Tuple[str, List[bytes]]]] = {}
+        self.fields: Dict[str, List[bytes]] = {}
+        self.current: Optional[List[bytes]] = None
+
+    def feed(self, data: Optional[bytes]) -> None:
+        """Parse the next chunk of the body, or the end of it if `data` is None."""
+        self.decoder.receive_data(data)
+        while True:
+            event = self.decoder.next_event()
+            if isinstance(event, (NeedData, Epilogue)):
+                return
+            if isinstance(event, File):
+                self.current = []
+                self.parts.setdefault(event.name, []).append(
+                    (event.filename, self.current)
+                )
+            elif isinstance(event, Field):
+                # The first value of a repeated field wins, as in request.form.get
+                self.current = []
+                self.fields.setdefault(event.name, self.current)
+            elif isinstance(event, Data):
+                if self.current is not None:
+                    self.current.append(event.data)
+            else:
+                self.current = None
+
+    def close(self) -> Dict[str, List[Tuple[str, bytes]]]:
+        """
+        Finish parsing.
+
+        Returns:
+            Field name to list of (filename, content), in upload order
+        """
+        self.feed(None)
+        return {
+            name: [(filename, b"".join(chunks)) for filename, chunks in parts]
+            for name, parts in self.parts.items()
+        }
+
+    @property
+    def form(self) -> Dict[str, str]:
+        """Plain form fields received so far."""
+        return {
+            name: b"".join(chunks).decode("utf-8", "replace")
+            for name, chunks in self.fields.items()
+        }
+
+
+def digest_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def offload(fn: Callable, *args) -> Any:
+    """Run CPU-bound work on the decode pool, in the request's logging context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        decode_executor, context.run, fn, *args
+    )
+
+
+async def run_inference(
+    fn: Callable[[], Any], lane: Optional[str], timeout: float, measure: bool = True
+) -> Any:
+    """
+    Await a scheduler job without blocking the event loop.
+
+    The job holds a concurrency limiter slot from submission to result,
+    so clients still sending or receiving bodies hold none.
+
+    Args:
+        fn: Inference job
+        lane: Priority lane
+        timeout: Seconds to wait for the result
+        measure: Feed the latency to the limit algorithm (False for
+            batches, whose latency is not that of one request)
+
+    Raises:
+        HTTPError: 503 if the server is over its concurrency limit
+        DeadlineExceeded: If there is no result within `timeout`
+    """
+    start_time = concurrency_limiter.try_acquire()
+    if start_time is None:
+        raise HTTPError(
+            503,
+            "Server is overloaded, please retry",
+            [(b"retry-after", str(LIMITER_CONFIG["retry_after"]).encode("latin-1"))],
+        )
+    overloaded = succeeded = False
+    try:
+        future = inference_scheduler.submit(fn, lane, timeout)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # wrap_future cancelled the queued job along with the wait
+            overloaded = True
+            raise DeadlineExceeded(f"No result within {timeout:.2f}s")
+        succeeded = True
+        return result
+    finally:
+        # Same accounting as app.limit_concurrency: only successes and
+        # overload failures say something about capacity
+        concurrency_limiter.release(
+            start_time, overloaded=overloaded, measure=measure and succeeded
+        )
+
+
+class Request:
+    """The parts of an ASGI HTTP request the routes need."""
+
+    def __init__(self, scope: Dict, receive: Callable):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope.get("headers", [])
+        }
+        self.args = {
+            name: values[0]
+            for name, values in parse_qs(
+                scope.get("query_string", b"").decode("latin-1")
+            ).items()
+        }
+        # Plain multipart form fields, once files() has received the body
+        self.form: Dict[str, str] = {}
+
+    @property
+    def content_length(self) -> Optional[int]:
+        try:
+            return int(self.headers["content-length"])
+        except (KeyError, ValueError):
+            return None
+
+    async def stream(self, max_size: int) -> AsyncIterator[bytes]:
+        """Receive the body in chunks, rejecting it once it exceeds `max_size`."""
+        if self.content_length is not None and self.content_length > max_size:
+            raise HTTPError(413, "Image too large")
+        received = 0
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected")
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > max_size:
+                raise HTTPError(413, "Image too large")
+            yield chunk
+            if not message.get("more_body", False):
+                return
+
+    async def body(self, max_size: int) -> bytes:
+        """Receive the whole body, rejecting it as soon as it exceeds `max_size`."""
+        return b"".join([chunk async for chunk in self.stream(max_size)])
+
+    def scheduling_options(self) -> Tuple[Optional[str], float]:
+        """
+        Priority lane and time budget, as in app.scheduling_options: the
+        lane comes from X-Priority or the `priority` form field.
+        """
+        try:
+            timeout = parse_timeout(self.headers.get("x-request-timeout"))
+        except ValueError:
+            raise HTTPError(400, "Invalid X-Request-Timeout")
+        return self.headers.get("x-priority") or self.form.get("priority"), timeout
+
+    async def files(self, max_size: int) -> Dict[str, List[Tuple[str, bytes]]]:
+        mimetype, options = parse_options_header(self.headers.get("content-type", ""))
+        if mimetype != "multipart/form-data" or "boundary" not in options:
+            raise HTTPError(400, "No file part")
+        # Parsed on the decode pool as chunks arrive, so the raw body is
+        # never held in full next to the parts
+        parser = MultipartParser(options["boundary"].encode("latin-1"))
+        async for chunk in self.stream(max_size):
+            if chunk:
+                await offload(parser.feed, chunk)
+        files = await offload(parser.close)
+        self.form = parser.form
+        return files
+
+
+async def send_response(
+    send: Callable,
+    status: int,
+    body: bytes,
+    content_type: str,
+    headers: Optional[List[Tuple[bytes, bytes]]] = None,
+) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode("latin-1")),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ]
+            + (headers or []),
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(
+    send: Callable,
+    status: int,
+    payload: Dict,
+    headers: Optional[List[Tuple[bytes, bytes]]] = None,
+) -> None:
+    await send_response(
+        send, status, json.dumps(payload).encode("utf-8"), "application/json", headers
+    )
+
+
+def header_list(headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    return [
+        (k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()
+    ]
+
+
+async def caption_response(
+    digest: str, data: bytes, lane: Optional[str], timeout: float
+) -> Tuple[int, Dict, List[Tuple[bytes, bytes]]]:
+    """
+    Status, body and headers for captioning one image, cached or
+    coalesced by digest.
+    """
+    caption = caption_cache.get(digest, len(data))
+    if caption is None:
+        seed = seed_from_bytes(digest)
+        try:
+            # Shared per lane and waited for up to each request's own timeout, as in app
+            lane = inference_scheduler.resolve_lane(lane)
+            caption, _ = await caption_flight.do(
+                (digest, lane),
+                lambda: run_inference(
+                    lambda: captioner.generate_caption(data, seed=seed), lane, timeout
+                ),
+                timeout,
+            )
+        except UnknownLane as e:
+            return 400, {"error": str(e)}, []
+        except HTTPError as e:
+            return e.status, {"error": str(e)}, e.headers
+        except (DeadlineExceeded, TimeoutError) as e:
+            return 504, {"error": str(e)}, []
+        except Exception as e:
+            return 500, {"error": str(e)}, []
+        if caption.startswith("Caption:"):
+            caption_cache.put(digest, len(data), caption)
+    return 200, {"caption": caption}, header_list({"ETag": f'"{digest}"'})
+
+
+async def index(request: Request, send: Callable) -> None:
+    path = os.path.join(STATIC_FOLDER, "index.html")
+    body = await offload(read_file, path)
+    await send_response(send, 200, body, "text/html; charset=utf-8")
+
+
+async def generate_caption(request: Request, send: Callable) -> int:
+    with stage("read"):
+        files = (await request.files(MAX_CONTENT_LENGTH)).get("image")
+    if not files:
+        raise HTTPError(400, "No file part")
+    filename, data = files[0]
+    if filename == "":
+        raise HTTPError(400, "No selected file")
+    if not allowed_file(filename):
+        raise HTTPError(400, "File type not allowed")
+    lane, timeout = request.scheduling_options()
+    status, payload, headers = await caption_response(
+        await offload(digest_of, data), data, lane, timeout
+    )
+    await send_json(send, status, payload, headers)
+    return status
+
+
+async def generate_caption_raw(request: Request, send: Callable) -> int:
+    mimetype, _ = parse_options_header(request.headers.get("content-type", ""))
+    if mimetype != "application/octet-stream" and not mimetype.startswith("image/"):
+        raise HTTPError(415, "Content-Type must be application/octet-stream or image/*")
+    lane, timeout = request.scheduling_options()
+    with stage("read"):
+        data = await request.body(MAX_CONTENT_LENGTH)
+    if not data:
+        raise HTTPError(400, "Empty body")
+    status, payload, headers = await caption_response(
+        await offload(digest_of, data), data, lane, timeout
+    )
+    await send_json(send, status, payload, headers)
+    return status
+
+
+async def batch_captions(
+    batch: List[Tuple[int, str, bytes, str]], lane: str, timeout: float
+) -> List[str]:
+    """
+    Captions of a batch of (index, filename, data, digest) jobs, as in
+    app.batch_captions.
+    """
+    captions = [caption_cache.get(digest, len(data)) for _, _, data, digest in batch]
+    missing = [i for i, caption in enumerate(captions) if caption is None]
+    if not missing:
+        return captions
+    sources = {(batch[i][3], lane): batch[i][2] for i in missing}
+
+    async def run(keys: List[Tuple[str, str]]) -> List[str]:
+        images = [sources[key] for key in keys]
+        seeds = [seed_from_bytes(digest) for digest, _ in keys]
+        return await run_inference(
+            lambda: captioner.generate_captions(images, seeds),
+            lane,
+            timeout,
+            measure=False,
+        )
+
+    results = await caption_flight.do_batch(
+        [(batch[i][3], lane) for i in missing], run, timeout
+    )
+    for i, (caption, _) in zip(missing, results):
+        captions[i] = caption
+        if caption.startswith("Caption:"):
+            caption_cache.put(batch[i][3], len(batch[i][2]), caption)
+    return captions
+
+
+async def generate_captions(request: Request, send: Callable) -> int:
+    """Stream one NDJSON line per image, like app.generate_captions."""
+    files = (await request.files(MAX_CONTENT_LENGTH)).get("images")
+    if not files:
+        raise HTTPError(400, "No file part")
+    lane, timeout = request.scheduling_options()
+    try:
+        lane = inference_scheduler.resolve_lane(lane)
+    except UnknownLane as e:
+        raise HTTPError(400, str(e))
+    start_time = time.monotonic()
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson")],
+        }
+    )
+
+    async def send_line(line: Dict) -> None:
+        await send(
+            {
+                "type": "http.response.body",
+                "body": (json.dumps(line) + "\n").encode("utf-8"),
+                "more_body": True,
+            }
+        )
+
+    jobs = []
+    for index, (filename, data) in enumerate(files):
+        if not filename or not allowed_file(filename):
+            await send_line(
+                {"index": index, "filename": filename, "error": "File type not allowed"}
+            )
+        else:
+            jobs.append((index, filename, data, await offload(digest_of, data)))
+
+    batch_size = captioner.buffer_pool.batch_size
+    for start in range(0, len(jobs), batch_size):
+        batch = jobs[start : start + batch_size]
+        batch_start = time.monotonic()
+        try:
+            captions = await batch_captions(batch, lane, timeout)
+            errors = [None] * len(batch)
+        except Exception as e:
+            captions, errors = [None] * len(batch), [str(e)] * len(batch)
+        timings = {
+            "batch_ms": round((time.monotonic() - batch_start) * 1000, 2),
+            "elapsed_ms": round((time.monotonic() - start_time) * 1000, 2),
+        }
+        for (index, filename, _, _), caption, error in zip(batch, captions, errors):
+            line = {"index": index, "filename": filename, "timings": timings}
+            if error is None and caption.startswith("Caption:"):
+                line["caption"] = caption
+            else:
+                line["error"] = error or caption
+            await send_line(line)
+
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+    return 200
+
+
+async def embeddings(request: Request, send: Callable) -> int:
+    """Pooled backbone embeddings, like app.embeddings (options in the query string)."""
+    files = await request.files(MAX_CONTENT_LENGTH)
+    files = files.get("images") or files.get("image")
+    if not files:
+        raise HTTPError(400, "No file part")
+    fmt = request.args.get("format", "base64")
+    if fmt not in EMBEDDING_FORMATS:
+        raise HTTPError(
+            400, f"Unknown format '{fmt}'. Available: {', '.join(EMBEDDING_FORMATS)}"
+        )
+    flags = {
+        name: request.args.get(name, "").lower() in ("1", "true", "yes")
+        for name in ("normalize", "captions")
+    }
+    lane, timeout = request.scheduling_options()
+
+    valid = [
+        i
+        for i, (filename, _) in enumerate(files)
+        if filename and allowed_file(filename)
+    ]
+    sources = [files[i][1] for i in valid]
+    seeds = [seed_from_bytes(await offload(digest_of, data)) for data in sources]
+    try:
+        captions, vectors = await run_inference(
+            lambda: captioner.generate_captions_with_embeddings(sources, seeds),
+            lane,
+            timeout,
+        )
+    except UnknownLane as e:
+        raise HTTPError(400, str(e))
+    except DeadlineExceeded as e:
+        raise HTTPError(504, str(e))
+    except HTTPError:
+        raise
+    except Exception as e:
+        raise HTTPError(500, str(e))
+
+    status, body, headers = await offload(
+        embedding_response,
+        [filename for filename, _ in files],
+        valid,
+        captions,
+        vectors,
+        fmt,
+        flags["normalize"],
+        flags["captions"],
+    )
+    if isinstance(body, dict):
+        await send_json(send, status, body)
+    else:
+        content_type = headers.pop("Content-Type")
+        await send_response(send, status, body, content_type, header_list(headers))
+    return status
+
+
+async def lookup_caption(request: Request, send: Callable) -> int:
+    """Hash-first upload lookup, as in app.lookup_caption."""
+    status, payload, headers = lookup_response(
+        caption_cache,
+        request.args.get("sha256", ""),
+        request.args.get("size"),
+        request.headers.get("if-none-match"),
+        MAX_CONTENT_LENGTH,
+    )
+    if payload is None:
+        await send_response(send, status, b"", "application/json", header_list(headers))
+    else:
+        await send_json(send, status, payload, header_list(headers))
+    return status
+
+
+async def healthz(request: Request, send: Callable) -> None:
+    await send_json(send, 200, {"status": "ok"})
+
+
+async def metrics(request: Request, send: Callable) -> None:
+    payload = {
+        "coalescing": caption_flight.stats(),
+        "scheduler": inference_scheduler.stats(),
+        "limiter": concurrency_limiter.stats(),
+        "caption_cache": caption_cache.stats(),
+        "logging": logging_stats(),
+    }
+    if captioner.near_duplicates is not None:
+        payload["near_duplicates"] = captioner.near_duplicates.stats()
+    await send_json(send, 200, payload)
+
+
+# (method, path) -> handler; the inference routes take a concurrency limiter
+# slot in run_inference, once their body has been received
+ROUTES = {
+    ("GET", "/"): index,
+    ("POST", "/generate_caption"): generate_caption,
+    ("POST", "/generate_caption/raw"): generate_caption_raw,
+    ("GET", "/generate_caption/lookup"): lookup_caption,
+    ("POST", "/generate_captions"): generate_captions,
+    ("POST", "/embeddings"): embeddings,
+    ("GET", "/healthz"): healthz,
+    ("GET", "/metrics"): metrics,
+}
+
+
+async def app(scope: Dict, receive: Callable, send: Callable) -> None:
+    """ASGI application."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                decode_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    request = Request(scope, receive)
+    tokens = start_request(request.headers.get("x-request-id"))
+    request_id = current_request_id().encode("latin-1")
+    started = time.perf_counter()
+    status = 500
+
+    async def send_tagged(message: Dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            message = dict(
+                message,
+                headers=list(message.get("headers", []))
+                + [(b"x-request-id", request_id)],
+            )
+        await send(message)
+
+    try:
+        await dispatch(request, send_tagged)
+    finally:
+        log_access(
+            logger, request.method, request.path, status, time.perf_counter() - started
+        )
+        end_request(tokens)
+
+
+async def dispatch(request: Request, send: Callable) -> None:
+    """Route a request to its handler and answer its HTTPErrors."""
+    handler = ROUTES.get((request.method, request.path))
+    if handler is None:
+        known = any(path == request.path for _, path in ROUTES)
+        await send_json(
+            send,
+            405 if known else 404,
+            {"error": "Method not allowed" if known else "Not found"},
+        )
+        return
+    try:
+        await handler(request, send)
+    except HTTPError as e:
+        await send_json(send, e.status, {"error": str(e)}, e.headers)
+    except ConnectionError:
+        logger.info(f"Client disconnected during {request.method} {request.path}")
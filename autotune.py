@@ -0,0 +1,312 @@
+"""
+Startup autotuner for CPU inference settings.
+
+Benchmarks the backbone on synthetic input over a grid of thread counts,
+memory formats, autograd modes and batch sizes, and caches the fastest
+profile under config.MODEL_DIR keyed by CPU model, core count and torch
+version, so each kind of host is tuned once. Workers starting together
+take turns on a lock file, so only the first one benchmarks and the
+others load its profile.
+"""
+import itertools
+import json
+import logging
+import os
+import platform
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+import torch
+import torch.nn as nn
+
+from config import MODEL_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: workers starting together may each autotune
+    fcntl = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Batch sizes tried once the per-image settings are chosen
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8)
+
+# Settings used when no profile applies
+DEFAULT_PROFILE = {
+    "num_threads": None,
+    "channels_last": False,
+    "inference_mode": False,
+    "batch_size": 1,
+}
+
+
+def cpu_model() -> str:
+    """Get a human readable name of the host CPU."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine() or "unknown-cpu"
+
+
+def cpu_flags() -> List[str]:
+    """Instruction set flags of the host CPU (empty without /proc/cpuinfo)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return line.split(":", 1)[1].split()
+    except OSError:
+        pass
+    return []
+
+
+def bf16_supported(device: torch.device = torch.device("cpu")) -> bool:
+    """Whether the device computes bfloat16 natively (AVX512-BF16 or AMX on x86)."""
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    flags = set(cpu_flags())
+    if platform.machine() in ("arm64", "aarch64"):
+        return "bf16" in flags
+    return bool(flags & {"avx512_bf16", "amx_bf16"})
+
+
+def available_cores() -> int:
+    """Number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def host_key() -> str:
+    """Cache key identifying the CPU model, core count and torch version."""
+    raw = f"{cpu_model()}-{available_cores()}cores-torch{torch.__version__}"
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", raw).strip("_")
+
+
+def profile_path(
+    model_dir: Union[str, Path] = MODEL_DIR, name: Optional[str] = None
+) -> Path:
+    """Location of the cached profile for this host (and backbone `name`, if given)."""
+    suffix = f"-{name}" if name else ""
+    return Path(model_dir) / "autotune" / f"{host_key()}{suffix}.json"
+
+
+def default_thread_counts(cores: Optional[int] = None) -> List[int]:
+    """Thread counts worth trying for a core count: 1, half and all cores."""
+    cores = cores or available_cores()
+    return sorted({1, max(1, cores // 2), cores})
+
+
+def _benchmark(
+    model: nn.Module,
+    batch_size: int,
+    channels_last: bool,
+    inference_mode: bool,
+    input_size: int,
+    warmup: int,
+    iterations: int,
+) -> float:
+    """Median seconds per image for one configuration."""
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    model.to(memory_format=memory_format)
+    x = torch.randn(batch_size, 3, input_size, input_size).contiguous(
+        memory_format=memory_format
+    )
+    context = torch.inference_mode if inference_mode else torch.no_grad
+    timings = []
+    with context():
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            model(x)
+            if i >= warmup:
+                timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] / batch_size
+
+
+def autotune(
+    model: nn.Module,
+    thread_counts: Optional[Sequence[int]] = None,
+    batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+    input_size: int = 224,
+    warmup: int = 1,
+    iterations: int = 3,
+) -> Dict:
+    """
+    Find the fastest inference settings for this host.
+
+    The search is staged to keep start-up short: thread count, memory
+    format and autograd mode are tuned together at batch size 1, then the
+    batch size is tuned with the winning settings.
+
+    Args:
+        model: Backbone in eval mode
+        thread_counts: Intra-op thread counts to try (1, half and all cores by default)
+        batch_sizes: Batch sizes to try
+        input_size: Side of the synthetic square input
+        warmup: Untimed iterations per configuration
+        iterations: Timed iterations per configuration
+
+    Returns:
+        Profile dictionary with the chosen settings and all measurements
+    """
+    original_threads = torch.get_num_threads()
+    thread_counts = list(thread_counts or default_thread_counts())
+    results = []
+    try:
+        best = None
+        for threads, channels_last, inference_mode in itertools.product(
+            thread_counts, (False, True), (False, True)
+        ):
+            torch.set_num_threads(threads)
+            seconds = _benchmark(
+                model, 1, channels_last, inference_mode, input_size, warmup, iterations
+            )
+            entry = {
+                "num_threads": threads,
+                "channels_last": channels_last,
+                "inference_mode": inference_mode,
+                "batch_size": 1,
+                "ms_per_image": seconds * 1000,
+            }
+            results.append(entry)
+            if best is None or entry["ms_per_image"] < best["ms_per_image"]:
+                best = entry
+
+        torch.set_num_threads(best["num_threads"])
+        for batch_size in batch_sizes:
+            if batch_size == 1:
+                continue
+            seconds = _benchmark(
+                model,
+                batch_size,
+                best["channels_last"],
+                best["inference_mode"],
+                input_size,
+                warmup,
+                iterations,
+            )
+            entry = dict(best, batch_size=batch_size, ms_per_image=seconds * 1000)
+            results.append(entry)
+            if entry["ms_per_image"] < best["ms_per_image"]:
+                best = entry
+    finally:
+        torch.set_num_threads(original_threads)
+        model.to(memory_format=torch.contiguous_format)
+
+    profile = {key: best[key] for key in DEFAULT_PROFILE}
+    profile.update(
+        {
+            "ms_per_image": best["ms_per_image"],
+            "host": host_key(),
+            "cores": available_cores(),
+            "torch_version": torch.__version__,
+            "measurements": results,
+        }
+    )
+    logger.info(
+        f"Autotuned inference: {profile['num_threads']} threads, "
+        f"channels_last={profile['channels_last']}, "
+        f"inference_mode={profile['inference_mode']}, "
+        f"batch_size={profile['batch_size']} ({profile['ms_per_image']:.1f} ms/image)"
+    )
+    return profile
+
+
+def load_or_autotune(
+    model: nn.Module,
+    model_dir: Union[str, Path] = MODEL_DIR,
+    name: Optional[str] = None,
+    **kwargs,
+) -> Dict:
+    """
+    Load this host's cached profile, running the autotuner on a cache miss.
+
+    Args:
+        model: Backbone in eval mode
+        model_dir: Directory holding the profile cache
+        name: Backbone name, so each backbone is tuned separately
+        **kwargs: Passed to autotune
+
+    Returns:
+        Profile dictionary
+    """
+    path = profile_path(model_dir, name)
+    profile = _read_profile(path)
+    if profile is not None:
+        return profile
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _profile_lock(path):
+        # Another worker may have tuned this host while we waited
+        profile = _read_profile(path)
+        if profile is not None:
+            return profile
+        profile = autotune(model, **kwargs)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=path.parent, prefix=path.name, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(profile, f, indent=2)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return profile
+
+
+def _read_profile(path: Path) -> Optional[Dict]:
+    """The cached profile at `path`, or None if missing or unreadable."""
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable autotune profile {path}: {e}")
+        return None
+    logger.info(f"Loaded autotune profile from {path}")
+    return profile
+
+
+@contextmanager
+def _profile_lock(path: Path) -> Iterator[None]:
+    """Exclusive lock on <profile>.lock, held across threads and processes."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path.with_name(path.name + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def apply_profile(profile: Dict, model: nn.Module) -> nn.Module:
+    """
+    Apply the process-wide and model settings of a profile.
+
+    Args:
+        profile: Profile from autotune or load_or_autotune
+        model: Backbone to convert to the chosen memory format
+
+    Returns:
+        The model
+    """
+    if profile.get("num_threads"):
+        torch.set_num_threads(profile["num_threads"])
+    if profile.get("channels_last"):
+        model.to(memory_format=torch.channels_last)
+    return model
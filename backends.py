@@ -0,0 +1,390 @@
+"""
+Pluggable inference backends for the Sports Captioner.
+
+A backend turns a batch of preprocessed images into backbone features.
+SportsCaptioner picks one by name from MODEL_CONFIG["backend"], so
+alternative runtimes can be benchmarked without touching the captioner.
+"""
+import copy
+import hashlib
+import inspect
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Type, Union
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from autotune import bf16_supported
+from config import MODEL_DIR
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Values of MODEL_CONFIG["precision"]
+PRECISIONS = ("fp32", "bf16")
+
+# Keyword arguments of torch.compile, for validating backend_options
+COMPILE_ARGUMENTS = set(inspect.signature(torch.compile).parameters) - {"model"}
+
+
+def model_fingerprint(model: nn.Module) -> str:
+    """Short digest of a model's weights, used to key exported artifacts."""
+    hasher = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        hasher.update(name.encode("utf-8"))
+        hasher.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return hasher.hexdigest()[:16]
+
+
+class InferenceBackend:
+    """Interface of an inference backend."""
+
+    #: Name used to select the backend in MODEL_CONFIG["backend"]
+    name = "base"
+
+    def load(self) -> None:
+        """Prepare the backend for inference (export, compile, open sessions)."""
+
+    def warmup(self, batch_sizes: Sequence[int] = (1,), input_size: int = 224) -> None:
+        """
+        Run synthetic batches so the first real request is not slowed down.
+
+        Args:
+            batch_sizes: Batch sizes to warm up
+            input_size: Side of the square model input
+        """
+        for batch_size in batch_sizes:
+            self.run_batch(torch.zeros(batch_size, 3, input_size, input_size))
+        logger.info(
+            f"Warmed up {self.name} backend for batch sizes {list(batch_sizes)}"
+        )
+
+    def run_batch(self, batch: torch.Tensor) -> torch.Tensor:
+        """
+        Compute backbone features for a batch.
+
+        Args:
+            batch: Normalized float tensor of shape (N, 3, H, W)
+
+        Returns:
+            Feature tensor of shape (N, C, h, w)
+        """
+        raise NotImplementedError
+
+
+def to_bf16_weights(model: nn.Module) -> nn.Module:
+    """Copy of a model with convolution and linear weights stored in bfloat16.
+
+    Normalization layers keep fp32 parameters; autocast feeds them bf16
+    activations, which CPU kernels accept with fp32 statistics.
+    """
+    model = copy.deepcopy(model)
+    for module in model.modules():
+        if isinstance(module, (nn.Conv2d, nn.Linear)):
+            module.to(torch.bfloat16)
+    return model
+
+
+def pooled_cosine_similarity(a: torch.Tensor, b: torch.Tensor) -> float:
+    """Smallest per-image cosine similarity between globally pooled feature maps."""
+    return (
+        F.cosine_similarity(a.float().mean(dim=(2, 3)), b.float().mean(dim=(2, 3)))
+        .min()
+        .item()
+    )
+
+
+class TorchBackend(InferenceBackend):
+    """Eager PyTorch execution of the backbone."""
+
+    name = "torch"
+
+    def __init__(
+        self,
+        model: nn.Module,
+        device: torch.device = torch.device("cpu"),
+        channels_last: bool = False,
+        inference_mode: bool = False,
+        precision: str = "fp32",
+        parity_threshold: float = 0.99,
+    ):
+        """
+        Args:
+            model: Backbone in eval mode
+            device: Device the model lives on
+            channels_last: Feed inputs in channels-last layout
+            inference_mode: Use torch.inference_mode instead of no_grad
+            precision: "fp32", or "bf16" for bfloat16 weights and autocast
+                (falls back to fp32 without native support or on a failed parity check)
+            parity_threshold: Smallest acceptable cosine similarity of bf16
+                to fp32 pooled features
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision '{precision}'. Available: {', '.join(PRECISIONS)}"
+            )
+        self.model = model
+        self.device = device
+        self.memory_format = (
+            torch.channels_last if channels_last else torch.contiguous_format
+        )
+        self.inference_mode = inference_mode
+        self.precision = precision
+        self.parity_threshold = parity_threshold
+
+    def load(self) -> None:
+        if self.precision == "bf16":
+            self._enable_bf16()
+
+    def _enable_bf16(self) -> None:
+        """
+        Switch to bf16 weights if the device supports it and features stay
+        close to fp32.
+        """
+        if not bf16_supported(self.device):
+            logger.warning("bf16 is not supported natively on this device; using fp32")
+            self.precision = "fp32"
+            return
+        fp32_model = self.model
+        sample = torch.randn(2, 3, 224, 224, generator=torch.Generator().manual_seed(0))
+        expected = self.run_batch(sample, autocast=False)
+        self.model = to_bf16_weights(fp32_model)
+        similarity = pooled_cosine_similarity(self.run_batch(sample), expected)
+        if similarity < self.parity_threshold:
+            logger.warning(
+                f"bf16 pooled features differ from fp32 (cosine {similarity:.4f} < "
+                f"{self.parity_threshold}); using fp32"
+            )
+            self.model, self.precision = fp32_model, "fp32"
+            return
+        logger.info(
+            "Running the backbone in bf16 "
+            f"(pooled feature cosine vs fp32: {similarity:.4f})"
+        )
+
+    def _context(self):
+        return torch.inference_mode() if self.inference_mode else torch.no_grad()
+
+    def run_batch(self, batch: torch.Tensor, autocast: bool = True) -> torch.Tensor:
+        batch = batch.to(self.device).contiguous(memory_format=self.memory_format)
+        enabled = autocast and self.precision == "bf16"
+        with self._context(), torch.autocast(
+            self.device.type, dtype=torch.bfloat16, enabled=enabled
+        ):
+            features = self.model(batch)
+        return features.float() if enabled else features
+
+
+class CompiledTorchBackend(TorchBackend):
+    """Backbone compiled with torch.compile (TorchInductor) for fused CPU kernels.
+
+    Compiled artifacts are cached under `cache_dir`, so a restart reuses
+    them instead of compiling again. Compilation happens lazily on the
+    first batch of each shape, which is what warmup() is for.
+    """
+
+    name = "torch_compile"
+
+    def __init__(
+        self,
+        model: nn.Module,
+        device: torch.device = torch.device("cpu"),
+        channels_last: bool = False,
+        inference_mode: bool = False,
+        precision: str = "fp32",
+        parity_threshold: float = 0.99,
+        mode: Optional[str] = None,
+        dynamic: Optional[bool] = None,
+        cache_dir: Union[str, Path] = MODEL_DIR / "compile_cache",
+        **compile_options,
+    ):
+        """
+        Args:
+            model: Backbone in eval mode
+            device: Device the model lives on
+            channels_last: Feed inputs in channels-last layout
+            inference_mode: Use torch.inference_mode instead of no_grad
+            precision: "fp32" or "bf16", as for TorchBackend
+            parity_threshold: As for TorchBackend
+            mode: torch.compile mode, e.g. "max-autotune" (default mode if None)
+            dynamic: Compile for dynamic batch sizes (decided by torch if None)
+            cache_dir: Persistent TorchInductor cache directory
+            **compile_options: Further torch.compile arguments, e.g. fullgraph
+                or options
+
+        Raises:
+            TypeError: If an option is not a torch.compile argument
+        """
+        unknown = sorted(set(compile_options) - COMPILE_ARGUMENTS)
+        if unknown:
+            raise TypeError(f"Unknown torch.compile options: {', '.join(unknown)}")
+        super().__init__(
+            model, device, channels_last, inference_mode, precision, parity_threshold
+        )
+        self.mode = mode
+        self.dynamic = dynamic
+        self.cache_dir = Path(cache_dir)
+        self.compile_options = compile_options
+
+    def load(self) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Read by inductor whenever it resolves its cache; applies process-wide
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(self.cache_dir))
+        # Settle the precision in eager mode, then compile the chosen model
+        super().load()
+        self.model = torch.compile(
+            self.model, mode=self.mode, dynamic=self.dynamic, **self.compile_options
+        )
+
+    def warmup(self, batch_sizes: Sequence[int] = (1,), input_size: int = 224) -> None:
+        start = time.perf_counter()
+        super().warmup(batch_sizes, input_size)
+        logger.info(
+            f"Compiled backbone in {time.perf_counter() - start:.1f}s "
+            f"(cache: {os.environ.get('TORCHINDUCTOR_CACHE_DIR')})"
+        )
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime CPU execution of the backbone exported to ONNX."""
+
+    name = "onnxruntime"
+
+    def __init__(
+        self,
+        model: nn.Module,
+        model_dir: Union[str, Path] = MODEL_DIR,
+        onnx_path: Optional[Union[str, Path]] = None,
+        intra_op_threads: Optional[int] = None,
+        input_size: int = 224,
+        device: torch.device = torch.device("cpu"),
+        channels_last: bool = False,
+        inference_mode: bool = False,
+        precision: str = "fp32",
+    ):
+        """
+        Args:
+            model: Backbone in eval mode; exported on first load
+            model_dir: Directory for the exported ONNX file
+            onnx_path: Explicit ONNX file (defaults to one keyed by the weights)
+            intra_op_threads: ONNX Runtime intra-op threads (runtime default if None)
+            input_size: Side of the square input used for export
+            device, channels_last, inference_mode, precision: Options of the
+                torch backends, accepted so MODEL_CONFIG can switch backends;
+                this backend always runs fp32 on the CPU execution provider
+                and says so when they ask for something else
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision '{precision}'. Available: {', '.join(PRECISIONS)}"
+            )
+        if precision != "fp32":
+            logger.warning(
+                f"The onnxruntime backend does not support {precision}; using fp32"
+            )
+        if torch.device(device).type != "cpu":
+            logger.warning(f"The onnxruntime backend runs on the CPU, not {device}")
+        if channels_last:
+            logger.info("channels_last has no effect on the onnxruntime backend")
+        self.model = model
+        self.onnx_path = (
+            Path(onnx_path)
+            if onnx_path
+            else (Path(model_dir) / f"backbone-{model_fingerprint(model)}.onnx")
+        )
+        self.intra_op_threads = intra_op_threads
+        self.input_size = input_size
+        self.session = None
+
+    def export(self) -> Path:
+        """Export the backbone to ONNX with dynamic batch and spatial dimensions.
+
+        The spatial dimensions are dynamic so the padded input of the uint8
+        pipeline's folded backbone runs on the same export path.
+        """
+        self.onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.onnx_path.with_suffix(".onnx.tmp")
+        dummy = torch.zeros(1, 3, self.input_size, self.input_size)
+        # Newer torch defaults to the dynamo exporter; keep the TorchScript one
+        extra = (
+            {"dynamo": False}
+            if "dynamo" in inspect.signature(torch.onnx.export).parameters
+            else {}
+        )
+        torch.onnx.export(
+            copy.deepcopy(self.model).cpu(),
+            dummy,
+            str(tmp_path),
+            input_names=["input"],
+            output_names=["features"],
+            dynamic_axes={
+                "input": {0: "batch", 2: "height", 3: "width"},
+                "features": {0: "batch", 2: "h", 3: "w"},
+            },
+            opset_version=17,
+            **extra,
+        )
+        os.replace(tmp_path, self.onnx_path)
+        logger.info(f"Exported backbone to {self.onnx_path}")
+        return self.onnx_path
+
+    def load(self) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError(
+                "The onnxruntime backend requires the onnxruntime package "
+                "(pip install onnxruntime)"
+            ) from e
+
+        if not self.onnx_path.exists():
+            self.export()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        self.session = ort.InferenceSession(
+            str(self.onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+
+    def run_batch(self, batch: torch.Tensor) -> torch.Tensor:
+        if self.session is None:
+            self.load()
+        inputs = batch.detach().cpu().contiguous().numpy()
+        (features,) = self.session.run(["features"], {"input": inputs})
+        return torch.from_numpy(features)
+
+
+# Backends selectable through MODEL_CONFIG["backend"]
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    TorchBackend.name: TorchBackend,
+    CompiledTorchBackend.name: CompiledTorchBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+
+def create_backend(name: str, model: nn.Module, **kwargs) -> InferenceBackend:
+    """
+    Create and load a backend by name.
+
+    Args:
+        name: Key of BACKENDS
+        model: Backbone in eval mode
+        **kwargs: Backend specific options
+
+    Returns:
+        Loaded backend
+    """
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend '{name}'. Available: {', '.join(BACKENDS)}"
+        )
+    backend = BACKENDS[name](model, **kwargs)
+    backend.load()
+    logger.info(f"Using {name} inference backend")
+    return backend
@@ -0,0 +1,118 @@
+"""
+Eager vs torch.compile latency of the backbone, and the compile cost.
+
+Compile cost is measured in fresh processes: once with an empty
+TorchInductor cache (cold start) and once reusing it (a restart with
+the persistent cache from MODEL_DIR/compile_cache).
+
+Usage:
+    python benchmarks/bench_compile.py [--model resnet50] [--batch-sizes 1 8]
+        [--iterations N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from torchvision import models
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import create_backend  # noqa: E402
+
+
+def make_backbone(name):
+    model = getattr(models, name)(weights=None)
+    return torch.nn.Sequential(*(list(model.children())[:-2])).eval()
+
+
+def median_ms(backend, batch, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        backend.run_batch(batch)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def compile_only(args):
+    """Child process: compile and warm up, print the elapsed seconds as JSON."""
+    start = time.perf_counter()
+    backend = create_backend(
+        "torch_compile",
+        make_backbone(args.model),
+        cache_dir=args.cache_dir,
+        inference_mode=True,
+    )
+    backend.warmup(args.batch_sizes)
+    print(json.dumps({"seconds": time.perf_counter() - start}))
+
+
+def compile_seconds(args, cache_dir):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--compile-only",
+        "--cache-dir",
+        cache_dir,
+        "--model",
+        args.model,
+        "--batch-sizes",
+        *map(str, args.batch_sizes),
+    ]
+    env = dict(os.environ, TORCHINDUCTOR_CACHE_DIR=cache_dir)
+    output = subprocess.run(
+        command, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])["seconds"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", default="resnet50")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--compile-only", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compile_only:
+        compile_only(args)
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = compile_seconds(args, cache_dir)
+        warm = compile_seconds(args, cache_dir)
+        print(
+            f"One-time compile + warmup ({args.model}, batch sizes {args.batch_sizes}):"
+        )
+        print(f"  cold cache {cold:.1f} s, warm cache {warm:.1f} s")
+
+        model = make_backbone(args.model)
+        eager = create_backend("torch", model, inference_mode=True)
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+        compiled = create_backend(
+            "torch_compile", model, cache_dir=cache_dir, inference_mode=True
+        )
+        compiled.warmup(args.batch_sizes)
+
+        print(f"\n{'batch':>6}{'eager ms':>12}{'compiled ms':>14}{'speedup':>10}")
+        for batch_size in args.batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224)
+            eager.run_batch(batch)
+            eager_ms = median_ms(eager, batch, args.iterations)
+            compiled_ms = median_ms(compiled, batch, args.iterations)
+            print(
+                f"{batch_size:>6}{eager_ms:>12.1f}{compiled_ms:>14.1f}"
+                f"{eager_ms / compiled_ms:>9.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Near-duplicate lookup latency and skipped inferences.
+
+Fills a NearDuplicateIndex with random 64-bit hashes (1M by default),
+then times lookups that miss (random queries) and lookups that hit
+(stored hashes with a few bits flipped). It also hashes re-encoded,
+resized and cropped variants of a synthetic photo to show how many of
+them fall within the radius, i.e. how many model runs would be skipped.
+
+Usage:
+    python benchmarks/bench_phash.py [--entries N] [--radius R] [--queries Q]
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.phash import NearDuplicateIndex, dhash, hamming_distance  # noqa: E402
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def encode(image, **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", **kwargs)
+    return buffer.getvalue()
+
+
+def photo_variants(seed=0):
+    """A smooth synthetic photo plus the edits outlets typically apply."""
+    rng = np.random.default_rng(seed)
+    noise = rng.random((9, 16, 3)) * 255
+    image = Image.fromarray(noise.astype(np.uint8)).resize((1600, 900), Image.BICUBIC)
+    image = image.filter(ImageFilter.GaussianBlur(8))
+    width, height = image.size
+    return encode(image, quality=95), {
+        "re-encoded q60": encode(image, quality=60),
+        "resized 50%": encode(image.resize((width // 2, height // 2))),
+        "resized 25%": encode(image.resize((width // 4, height // 4))),
+        "cropped 3%": encode(
+            image.crop((width * 3 // 100, height * 3 // 100, width, height))
+        ),
+        "cropped 10%": encode(image.crop((width // 10, height // 10, width, height))),
+    }
+
+
+def time_lookups(index, queries):
+    timings = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        hits += index.lookup(query) is not None
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return (
+        hits,
+        statistics.median(timings) * 1e6,
+        timings[int(len(timings) * 0.95)] * 1e6,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--radius", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    original, variants = photo_variants()
+    base = dhash(original)
+    start = time.perf_counter()
+    for _ in range(100):
+        dhash(original)
+    print(f"dhash of a 1600x900 JPEG: {(time.perf_counter() - start) * 10:.2f} ms")
+    print(f"\n{'variant':<16}{'distance':>10}{'skipped':>10}")
+    skipped = 0
+    for name, data in variants.items():
+        distance = hamming_distance(base, dhash(data))
+        skipped += distance <= args.radius
+        print(
+            f"{name:<16}{distance:>10}{'yes' if distance <= args.radius else 'no':>10}"
+        )
+    print(
+        f"{skipped}/{len(variants)} variants would skip inference "
+        f"at radius {args.radius}"
+    )
+
+    index = NearDuplicateIndex(radius=args.radius, max_entries=args.entries)
+    stored = [rng.getrandbits(64) for _ in range(args.entries)]
+    start = time.perf_counter()
+    for value in stored:
+        index.add(value, None)
+    print(f"\nIndexed {len(index):,} hashes in {time.perf_counter() - start:.1f} s")
+
+    misses = [rng.getrandbits(64) for _ in range(args.queries)]
+    near = [
+        flip_bits(rng.choice(stored), rng.randint(0, args.radius), rng)
+        for _ in range(args.queries)
+    ]
+    print(f"{'queries':<16}{'hits':>8}{'p50 us':>10}{'p95 us':>10}")
+    for name, queries in (("random", misses), ("near-duplicate", near)):
+        hits, p50, p95 = time_lookups(index, queries)
+        print(f"{name:<16}{hits:>8}{p50:>10.1f}{p95:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
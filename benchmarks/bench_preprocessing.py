@@ -0,0 +1,125 @@
+"""
+Per-stage latency and allocation comparison of the preprocessing paths.
+
+Compares SportsCaptioner's PIL/torchvision transform against the uint8
+pipeline in preprocessing.py. For every stage it reports the median
+latency and the bytes of new image/tensor memory the stage allocates
+(views and writes into preallocated buffers count as zero).
+
+Usage:
+    python benchmarks/bench_preprocessing.py [image_path] [--iterations N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import (  # noqa: E402
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    decode_to_uint8,
+    resize_and_crop_uint8,
+)
+
+
+def allocated_bytes(result, inputs):
+    """Bytes of fresh memory held by a stage result (0 if it shares an input's)."""
+    if isinstance(result, Image.Image):
+        return result.width * result.height * len(result.getbands())
+    if isinstance(result, torch.Tensor):
+        storage = result.untyped_storage()
+        for item in inputs:
+            if (
+                isinstance(item, torch.Tensor)
+                and item.untyped_storage().data_ptr() == storage.data_ptr()
+            ):
+                return 0
+        return storage.nbytes()
+    return 0
+
+
+def run_stages(stages, iterations, preallocated=()):
+    """Run a list of (name, fn) stages, each taking the previous output."""
+    preallocated = list(preallocated)
+    timings = {name: [] for name, _ in stages}
+    allocations = {}
+    for _ in range(iterations):
+        value = None
+        for name, fn in stages:
+            start = time.perf_counter()
+            result = fn(value)
+            timings[name].append(time.perf_counter() - start)
+            allocations[name] = allocated_bytes(result, [value] + preallocated)
+            value = result
+    return [
+        (name, statistics.median(timings[name]) * 1000, allocations[name])
+        for name, _ in stages
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "image",
+        nargs="?",
+        help="Image to preprocess (a synthetic 1920x1080 JPEG by default)",
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    image_path = args.image
+    if image_path is None:
+        image_path = os.path.join(tempfile.mkdtemp(), "synthetic.jpg")
+        pixels = np.random.default_rng(0).integers(
+            0, 256, (1080, 1920, 3), dtype=np.uint8
+        )
+        Image.fromarray(pixels).save(image_path, quality=90)
+
+    resize = transforms.Resize(256)
+    crop = transforms.CenterCrop(224)
+    to_tensor = transforms.ToTensor()
+    normalize = transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    current = [
+        ("decode (PIL)", lambda _: Image.open(image_path).convert("RGB")),
+        ("resize", resize),
+        ("center crop", crop),
+        ("to tensor", to_tensor),
+        ("normalize", normalize),
+        ("unsqueeze", lambda t: t.unsqueeze(0)),
+    ]
+
+    buffer = torch.empty((1, 3, 230, 230)).to(memory_format=torch.channels_last)
+    uint8 = [
+        ("decode (torchvision.io)", lambda _: decode_to_uint8(image_path)),
+        ("resize + crop (uint8)", resize_and_crop_uint8),
+        ("copy into buffer", lambda t: buffer[0, :, 3:227, 3:227].copy_(t)),
+        ("normalize (folded)", lambda t: t),
+    ]
+
+    for title, stages, preallocated in (
+        ("Current transform", current, []),
+        ("uint8 pipeline", uint8, [buffer]),
+    ):
+        results = run_stages(stages, args.iterations, preallocated)
+        print(f"\n{title}")
+        print(f"{'stage':<26}{'median ms':>12}{'allocated KB':>15}")
+        for name, ms, nbytes in results:
+            print(f"{name:<26}{ms:>12.3f}{nbytes / 1024:>15.1f}")
+        print(
+            f"{'total':<26}{sum(r[1] for r in results):>12.3f}"
+            f"{sum(r[2] for r in results) / 1024:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
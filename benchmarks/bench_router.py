@@ -0,0 +1,305 @@
+"""
+Caption cache hit rate of several captioner nodes, routed by content or at random.
+
+Starts --nodes local app.py processes, each with a caption cache of
+--cache-entries images and a randomly initialised backbone, and replays
+the same request sequence twice: once through router.py, which sends
+every image to the node owning its digest, and once spraying requests
+over the nodes at random, as a plain round-robin or random load
+balancer would. The sequence draws uniformly from --images distinct
+JPEGs, so with nodes * cache_entries >= images content routing can keep
+every image cached somewhere, while random routing is bounded by
+cache_entries / images per node.
+
+Nodes are restarted for each policy so both start with cold caches.
+
+Usage:
+    python benchmarks/bench_router.py [--nodes 3] [--images 300] [--requests 1500]
+        [--cache-entries 120] [--concurrency 4] [--load-factor 1.25] [--model resnet18]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from load_test import free_port, synthetic_jpeg  # noqa: E402
+
+from config import ROUTER_CONFIG  # noqa: E402
+
+
+def serve(args):
+    """Child process: a captioner node with a small caption cache."""
+    import logging
+
+    from config import CAPTION_CACHE_CONFIG, MODEL_CONFIG
+
+    MODEL_CONFIG["default_model"] = args.model
+    MODEL_CONFIG["pretrained"] = False
+    CAPTION_CACHE_CONFIG["max_entries"] = args.cache_entries
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app.run(host="127.0.0.1", port=args.port, threaded=True, debug=False)
+
+
+def get_json(url, path, timeout=5):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        connection.close()
+
+
+def start_nodes(args):
+    """Start the node processes and wait until all answer /healthz."""
+    processes, urls = [], []
+    for _ in range(args.nodes):
+        port = free_port()
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--serve",
+            "--port",
+            str(port),
+            "--model",
+            args.model,
+            "--cache-entries",
+            str(args.cache_entries),
+        ]
+        processes.append(
+            subprocess.Popen(
+                command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        )
+        urls.append(f"http://127.0.0.1:{port}")
+    deadline = time.monotonic() + 300
+    for process, url in zip(processes, urls):
+        while True:
+            if process.poll() is not None:
+                stop_nodes(processes)
+                raise RuntimeError(f"Node {url} exited with code {process.returncode}")
+            try:
+                if get_json(url, "/healthz", timeout=1)[0] == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                stop_nodes(processes)
+                raise RuntimeError(f"Node {url} did not start")
+            time.sleep(0.5)
+    return processes, urls
+
+
+def stop_nodes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def start_router(urls, load_factor):
+    """router.py on a free port in this process."""
+    import logging
+
+    from werkzeug.serving import make_server
+
+    from router import Router, create_app
+
+    router = Router(
+        urls,
+        load_factor=load_factor,
+        **{
+            key: ROUTER_CONFIG[key]
+            for key in (
+                "virtual_nodes",
+                "health_interval",
+                "health_timeout",
+                "unhealthy_after",
+                "timeout",
+            )
+        },
+    )
+    router.start()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, create_app(router), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return router, server, f"http://127.0.0.1:{server.server_port}"
+
+
+def replay(sequence, images, targets, concurrency):
+    """
+    Send the image indices in `sequence` to /generate_caption/raw.
+
+    Args:
+        targets: Function of the request number returning the base URL to send to
+
+    Returns:
+        Latencies in seconds and the number of failed requests
+    """
+    latencies, failures = [], [0]
+    position = iter(range(len(sequence)))
+    lock = threading.Lock()
+
+    def client():
+        connections = {}
+        while True:
+            with lock:
+                number = next(position, None)
+            if number is None:
+                break
+            parts = urlsplit(targets(number))
+            connection = connections.get(parts.netloc)
+            if connection is None:
+                connection = connections[parts.netloc] = http.client.HTTPConnection(
+                    parts.hostname, parts.port, timeout=300
+                )
+            start = time.perf_counter()
+            try:
+                connection.request(
+                    "POST",
+                    "/generate_caption/raw",
+                    body=images[sequence[number]],
+                    headers={"Content-Type": "image/jpeg"},
+                )
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connections.pop(parts.netloc)
+                ok = False
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                failures[0] += not ok
+        for connection in connections.values():
+            connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures[0]
+
+
+def run_policy(policy, args, sequence, images):
+    processes, urls = start_nodes(args)
+    router = server = None
+    try:
+        if policy == "content":
+            router, server, router_url = start_router(urls, args.load_factor)
+            targets = lambda number: router_url  # noqa: E731
+        else:
+            rng = random.Random(1)
+            choices = [rng.choice(urls) for _ in sequence]
+            targets = choices.__getitem__
+        start = time.perf_counter()
+        latencies, failures = replay(sequence, images, targets, args.concurrency)
+        elapsed = time.perf_counter() - start
+        caches = [get_json(url, "/metrics")[1]["caption_cache"] for url in urls]
+        # Requests bounded loads sent past the owner of their image
+        spilled = (
+            sum(node["spilled"] for node in router.stats()["nodes"].values())
+            if router
+            else 0
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            router.stop()
+        stop_nodes(processes)
+    hits = sum(cache["hits"] for cache in caches)
+    lookups = hits + sum(cache["misses"] for cache in caches)
+    latencies.sort()
+    return {
+        "policy": policy,
+        "hit_rate": hits / max(1, lookups),
+        "cached_images": sum(cache["entries"] for cache in caches),
+        "entries_per_node": [cache["entries"] for cache in caches],
+        "throughput": len(sequence) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(0.99 * (len(latencies) - 1))] * 1000,
+        "failures": failures,
+        "spilled": spilled,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument(
+        "--images", type=int, default=300, help="Distinct images in the workload"
+    )
+    parser.add_argument("--requests", type=int, default=1500)
+    parser.add_argument(
+        "--cache-entries", type=int, default=120, help="Caption cache size of each node"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--model", default="resnet18", help="Backbone, randomly initialised"
+    )
+    parser.add_argument(
+        "--load-factor",
+        type=float,
+        default=ROUTER_CONFIG["load_factor"],
+        help="Bounded-load factor of the router",
+    )
+    parser.add_argument(
+        "--policies",
+        nargs="+",
+        choices=["content", "random"],
+        default=["content", "random"],
+    )
+    parser.add_argument("--json", help="Write the results as JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    images = [synthetic_jpeg(320, 240, seed) for seed in range(args.images)]
+    rng = random.Random(0)
+    sequence = [rng.randrange(args.images) for _ in range(args.requests)]
+    print(
+        f"{args.nodes} nodes x {args.cache_entries} cached captions, "
+        f"{args.images} distinct images, "
+        f"{args.requests} requests ({len(set(sequence))} distinct), "
+        f"concurrency {args.concurrency}"
+    )
+
+    results = [run_policy(policy, args, sequence, images) for policy in args.policies]
+    print(
+        f"\n{'policy':<10}{'hit rate':>10}{'cached':>8}{'req/s':>8}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'failed':>8}{'spilled':>9}"
+        "  entries per node"
+    )
+    for r in results:
+        print(
+            f"{r['policy']:<10}{r['hit_rate']:>10.1%}{r['cached_images']:>8}"
+            f"{r['throughput']:>8.1f}"
+            f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['failures']:>8}"
+            f"{r['spilled']:>9}  {r['entries_per_node']}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+"""
+Concurrent load generator for the caption HTTP service.
+
+Drives /generate_caption (multipart) or /generate_caption/raw with a mix
+of JPEG sizes and reports throughput, error rates and latency
+percentiles. Two modes:
+
+- closed: --concurrency clients each send a request, wait for the
+  answer and send the next. Latencies are also corrected for
+  coordinated omission (HdrHistogram style): a response slower than the
+  expected interval back-fills the samples the stalled client would have
+  taken meanwhile. The expected interval is --expected-interval-ms, or
+  the mean latency of the run.
+- open: requests are scheduled at a fixed --rate whatever the server
+  does. Corrected latency is measured from the scheduled send time, so
+  time queued behind a slow server counts; uncorrected latency from the
+  actual send.
+
+Without --url a local server is started on a free port with a randomly
+initialised backbone (MODEL_CONFIG["pretrained"] = False), so the test
+runs offline. Images are unique per request unless --repeat-fraction is
+set, so the caption cache and coalescing do not hide the model cost.
+
+Usage:
+    python benchmarks/load_test.py [--mode closed|open] [--concurrency 50] [--rate R]
+        [--duration S] [--sizes 320x240 1280x720] [--endpoint multipart|raw]
+        [--url http://host:port] [--model resnet50] [--hgrm-prefix PATH] [--json PATH]
+"""
+import argparse
+import http.client
+import io
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Percentiles printed in the summary
+SUMMARY_PERCENTILES = (50, 90, 99, 99.9, 100)
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with about 1% value resolution."""
+
+    # Smallest distinguishable latency in seconds
+    LOWEST = 1e-6
+
+    def __init__(self, precision: float = 0.01):
+        self._log_base = math.log1p(precision)
+        self.counts = Counter()
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _bucket(self, value):
+        return int(math.log(max(value, self.LOWEST) / self.LOWEST) / self._log_base)
+
+    def _upper(self, bucket):
+        return self.LOWEST * math.exp((bucket + 1) * self._log_base)
+
+    def record(self, value, count=1):
+        self.counts[self._bucket(value)] += count
+        self.total += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+
+    def record_corrected(self, value, expected_interval):
+        """Record a latency plus the samples a stalled closed-loop client missed."""
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile(self, percent):
+        """Latency at or below which `percent` of samples fall (bucket upper edge)."""
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(percent / 100 * self.total))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._upper(bucket), self.max)
+        return self.max
+
+    def hgrm(self, ticks_per_half_distance=5):
+        """Percentile distribution in HdrHistogram's .hgrm format (values in ms)."""
+        lines = [
+            f"{'Value':>12} {'Percentile':>14} "
+            f"{'TotalCount':>10} {'1/(1-Percentile)':>14}",
+            "",
+        ]
+        buckets = sorted(self.counts)
+        cumulative, seen = [], 0
+        for bucket in buckets:
+            seen += self.counts[bucket]
+            cumulative.append(seen)
+        step, index = 0, 0
+        while self.total:
+            level = 1 - 0.5 ** (step / ticks_per_half_distance)
+            while cumulative[index] < level * self.total:
+                index += 1
+            value = min(self._upper(buckets[index]), self.max) * 1000
+            lines.append(
+                f"{value:12.3f} {level:14.12f} "
+                f"{cumulative[index]:10d} {1 / (1 - level):14.2f}"
+            )
+            if cumulative[index] == self.total:
+                lines.append(f"{self.max * 1000:12.3f} {1.0:14.12f} {self.total:10d}")
+                break
+            step += 1
+        lines.append(
+            f"#[Mean    = {self.mean * 1000:12.3f}, Total count = {self.total:10d}]"
+        )
+        lines.append(f"#[Max     = {self.max * 1000:12.3f}]")
+        return "\n".join(lines) + "\n"
+
+
+def synthetic_jpeg(width, height, seed):
+    """A smooth photo-like JPEG, so decode cost resembles real uploads."""
+    rng = np.random.default_rng(seed)
+    noise = (rng.random((9, 16, 3)) * 255).astype(np.uint8)
+    image = (
+        Image.fromarray(noise)
+        .resize((width, height), Image.BICUBIC)
+        .filter(ImageFilter.GaussianBlur(4))
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class Workload:
+    """Request bodies over a mix of image sizes."""
+
+    def __init__(self, sizes, repeat_fraction=0.0, seed=0):
+        """
+        Args:
+            sizes: (width, height) pairs, picked uniformly per request
+            repeat_fraction: Share of requests that resend an earlier image
+                byte for byte (caption cache hits); the rest get unique bytes
+            seed: Seed of the image choice
+        """
+        self.images = {
+            f"{w}x{h}": synthetic_jpeg(w, h, seed + i) for i, (w, h) in enumerate(sizes)
+        }
+        self.repeat_fraction = repeat_fraction
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self):
+        """Size label and JPEG bytes of the next request."""
+        with self._lock:
+            label = self._rng.choice(list(self.images))
+            repeat = self._rng.random() < self.repeat_fraction
+        data = self.images[label]
+        if not repeat:
+            # Bytes after the JPEG end marker are ignored by decoders but
+            # change the digest
+            data += uuid.uuid4().bytes
+        return label, data
+
+
+class Client:
+    """Keep-alive HTTP connection of one load generator thread."""
+
+    def __init__(self, url, endpoint, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, data):
+        """
+        Send one caption request.
+
+        Returns:
+            Tuple of (status code or 0 for connection errors, Retry-After seconds or 0)
+        """
+        if self.endpoint == "raw":
+            path, headers, body = (
+                "/generate_caption/raw",
+                {"Content-Type": "image/jpeg"},
+                data,
+            )
+        else:
+            boundary = uuid.uuid4().hex
+            body = (
+                (
+                    f"--{boundary}\r\nContent-Disposition: form-data; "
+                    'name="image"; filename="load.jpg"\r\n'
+                    f"Content-Type: image/jpeg\r\n\r\n"
+                ).encode()
+                + data
+                + f"\r\n--{boundary}--\r\n".encode()
+            )
+            path, headers = "/generate_caption", {
+                "Content-Type": f"multipart/form-data; boundary={boundary}"
+            }
+        headers["Content-Length"] = str(len(body))
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout
+                )
+            self.connection.request("POST", path, body, headers)
+            response = self.connection.getresponse()
+            response.read()
+            if (
+                response.getheader("Connection", "").lower() == "close"
+                or response.version == 10
+            ):
+                self.close()
+            retry_after = response.getheader("Retry-After", "0")
+            return response.status, float(retry_after) if retry_after.isdigit() else 0.0
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0, 0.0
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Results:
+    """Thread-safe collection of request outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.statuses = Counter()
+        # Per size label: [(latency from actual send, latency from scheduled send)]
+        self.samples = defaultdict(list)
+
+    def add(self, label, status, latency, scheduled_latency):
+        with self._lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.samples[label].append((latency, scheduled_latency))
+
+
+def run_closed(args, workload, results):
+    """
+    Each of --concurrency clients sends its next request when the
+    previous one is answered.
+
+    Rejected clients back off for the Retry-After the server asks for,
+    like well-behaved mobile clients, unless --ignore-retry-after is set.
+    """
+    deadline = time.monotonic() + args.duration
+
+    def client_loop():
+        client = Client(args.url, args.endpoint, args.timeout)
+        while time.monotonic() < deadline:
+            label, data = workload.next()
+            start = time.monotonic()
+            status, retry_after = client.send(data)
+            latency = time.monotonic() - start
+            results.add(label, status, latency, latency)
+            if retry_after and not args.ignore_retry_after:
+                time.sleep(min(retry_after, max(0.0, deadline - time.monotonic())))
+        client.close()
+
+    threads = [
+        threading.Thread(target=client_loop, daemon=True)
+        for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(args, workload, results):
+    """Schedule requests at a fixed rate; workers pick them up, late if all are busy."""
+    schedule = queue.Queue()
+    start = time.monotonic()
+    total = int(args.rate * args.duration)
+
+    def worker():
+        client = Client(args.url, args.endpoint, args.timeout)
+        while True:
+            scheduled = schedule.get()
+            if scheduled is None:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            label, data = workload.next()
+            sent = time.monotonic()
+            status, _ = client.send(data)
+            done = time.monotonic()
+            results.add(label, status, done - sent, done - scheduled)
+        client.close()
+
+    threads = [
+        threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for i in range(total):
+        schedule.put(start + i / args.rate)
+    for _ in threads:
+        schedule.put(None)
+    for thread in threads:
+        thread.join()
+
+
+def histograms(args, results):
+    """(uncorrected, corrected) histograms per size label and overall."""
+    latencies = [
+        latency for samples in results.samples.values() for latency, _ in samples
+    ]
+    expected = (
+        args.expected_interval_ms / 1000
+        if args.expected_interval_ms
+        else (sum(latencies) / len(latencies) if latencies else 0.0)
+    )
+    per_label = {}
+    for label, samples in sorted(results.samples.items()):
+        raw, corrected = LatencyHistogram(), LatencyHistogram()
+        for latency, scheduled_latency in samples:
+            raw.record(latency)
+            if args.mode == "open":
+                corrected.record(scheduled_latency)
+            else:
+                corrected.record_corrected(latency, expected)
+        per_label[label] = (raw, corrected)
+    overall = (LatencyHistogram(), LatencyHistogram())
+    for raw, corrected in per_label.values():
+        overall[0].merge(raw)
+        overall[1].merge(corrected)
+    return per_label, overall, expected
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args):
+    """Child process: run the Flask app with the requested backbone."""
+    import logging
+
+    from config import MODEL_CONFIG
+
+    MODEL_CONFIG["default_model"] = args.model or MODEL_CONFIG["default_model"]
+    MODEL_CONFIG["pretrained"] = False
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app.run(host="127.0.0.1", port=args.port, threaded=True, debug=False)
+
+
+def start_server(args):
+    """Start a local server and wait until it answers."""
+    port = free_port()
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--serve",
+        "--port",
+        str(port),
+    ]
+    if args.model:
+        command += ["--model", args.model]
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/metrics")
+            if connection.getresponse().status == 200:
+                return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+def print_report(args, results, elapsed):
+    per_label, (raw, corrected), expected = histograms(args, results)
+    requests = sum(results.statuses.values())
+    errors = requests - results.statuses[200]
+    print(
+        f"\n{args.mode} loop, {args.concurrency} clients"
+        + (f", {args.rate:g} req/s offered" if args.mode == "open" else "")
+        + f", {args.endpoint} uploads, {elapsed:.1f} s"
+    )
+    print(
+        f"Requests {requests}, throughput {results.statuses[200] / elapsed:.2f} req/s, "
+        f"errors {errors} ({errors / max(1, requests):.1%})"
+    )
+    print(
+        "Status codes: "
+        + ", ".join(
+            f"{'conn-error' if s == 0 else s}: {n}"
+            for s, n in sorted(results.statuses.items())
+        )
+    )
+    if args.mode == "closed":
+        print(
+            "Coordinated omission correction with expected interval "
+            f"{expected * 1000:.1f} ms"
+        )
+
+    header = "".join(
+        f"{'p' + format(p, 'g') if p < 100 else 'max':>10}" for p in SUMMARY_PERCENTILES
+    )
+    print(f"\n{'latency ms':<24}{'count':>8}{header}")
+    rows = [
+        (f"{label} {kind}", histogram)
+        for label, pair in per_label.items()
+        for kind, histogram in zip(("raw", "corrected"), pair)
+    ]
+    rows += [("all raw", raw), ("all corrected", corrected)]
+    for name, histogram in rows:
+        values = "".join(
+            f"{histogram.percentile(p) * 1000:>10.1f}" for p in SUMMARY_PERCENTILES
+        )
+        print(f"{name:<24}{histogram.total:>8}{values}")
+
+    if args.hgrm_prefix:
+        for kind, histogram in (("raw", raw), ("corrected", corrected)):
+            with open(f"{args.hgrm_prefix}.{kind}.hgrm", "w") as f:
+                f.write(histogram.hgrm())
+        print(
+            f"\nWrote {args.hgrm_prefix}.raw.hgrm and {args.hgrm_prefix}.corrected.hgrm"
+        )
+    if args.json:
+        summary = {
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration_s": elapsed,
+            "requests": requests,
+            "errors": errors,
+            "throughput_rps": results.statuses[200] / elapsed,
+            "statuses": {str(s): n for s, n in results.statuses.items()},
+            "latency_ms": {
+                name: {
+                    f"p{p:g}": histogram.percentile(p) * 1000
+                    for p in SUMMARY_PERCENTILES
+                }
+                for name, histogram in rows
+            },
+        }
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=50,
+        help="Clients (closed) or sender threads (open)",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=10.0, help="Requests per second (open)"
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument(
+        "--warmup", type=float, default=5.0, help="Seconds of unmeasured load first"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=parse_size,
+        nargs="+",
+        default=[(320, 240), (1280, 720), (1920, 1080)],
+    )
+    parser.add_argument("--repeat-fraction", type=float, default=0.0)
+    parser.add_argument("--endpoint", choices=("multipart", "raw"), default="multipart")
+    parser.add_argument(
+        "--ignore-retry-after",
+        action="store_true",
+        help="Closed-loop clients retry rejected requests immediately",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="Client socket timeout in seconds"
+    )
+    parser.add_argument(
+        "--expected-interval-ms",
+        type=float,
+        help="Closed-loop correction interval (default: mean latency)",
+    )
+    parser.add_argument("--url", help="Running server (default: start one locally)")
+    parser.add_argument(
+        "--model", help="Backbone of the local server (default: MODEL_CONFIG)"
+    )
+    parser.add_argument("--server-log", help="File for the local server's output")
+    parser.add_argument(
+        "--hgrm-prefix", help="Write .hgrm percentile distributions for plotting"
+    )
+    parser.add_argument("--json", help="Write a JSON summary")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    workload = Workload(args.sizes, args.repeat_fraction)
+    process = None
+    if args.url is None:
+        process, args.url = start_server(args)
+        print(f"Started local server at {args.url}")
+    run = run_closed if args.mode == "closed" else run_open
+    try:
+        if args.warmup > 0:
+            run(
+                argparse.Namespace(**dict(vars(args), duration=args.warmup)),
+                workload,
+                Results(),
+            )
+        results = Results()
+        start = time.monotonic()
+        run(args, workload, results)
+        print_report(args, results, time.monotonic() - start)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Soak test of the captioner with memory-leak detection.
+
+Captions synthetic images over and over, in-process, mixing file paths
+and encoded bytes, JPEG/PNG/GIF uploads of several sizes and
+unreadable files (error paths leak too). Every --sample-every
+iterations it records the resident set size, the number of open file
+descriptors and the Python heap traced by tracemalloc, and at the end
+prints the top tracemalloc growth by line. Files left for the garbage
+collector to close (ResourceWarning) are counted and fail the run.
+
+The baseline is taken after --warmup iterations, once allocator pools
+and lazily built state have settled. Growth is the median of the last
+samples minus the median of the first ones; the run fails (exit code 1)
+when RSS, descriptor or traced growth exceeds its threshold.
+
+Usage:
+    python benchmarks/soak_test.py [--duration S | --iterations N] [--model resnet18]
+        [--max-rss-growth-mb 64] [--max-fd-growth 0] [--max-traced-growth-mb 8]
+"""
+import argparse
+import gc
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import MODEL_CONFIG  # noqa: E402
+
+# Samples at each end of the run compared for the growth
+EDGE_SAMPLES = 3
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def open_fds():
+    for path in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return 0
+
+
+def make_inputs(directory, sizes, seed=0):
+    """Paths and byte strings of synthetic images, plus unreadable files."""
+    rng = np.random.default_rng(seed)
+    inputs = []
+    for width, height in sizes:
+        noise = (rng.random((9, 16, 3)) * 255).astype(np.uint8)
+        image = (
+            Image.fromarray(noise)
+            .resize((width, height), Image.BICUBIC)
+            .filter(ImageFilter.GaussianBlur(4))
+        )
+        for fmt in ("JPEG", "PNG", "GIF"):
+            path = os.path.join(directory, f"{width}x{height}.{fmt.lower()}")
+            image.save(path, format=fmt)
+            inputs.append(path)
+            buffer = io.BytesIO()
+            image.save(buffer, format=fmt)
+            inputs.append(buffer.getvalue())
+    truncated = os.path.join(directory, "truncated.jpg")
+    with open(inputs[0], "rb") as src, open(truncated, "wb") as dst:
+        dst.write(src.read()[:200])
+    inputs += [truncated, os.path.join(directory, "missing.jpg"), b"not an image"]
+    return inputs
+
+
+class ResourceWarningCounter:
+    """Counts ResourceWarnings (unclosed files) instead of printing them."""
+
+    def __init__(self):
+        self.count = 0
+        self.first = None
+
+    def __enter__(self):
+        self._catcher = warnings.catch_warnings()
+        self._catcher.__enter__()
+        warnings.simplefilter("always", ResourceWarning)
+        original = warnings.showwarning
+
+        def show(message, category, *args, **kwargs):
+            if issubclass(category, ResourceWarning):
+                self.count += 1
+                self.first = self.first or str(message)
+            else:
+                original(message, category, *args, **kwargs)
+
+        warnings.showwarning = show
+        return self
+
+    def __exit__(self, *exc):
+        self._catcher.__exit__(*exc)
+
+
+def growth(samples, key):
+    values = [sample[key] for sample in samples]
+    edge = min(EDGE_SAMPLES, max(1, len(values) // 2))
+    return statistics.median(values[-edge:]) - statistics.median(values[:edge])
+
+
+def sample(iteration, start):
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    return {
+        "iteration": iteration,
+        "elapsed": time.monotonic() - start,
+        "rss": rss_bytes(),
+        "fds": open_fds(),
+        "traced": traced,
+    }
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--duration", type=float, default=300.0, help="Seconds of load after warmup"
+    )
+    parser.add_argument(
+        "--iterations", type=int, help="Batches after warmup (overrides --duration)"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=20, help="Batches before the baseline"
+    )
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument(
+        "--sizes", type=parse_size, nargs="+", default=[(320, 240), (1280, 720)]
+    )
+    parser.add_argument(
+        "--model", default="resnet18", help="Backbone, randomly initialised"
+    )
+    parser.add_argument("--sample-every", type=int, default=10)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64.0)
+    parser.add_argument("--max-fd-growth", type=int, default=0)
+    parser.add_argument("--max-traced-growth-mb", type=float, default=8.0)
+    parser.add_argument(
+        "--no-tracemalloc",
+        action="store_true",
+        help="Skip heap tracing (it slows Python code)",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="tracemalloc growth lines to print"
+    )
+    args = parser.parse_args()
+
+    MODEL_CONFIG["default_model"] = args.model
+    MODEL_CONFIG["pretrained"] = False
+    from sports_captioner import SportsCaptioner
+
+    captioner = SportsCaptioner()
+    rng = random.Random(0)
+
+    unclosed = ResourceWarningCounter()
+    with tempfile.TemporaryDirectory() as directory, unclosed:
+        inputs = make_inputs(directory, args.sizes)
+
+        def run_batch():
+            batch = rng.sample(inputs, min(args.batch_size, len(inputs)))
+            captioner.generate_captions_with_embeddings(
+                batch, [rng.getrandbits(32) for _ in batch]
+            )
+
+        for _ in range(args.warmup):
+            run_batch()
+        if not args.no_tracemalloc:
+            tracemalloc.start()
+        start = time.monotonic()
+        samples = [sample(0, start)]
+        baseline = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+        print(
+            f"{'iteration':>10}{'elapsed s':>11}{'rss MB':>10}"
+            f"{'fds':>6}{'traced MB':>11}"
+        )
+        iteration = 0
+        while (
+            iteration < args.iterations
+            if args.iterations is not None
+            else time.monotonic() - start < args.duration
+        ):
+            run_batch()
+            iteration += 1
+            if iteration % args.sample_every == 0:
+                samples.append(sample(iteration, start))
+                s = samples[-1]
+                print(
+                    f"{iteration:>10}{s['elapsed']:>11.1f}{s['rss'] / 2**20:>10.1f}"
+                    f"{s['fds']:>6}{s['traced'] / 2**20:>11.2f}"
+                )
+        if samples[-1]["iteration"] != iteration:
+            samples.append(sample(iteration, start))
+
+        if baseline is not None:
+            print(f"\nTop {args.top} tracemalloc growth since the baseline:")
+            for stat in tracemalloc.take_snapshot().compare_to(baseline, "lineno")[
+                : args.top
+            ]:
+                print(f"  {stat}")
+
+    images = iteration * args.batch_size
+    print(f"\n{iteration} batches, {images} images in {samples[-1]['elapsed']:.1f} s")
+    checks = [
+        ("RSS growth", growth(samples, "rss") / 2**20, args.max_rss_growth_mb, "MB"),
+        ("open file descriptor growth", growth(samples, "fds"), args.max_fd_growth, ""),
+    ]
+    if baseline is not None:
+        checks.append(
+            (
+                "traced Python heap growth",
+                growth(samples, "traced") / 2**20,
+                args.max_traced_growth_mb,
+                "MB",
+            )
+        )
+    checks.append(("unclosed resources", unclosed.count, 0, ""))
+    failed = False
+    for name, value, limit, unit in checks:
+        ok = value <= limit
+        failed |= not ok
+        print(
+            f"{'ok  ' if ok else 'FAIL'} {name} {value:+.2f}{unit} "
+            f"(limit {limit:g}{unit})"
+        )
+    if unclosed.first:
+        print(f"     first unclosed resource: {unclosed.first}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Learned caption decoder with batched beam search.
+
+A small GRU language model is conditioned on the pooled backbone
+features. Beam search runs as tensor operations over all images x beams
+at once: the GRU hidden state is the incremental cache, so every step
+costs the same regardless of how long the captions already are. Each
+step stores only the chosen tokens and their parent beams, and the
+captions are read back once at the end by following those pointers;
+n-gram blocking compares each hypothesis's last tokens with its
+earlier n-grams in one tensor operation.
+
+Weights are loaded from a local checkpoint; without one the decoder is
+randomly initialised from a fixed seed, which keeps it usable (and
+deterministic) offline, if not eloquent.
+"""
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Union
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Words and punctuation, lowercased
+_TOKEN_PATTERN = re.compile(r"[a-z0-9'-]+|[.,!?]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word and punctuation tokens."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class Vocabulary:
+    """Bidirectional token/id mapping with reserved special tokens."""
+
+    PAD, BOS, EOS, UNK = 0, 1, 2, 3
+    SPECIALS = ("<pad>", "<bos>", "<eos>", "<unk>")
+
+    def __init__(self, tokens: Iterable[str]):
+        """
+        Args:
+            tokens: Vocabulary tokens (specials are added in front)
+        """
+        ordered = dict.fromkeys(t for t in tokens if t not in self.SPECIALS)
+        self.itos: List[str] = list(self.SPECIALS) + list(ordered)
+        self.stoi: Dict[str, int] = {token: i for i, token in enumerate(self.itos)}
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str]) -> "Vocabulary":
+        """Build a sorted vocabulary of every token in the texts."""
+        return cls(sorted({token for text in texts for token in tokenize(text)}))
+
+    def __len__(self) -> int:
+        return len(self.itos)
+
+    def encode(self, text: str) -> List[int]:
+        return [self.stoi.get(token, self.UNK) for token in tokenize(text)]
+
+    def decode(self, ids: Sequence[int]) -> str:
+        """Detokenize ids up to the first end token, skipping specials."""
+        words = []
+        for i in ids:
+            if i == self.EOS:
+                break
+            if i >= len(self.SPECIALS):
+                words.append(self.itos[i])
+        text = re.sub(r" ([.,!?])", r"\1", " ".join(words))
+        return text[:1].upper() + text[1:]
+
+
+class _NgramBlocker:
+    """
+    Tokens each beam hypothesis may not produce next under n-gram blocking.
+
+    Every hypothesis keeps its last n - 1 tokens and the n-grams it has
+    generated as tensors that are reordered along with the beams, so the
+    banned tokens of all hypotheses come from one comparison and one
+    scatter per step, without copying anything back to the host.
+    """
+
+    def __init__(self, n: int, rows: int, max_length: int, vocab_size: int, device):
+        self.n = n
+        self.vocab_size = vocab_size
+        self.suffix = torch.zeros((rows, n - 1), dtype=torch.long, device=device)
+        self.ngrams = torch.zeros(
+            (rows, max(max_length - n + 1, 0), n), dtype=torch.long, device=device
+        )
+        # Tokens generated and n-grams recorded so far, the same for every row
+        self.length = 0
+        self.count = 0
+
+    def ban(self, logprobs: torch.Tensor, neg_inf: float) -> None:
+        """Mask every token that would repeat an n-gram of its hypothesis."""
+        if not self.count:
+            return
+        ngrams = self.ngrams[:, : self.count]
+        match = (ngrams[:, :, :-1] == self.suffix.unsqueeze(1)).all(dim=-1)
+        # N-grams that do not match point at a spare column past the vocabulary
+        index = torch.where(match, ngrams[:, :, -1], self.vocab_size)
+        banned = torch.zeros(
+            (logprobs.size(0), self.vocab_size + 1),
+            dtype=torch.bool,
+            device=logprobs.device,
+        ).scatter_(1, index, True)
+        logprobs.masked_fill_(banned[:, :-1], neg_inf)
+
+    def advance(self, source: torch.Tensor, tokens: torch.Tensor) -> None:
+        """Follow the selected hypotheses to their parents and add their tokens."""
+        ngram = torch.cat([self.suffix.index_select(0, source), tokens[:, None]], 1)
+        if self.count:
+            self.ngrams[:, : self.count] = self.ngrams[:, : self.count].index_select(
+                0, source
+            )
+        self.length += 1
+        if self.length >= self.n:
+            self.ngrams[:, self.count] = ngram
+            self.count += 1
+        self.suffix = ngram[:, 1:]
+
+
+class CaptionDecoder(nn.Module):
+    """GRU caption decoder conditioned on pooled image features."""
+
+    def __init__(
+        self,
+        vocab: Vocabulary,
+        feature_dim: int,
+        embed_dim: int = 128,
+        hidden_dim: int = 256,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            vocab: Output vocabulary
+            feature_dim: Width of the pooled backbone features
+            embed_dim: Token embedding width
+            hidden_dim: GRU state width
+            seed: Seed of the random initialisation
+        """
+        super().__init__()
+        self.vocab = vocab
+        self.feature_dim = feature_dim
+        self.embed_dim = embed_dim
+        self.hidden_dim = hidden_dim
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed)
+            self.init_hidden = nn.Linear(feature_dim, hidden_dim)
+            self.embedding = nn.Embedding(
+                len(vocab), embed_dim, padding_idx=Vocabulary.PAD
+            )
+            self.cell = nn.GRUCell(embed_dim, hidden_dim)
+            self.output = nn.Linear(hidden_dim, len(vocab))
+        self.eval()
+
+    def start(self, features: torch.Tensor) -> torch.Tensor:
+        """Initial hidden state from pooled features of shape (N, feature_dim)."""
+        return torch.tanh(self.init_hidden(features))
+
+    def step(self, tokens: torch.Tensor, hidden: torch.Tensor):
+        """Advance one token: returns (logits, new hidden state)."""
+        hidden = self.cell(self.embedding(tokens), hidden)
+        return self.output(hidden), hidden
+
+    @torch.no_grad()
+    def generate(
+        self,
+        features: torch.Tensor,
+        num_beams: int = 4,
+        max_length: int = 50,
+        no_repeat_ngram_size: int = 0,
+        early_stopping: bool = True,
+        temperature: float = 1.0,
+        length_penalty: float = 1.0,
+    ) -> List[List[int]]:
+        """
+        Beam search over all images at once.
+
+        Finished hypotheses stay in their beam with a frozen score and
+        compete with the live ones, so each image always has `num_beams`
+        hypotheses and the work is one (N * num_beams)-row batch per step.
+
+        Args:
+            features: Pooled features of shape (N, feature_dim)
+            num_beams: Hypotheses kept per image (1 is greedy decoding)
+            max_length: Most tokens generated per caption
+            no_repeat_ngram_size: Forbid repeating any n-gram of this size (0 disables)
+            early_stopping: Stop an image once its best hypothesis has ended,
+                instead of waiting for all its beams to end
+            temperature: Softmax temperature of the token distribution
+            length_penalty: Exponent of the length normalization of final scores
+
+        Returns:
+            Best token ids per image, without the start and end tokens
+        """
+        features = features.float()
+        n_images, beams, vocab_size = features.size(0), num_beams, len(self.vocab)
+        rows = n_images * beams
+        device = features.device
+        neg_inf = float("-inf")
+
+        hidden = self.start(features).repeat_interleave(beams, dim=0)
+        # Only the first beam starts live, so the first step does not pick duplicates
+        scores = torch.full((n_images, beams), neg_inf, device=device)
+        scores[:, 0] = 0.0
+        current = torch.full((rows,), Vocabulary.BOS, dtype=torch.long, device=device)
+        # Token and parent row of every step; the captions are read back once at the end
+        history = torch.full(
+            (max_length, rows), Vocabulary.PAD, dtype=torch.long, device=device
+        )
+        parents = torch.zeros((max_length, rows), dtype=torch.long, device=device)
+        # Produced the end token
+        ended = torch.zeros(rows, dtype=torch.bool, device=device)
+        # Ended, or its image is done
+        frozen = torch.zeros(rows, dtype=torch.bool, device=device)
+        lengths = torch.zeros(rows, dtype=torch.long, device=device)
+        offsets = (torch.arange(n_images, device=device) * beams).unsqueeze(1)
+        blocker = (
+            _NgramBlocker(no_repeat_ngram_size, rows, max_length, vocab_size, device)
+            if no_repeat_ngram_size > 0
+            else None
+        )
+
+        steps = 0
+        for t in range(max_length):
+            logits, new_hidden = self.step(current, hidden)
+            logprobs = F.log_softmax(logits / temperature, dim=-1)
+            if blocker is not None:
+                blocker.ban(logprobs, neg_inf)
+
+            # Frozen hypotheses only extend with padding at no cost
+            logprobs[frozen] = neg_inf
+            logprobs[frozen, Vocabulary.PAD] = 0.0
+
+            candidates = (scores.view(rows, 1) + logprobs).view(
+                n_images, beams * vocab_size
+            )
+            scores, top = candidates.topk(beams, dim=1)
+            source = (offsets + torch.div(top, vocab_size, rounding_mode="floor")).view(
+                -1
+            )
+            current = (top % vocab_size).view(-1)
+
+            hidden = new_hidden[source]
+            ended, frozen, lengths = ended[source], frozen[source], lengths[source]
+            history[t], parents[t] = current, source
+            steps = t + 1
+            if blocker is not None:
+                blocker.advance(source, current)
+            lengths += (~frozen).long()
+            newly_ended = ~frozen & (current == Vocabulary.EOS)
+            ended |= newly_ended
+            frozen |= newly_ended
+
+            # Beams are sorted by score, and live scores only go down
+            ended_by_image = ended.view(n_images, beams)
+            done = (
+                ended_by_image[:, 0]
+                if early_stopping
+                else frozen.view(n_images, beams).all(dim=1)
+            )
+            frozen |= done.repeat_interleave(beams)
+            if bool(done.all()):
+                break
+
+        # Prefer hypotheses that ended properly, ranked by length-normalized score
+        normalized = (
+            scores
+            / lengths.view(n_images, beams).clamp(min=1).float() ** length_penalty
+        )
+        ended_by_image = ended.view(n_images, beams)
+        has_ended = ended_by_image.any(dim=1, keepdim=True)
+        normalized = normalized.masked_fill(has_ended & ~ended_by_image, neg_inf)
+        row = offsets.view(-1) + normalized.argmax(dim=1)
+
+        # Follow the parent pointers back from the best hypotheses
+        ids = torch.empty((n_images, steps), dtype=torch.long, device=device)
+        for t in range(steps - 1, -1, -1):
+            ids[:, t] = history[t, row]
+            row = parents[t, row]
+
+        results = []
+        for caption in ids.tolist():
+            if Vocabulary.EOS in caption:
+                caption = caption[: caption.index(Vocabulary.EOS)]
+            results.append([i for i in caption if i != Vocabulary.PAD])
+        return results
+
+    def generate_text(self, features: torch.Tensor, **gen_kwargs) -> List[str]:
+        """Beam search and detokenize; gen_kwargs as for generate()."""
+        return [self.vocab.decode(ids) for ids in self.generate(features, **gen_kwargs)]
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Save weights together with the vocabulary and sizes."""
+        torch.save(
+            {
+                "vocab": self.vocab.itos[len(Vocabulary.SPECIALS) :],
+                "feature_dim": self.feature_dim,
+                "embed_dim": self.embed_dim,
+                "hidden_dim": self.hidden_dim,
+                "state_dict": self.state_dict(),
+            },
+            path,
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CaptionDecoder":
+        """Load a decoder saved with save()."""
+        checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+        decoder = cls(
+            Vocabulary(checkpoint["vocab"]),
+            checkpoint["feature_dim"],
+            checkpoint["embed_dim"],
+            checkpoint["hidden_dim"],
+        )
+        decoder.load_state_dict(checkpoint["state_dict"])
+        logger.info(f"Loaded caption decoder from {path}")
+        return decoder.eval()
@@ -0,0 +1,193 @@
+"""
+Template caption engine for the Sports Captioner.
+
+Templates are compiled once and the sport terminology is matched with a
+single regular expression. Every request draws from its own seeded NumPy
+generator, so captions are reproducible (and therefore cacheable) and the
+engine can be shared between threads without locking.
+"""
+import hashlib
+import re
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+# Caption templates; {Action} is the capitalized action verb
+CAPTION_TEMPLATES = (
+    "A player is {action} in a {sport} game.",
+    "The {sport} player is {action} the ball.",
+    "{Action} in an intense {sport} match.",
+    "The {sport} team is {action} during the game.",
+    "{emotion} the {sport} player makes a move!",
+)
+
+# Probability of prefixing a caption with an emotional phrase
+EMOTION_PROBABILITY = 0.7
+
+# Random draws per caption: sport, action, template emotion, template,
+# enhancement emotion and the enhancement coin flip
+_DRAWS_PER_CAPTION = 6
+
+Seed = Optional[Union[int, np.random.SeedSequence]]
+
+
+def seed_from_bytes(data: Union[bytes, str]) -> int:
+    """
+    Derive a stable 64-bit seed from content, e.g. an image digest.
+
+    Args:
+        data: Bytes or text identifying the request
+
+    Returns:
+        int: Seed suitable for CaptionEngine
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], "little")
+
+
+class CaptionEngine:
+    """Generates sports captions from precompiled templates."""
+
+    def __init__(
+        self,
+        sports_categories: Sequence[str],
+        action_verbs: Sequence[str],
+        emotion_phrases: Sequence[str],
+        sports_terms: Dict[str, Sequence[str]],
+        templates: Sequence[str] = CAPTION_TEMPLATES,
+        emotion_probability: float = EMOTION_PROBABILITY,
+    ):
+        """
+        Compile the templates and the sport term matcher.
+
+        Args:
+            sports_categories: Sports a caption can mention
+            action_verbs: Verbs describing the action
+            emotion_phrases: Phrases used to add emotion
+            sports_terms: Terminology per sport, in priority order
+            templates: Caption templates with {sport}, {action}, {Action}
+                and {emotion} fields
+            emotion_probability: Chance of prefixing an emotional phrase
+        """
+        self.sports_categories = tuple(sports_categories)
+        self.action_verbs = tuple(action_verbs)
+        self.emotion_phrases = tuple(emotion_phrases)
+        self.emotion_probability = emotion_probability
+        self._templates = tuple(template.format for template in templates)
+        self._choice_sizes = np.array(
+            [
+                len(self.sports_categories),
+                len(self.action_verbs),
+                len(self.emotion_phrases),
+                len(self._templates),
+                len(self.emotion_phrases),
+            ]
+        )
+
+        # One alternation over every term; longer terms first so that e.g.
+        # 'free kick' wins over 'kick'. Terms match as substrings, as before.
+        self._term_sport = {}
+        self._sport_rank = {}
+        for rank, (sport, terms) in enumerate(sports_terms.items()):
+            self._sport_rank[sport] = rank
+            for term in terms:
+                self._term_sport.setdefault(term.lower(), sport)
+        if self._term_sport:
+            alternation = "|".join(
+                re.escape(term)
+                for term in sorted(self._term_sport, key=len, reverse=True)
+            )
+            self._term_pattern = re.compile(f"(?=({alternation}))", re.IGNORECASE)
+        else:
+            self._term_pattern = None
+
+    @staticmethod
+    def make_rng(seed: Seed = None) -> np.random.Generator:
+        """Create an independent generator for one request."""
+        return np.random.default_rng(seed)
+
+    def detect_sport(self, caption: str) -> Optional[str]:
+        """
+        Find the sport whose terminology appears in a caption.
+
+        When terms of several sports match, the sport listed first in
+        sports_terms wins.
+
+        Args:
+            caption: Caption text
+
+        Returns:
+            The detected sport, or None
+        """
+        if self._term_pattern is None:
+            return None
+        sports = {
+            self._term_sport[match.lower()]
+            for match in self._term_pattern.findall(caption)
+        }
+        return min(sports, key=self._sport_rank.__getitem__) if sports else None
+
+    def _finish(self, caption: str, emotion_index: int, add_emotion: bool) -> str:
+        if add_emotion:
+            caption = f"{self.emotion_phrases[emotion_index]} {caption.lower()}"
+        return caption[0].upper() + caption[1:]
+
+    def enhance(self, caption: str, rng: Optional[np.random.Generator] = None) -> str:
+        """
+        Enhance a caption with an emotional phrase and capitalization.
+
+        Args:
+            caption: Caption text
+            rng: Generator to draw from (a fresh unseeded one if omitted)
+
+        Returns:
+            The enhanced caption
+        """
+        rng = rng if rng is not None else self.make_rng()
+        draws = rng.random(2)
+        return self._finish(
+            caption,
+            int(draws[0] * len(self.emotion_phrases)),
+            draws[1] < self.emotion_probability,
+        )
+
+    def generate_batch(self, seeds: Sequence[Seed]) -> List[str]:
+        """
+        Generate one caption per seed.
+
+        All random choices for the batch are drawn up front, one draw
+        vector per request, and turned into template indices with a
+        single vectorized operation.
+
+        Args:
+            seeds: One seed per caption; None draws fresh entropy
+
+        Returns:
+            List of enhanced captions, in the order of the seeds
+        """
+        if not seeds:
+            return []
+        draws = np.stack(
+            [self.make_rng(seed).random(_DRAWS_PER_CAPTION) for seed in seeds]
+        )
+        choices = (draws[:, :5] * self._choice_sizes).astype(np.intp)
+        add_emotion = draws[:, 5] < self.emotion_probability
+
+        captions = []
+        for (sport, action, emotion, template, enhance_emotion), add in zip(
+            choices.tolist(), add_emotion.tolist()
+        ):
+            verb = self.action_verbs[action]
+            caption = self._templates[template](
+                sport=self.sports_categories[sport],
+                action=verb,
+                Action=verb.capitalize(),
+                emotion=self.emotion_phrases[emotion],
+            )
+            captions.append(self._finish(caption, enhance_emotion, add))
+        return captions
+
+    def generate(self, seed: Seed = None) -> str:
+        """Generate a single caption."""
+        return self.generate_batch([seed])[0]
@@ -4,7 +4,7 @@ Configuration settings for the Sports Captioner application.
 This file contains all the configurable parameters for the application.
 """
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, Union
 
 # Base directory
 BASE_DIR = Path(__file__).parent.absolute()
@@ -26,10 +26,50 @@ for directory in [DATA_DIR, MODEL_DIR, LOG_DIR, UPLOAD_FOLDER]:
 
 # Model settings
 MODEL_CONFIG = {
+    # Backbone from model_registry.BACKBONES: resnet18, resnet34, resnet50,
+    # mobilenet_v3_small, mobilenet_v3_large or efficientnet_b0
+    # ("sports-captioner-v1" is an alias of resnet50)
     "default_model": "sports-captioner-v1",
+    # Local state dict of the full torchvision model for offline hosts
+    # (None downloads the pretrained weights into the torch hub cache)
+    "weights_path": None,
+    # False keeps the backbone randomly initialised (offline testing and load tests)
+    "pretrained": True,
+    # Caption length limit and beam width (SportsCaptioner.gen_kwargs)
     "max_length": 128,
     "num_beams": 5,
+    # Softmax temperature of the learned caption decoder
     "temperature": 0.9,
+    # "template" captions, or "beam" for the learned decoder in caption_decoder.py
+    # (beam search driven by SportsCaptioner.gen_kwargs)
+    "caption_decoder": "template",
+    # Decoder checkpoint saved with CaptionDecoder.save (random weights if None)
+    "decoder_weights": None,
+    # Input preprocessing: "pil" (torchvision transforms) or "uint8"
+    # (uint8 decode with normalization folded into the first convolution; the
+    # folded backbone runs on the configured backend, precision and profile)
+    "preprocessing": "pil",
+    # Benchmark thread count, memory format, autograd mode and batch size
+    # on first start and cache the result per host under MODEL_DIR
+    "autotune": False,
+    # Inference backend: "torch" (eager PyTorch), "torch_compile" (TorchInductor,
+    # cached under MODEL_DIR/compile_cache) or "onnxruntime"
+    "backend": "torch",
+    # "fp32", or "bf16" for bfloat16 weights and CPU autocast in the torch
+    # backends (falls back to fp32 without native bf16 or on a parity failure;
+    # onnxruntime warns and runs fp32)
+    "precision": "fp32",
+    # Extra backend arguments, e.g. {"mode": "max-autotune", "fullgraph": True} for
+    # torch_compile (any torch.compile argument; unknown ones are rejected)
+    "backend_options": {},
+    # Batch sizes to run through the backend before serving
+    # (torch_compile defaults to 1 and max_batch_size)
+    "warmup_batch_sizes": [],
+    # Largest number of images run through the backbone at once
+    "max_batch_size": 8,
+    # Reuse the caption of a perceptually near-identical earlier image
+    # (re-encoded, resized, lightly cropped) instead of running the model
+    "near_duplicates": {"enabled": False, "radius": 4, "max_entries": 1_000_000},
 }
 
 # API settings (if applicable)
@@ -39,19 +79,81 @@ API_CONFIG = {
     "debug": True,
 }
 
-# Supported image formats
-SUPPORTED_IMAGE_FORMATS = {
-    ".jpg", ".jpeg", ".png", ".webp", ".bmp"
+# asyncio serving mode (asgi.py)
+ASGI_CONFIG = {
+    "host": "0.0.0.0",
+    "port": 8000,
+    # Threads for multipart parsing and hashing off the event loop
+    "decode_workers": 2,
 }
 
+# Inference scheduling
+SCHEDULER_CONFIG = {
+    # Priority lanes and their scheduling weights, highest priority first
+    "lanes": {"interactive": 4, "batch": 1},
+    # Threads feeding the captioner
+    "workers": 1,
+    # Seconds a request may wait and run before it is abandoned
+    "default_timeout": 30.0,
+    # Largest X-Request-Timeout honoured; longer budgets are clamped to it
+    "max_timeout": 300.0,
+}
+
+# Concurrency limiting of the caption endpoints
+LIMITER_CONFIG = {
+    # "static" (fixed at initial_limit), "aimd" or "gradient"
+    "algorithm": "aimd",
+    "initial_limit": 8,
+    "min_limit": 1,
+    "max_limit": 64,
+    # Seconds; slower responses make the AIMD limit back off
+    "latency_target": 5.0,
+    # Seconds advertised in the Retry-After header of rejected requests
+    "retry_after": 1,
+}
+
+# Captions kept by image digest, for repeat uploads and hash-first lookups
+CAPTION_CACHE_CONFIG = {
+    # Least recently used captions are evicted beyond this many (0 disables)
+    "max_entries": 100_000,
+    # Seconds HTTP caches may reuse a lookup response (Cache-Control max-age)
+    "max_age": 86400,
+}
+
+# Cache-affine routing across captioner nodes (router.py)
+ROUTER_CONFIG = {
+    # Base URLs of the app.py instances behind the router
+    "nodes": [],
+    "host": "127.0.0.1",
+    # Not ASGI_CONFIG["port"], so the router and a node can share a host
+    "port": 8080,
+    # Points per node on the hash ring; more points spread keys more evenly
+    "virtual_nodes": 160,
+    # A node takes at most ceil(load_factor * average in-flight requests)
+    # before its keys spill to the next node on the ring. Lower values even
+    # out hot images sooner but spill more keys, costing cache hits while
+    # few requests are in flight
+    "load_factor": 2.0,
+    # Seconds between GET /healthz probes, and the timeout of each
+    "health_interval": 2.0,
+    "health_timeout": 1.0,
+    # Consecutive failed probes or connections before a node is taken out
+    "unhealthy_after": 2,
+    # Seconds to wait for a node's response
+    "timeout": 120.0,
+}
+
+# Supported image formats
+SUPPORTED_IMAGE_FORMATS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
 # Logging configuration
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
-        "standard": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        },
+        "standard": {"format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"},
+        # One JSON object per line, with request id and stage timings
+        "json": {"()": "structured_logging.JsonFormatter"},
     },
     "handlers": {
         "console": {
@@ -62,7 +164,7 @@ LOGGING_CONFIG = {
         "file": {
             "class": "logging.FileHandler",
             "filename": LOG_DIR / "sports_captioner.log",
-            "formatter": "standard",
+            "formatter": "json",
             "level": "DEBUG",
         },
     },
@@ -75,6 +177,18 @@ LOGGING_CONFIG = {
     },
 }
 
+# Request-path logging (structured_logging.py): the handlers above run on a
+# listener thread, fed through a bounded queue
+LOG_QUEUE_CONFIG = {
+    # Records are dropped (and counted) while this many are waiting
+    "queue_size": 10_000,
+    # Per call site token bucket for records at min_level and above
+    "rate_limit": {"rate": 1.0, "burst": 10, "min_level": "WARNING"},
+    # Share of successful requests logged by the access log
+    "access_sample_rate": 1.0,
+}
+
+
 def get_config() -> Dict[str, Union[str, int, bool, Dict]]:
     """Return the current configuration as a dictionary."""
     return {
@@ -83,4 +197,10 @@ def get_config() -> Dict[str, Union[str, int, bool, Dict]]:
         "debug": DEBUG,
         "model_config": MODEL_CONFIG,
         "api_config": API_CONFIG,
+        "asgi_config": ASGI_CONFIG,
+        "scheduler_config": SCHEDULER_CONFIG,
+        "limiter_config": LIMITER_CONFIG,
+        "caption_cache_config": CAPTION_CACHE_CONFIG,
+        "log_queue_config": LOG_QUEUE_CONFIG,
+        "router_config": ROUTER_CONFIG,
     }
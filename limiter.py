@@ -0,0 +1,189 @@
+"""
+Adaptive concurrency limiting for the caption endpoints.
+
+A ConcurrencyLimiter admits requests while fewer than `limit` are in
+flight and rejects the rest immediately, so overload turns into fast
+503s instead of unbounded queueing. The limit itself is set by a limit
+algorithm from the observed latencies: a fixed limit, AIMD against a
+latency target, or a gradient of long-term to recent latency.
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+
+class StaticLimit:
+    """Fixed concurrency limit."""
+
+    name = "static"
+
+    def __init__(self, initial_limit: int = 8, **kwargs):
+        self.limit = float(initial_limit)
+
+    def update(self, latency: float, in_flight: int, overloaded: bool) -> None:
+        pass
+
+
+class AIMDLimit:
+    """Additive increase, multiplicative decrease against a latency target.
+
+    Each fast response while the limit is well used grows the limit by
+    1/limit (about +1 per limit's worth of requests). A response slower
+    than the target, or one that failed from overload, multiplies it by
+    `backoff`.
+    """
+
+    name = "aimd"
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_target: float = 2.0,
+        backoff: float = 0.9,
+        **kwargs,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+
+    def update(self, latency: float, in_flight: int, overloaded: bool) -> None:
+        if overloaded or latency > self.latency_target:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif in_flight * 2 >= self.limit:
+            # Only grow when the current limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+
+class GradientLimit:
+    """Limit driven by the ratio of long-term to recent latency.
+
+    While recent latency matches the long-term baseline the limit grows
+    by a queue allowance of sqrt(limit); once requests start queueing and
+    recent latency rises above `tolerance` times the baseline, the limit
+    shrinks in proportion.
+    """
+
+    name = "gradient"
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        smoothing: float = 0.2,
+        tolerance: float = 1.5,
+        long_window: int = 600,
+        **kwargs,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.long_decay = 2.0 / (long_window + 1)
+        self.long_latency: Optional[float] = None
+
+    def update(self, latency: float, in_flight: int, overloaded: bool) -> None:
+        if self.long_latency is None:
+            self.long_latency = latency
+        else:
+            self.long_latency += self.long_decay * (latency - self.long_latency)
+        if overloaded:
+            gradient = 0.5
+        else:
+            gradient = max(
+                0.5, min(1.0, self.tolerance * self.long_latency / max(latency, 1e-9))
+            )
+        target = self.limit * gradient + math.sqrt(self.limit)
+        # Do not grow past twice what is actually in use
+        if target > self.limit and in_flight * 2 < self.limit:
+            return
+        smoothed = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, smoothed))
+
+
+# Algorithms selectable through LIMITER_CONFIG["algorithm"]
+LIMIT_ALGORITHMS = {cls.name: cls for cls in (StaticLimit, AIMDLimit, GradientLimit)}
+
+
+class ConcurrencyLimiter:
+    """Admits requests up to an adaptive concurrency limit."""
+
+    def __init__(self, algorithm=None):
+        """
+        Args:
+            algorithm: Limit algorithm (AIMDLimit by default)
+        """
+        self.algorithm = algorithm or AIMDLimit()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._accepted = 0
+        self._rejected = 0
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "ConcurrencyLimiter":
+        """Build a limiter from a LIMITER_CONFIG style dictionary."""
+        options = dict(config)
+        name = options.pop("algorithm", "aimd")
+        options.pop("retry_after", None)
+        if name not in LIMIT_ALGORITHMS:
+            raise ValueError(
+                f"Unknown limit algorithm '{name}'. "
+                f"Available: {', '.join(LIMIT_ALGORITHMS)}"
+            )
+        return cls(LIMIT_ALGORITHMS[name](**options))
+
+    @property
+    def limit(self) -> int:
+        """Current whole-number concurrency limit."""
+        return max(0, int(self.algorithm.limit))
+
+    def try_acquire(self) -> Optional[float]:
+        """
+        Try to admit a request.
+
+        Returns:
+            Start time to pass to release(), or None if the request must be rejected
+        """
+        with self._lock:
+            if self._in_flight >= self.limit:
+                self._rejected += 1
+                return None
+            self._in_flight += 1
+            self._accepted += 1
+        return time.monotonic()
+
+    def release(
+        self, start_time: float, overloaded: bool = False, measure: bool = True
+    ) -> None:
+        """
+        Finish an admitted request and feed its latency to the algorithm.
+
+        Args:
+            start_time: Value returned by try_acquire
+            overloaded: The request failed because the service was overloaded
+            measure: Set to False for requests whose latency says nothing
+                about load (e.g. rejected as invalid)
+        """
+        latency = time.monotonic() - start_time
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            if measure or overloaded:
+                self.algorithm.update(latency, in_flight, overloaded)
+
+    def stats(self) -> Dict[str, float]:
+        """Current limit, in-flight count and admission counters."""
+        with self._lock:
+            return {
+                "algorithm": self.algorithm.name,
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "accepted": self._accepted,
+                "rejected": self._rejected,
+            }
@@ -0,0 +1,168 @@
+"""
+Registry of torchvision backbones for the Sports Captioner.
+
+Each entry knows how to build the architecture, strip its classifier
+down to a spatial feature extractor whose first module is the stem
+convolution, the preprocessing its weights were trained with and the
+number of feature channels it produces. MODEL_CONFIG["default_model"]
+selects the entry; weights come from the torchvision cache or, on
+offline hosts, from a local state dict file.
+"""
+import logging
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+import torch
+import torch.nn as nn
+from torchvision import models
+from torchvision.transforms import InterpolationMode
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class BackboneSpec(NamedTuple):
+    """How to build and feed one backbone."""
+
+    name: str
+    builder: Callable[..., nn.Module]
+    weights: models.WeightsEnum
+    extract: Callable[[nn.Module], nn.Sequential]
+    feature_dim: int
+
+    @property
+    def preprocessing(self):
+        """
+        Preset transform of the weights (resize_size, crop_size, mean, std,
+        interpolation).
+        """
+        return self.weights.transforms()
+
+    @property
+    def resize(self) -> int:
+        return self.preprocessing.resize_size[0]
+
+    @property
+    def crop(self) -> int:
+        return self.preprocessing.crop_size[0]
+
+    @property
+    def mean(self) -> Tuple[float, ...]:
+        return tuple(self.preprocessing.mean)
+
+    @property
+    def std(self) -> Tuple[float, ...]:
+        return tuple(self.preprocessing.std)
+
+    @property
+    def interpolation(self) -> InterpolationMode:
+        return self.preprocessing.interpolation
+
+
+def _resnet_features(model: nn.Module) -> nn.Sequential:
+    # Everything up to (not including) average pooling and the classifier
+    return nn.Sequential(*(list(model.children())[:-2]))
+
+
+def _stem_features(model: nn.Module) -> nn.Sequential:
+    # Flatten the Conv-BN-activation stem so the first module is the Conv2d
+    stem, *blocks = model.features
+    return nn.Sequential(*stem, *blocks)
+
+
+# Backbones selectable through MODEL_CONFIG["default_model"]
+BACKBONES: Dict[str, BackboneSpec] = {
+    spec.name: spec
+    for spec in (
+        BackboneSpec(
+            "resnet18",
+            models.resnet18,
+            models.ResNet18_Weights.DEFAULT,
+            _resnet_features,
+            512,
+        ),
+        BackboneSpec(
+            "resnet34",
+            models.resnet34,
+            models.ResNet34_Weights.DEFAULT,
+            _resnet_features,
+            512,
+        ),
+        BackboneSpec(
+            "resnet50",
+            models.resnet50,
+            models.ResNet50_Weights.DEFAULT,
+            _resnet_features,
+            2048,
+        ),
+        BackboneSpec(
+            "mobilenet_v3_small",
+            models.mobilenet_v3_small,
+            models.MobileNet_V3_Small_Weights.DEFAULT,
+            _stem_features,
+            576,
+        ),
+        BackboneSpec(
+            "mobilenet_v3_large",
+            models.mobilenet_v3_large,
+            models.MobileNet_V3_Large_Weights.DEFAULT,
+            _stem_features,
+            960,
+        ),
+        BackboneSpec(
+            "efficientnet_b0",
+            models.efficientnet_b0,
+            models.EfficientNet_B0_Weights.DEFAULT,
+            _stem_features,
+            1280,
+        ),
+    )
+}
+
+# Older model names kept working
+ALIASES = {
+    "sports-captioner-v1": "resnet50",
+}
+
+
+def get_backbone_spec(name: str) -> BackboneSpec:
+    """
+    Look up a backbone by name or alias.
+
+    Raises:
+        ValueError: If the name is not registered
+    """
+    name = ALIASES.get(name, name)
+    if name not in BACKBONES:
+        raise ValueError(
+            f"Unknown backbone '{name}'. Available: {', '.join(BACKBONES)}"
+        )
+    return BACKBONES[name]
+
+
+def load_backbone(
+    name: str, weights_path: Optional[Union[str, Path]] = None, pretrained: bool = True
+) -> Tuple[nn.Sequential, BackboneSpec]:
+    """
+    Build a backbone feature extractor in eval mode.
+
+    Args:
+        name: Registered backbone name or alias
+        weights_path: Local state dict of the full torchvision model, for
+            hosts that cannot download weights
+        pretrained: Use the torchvision pretrained weights when no
+            weights_path is given (random initialization otherwise)
+
+    Returns:
+        Tuple of (feature extractor, spec)
+    """
+    spec = get_backbone_spec(name)
+    if weights_path is not None:
+        model = spec.builder(weights=None)
+        model.load_state_dict(
+            torch.load(weights_path, map_location="cpu", weights_only=True)
+        )
+        logger.info(f"Loaded {spec.name} weights from {weights_path}")
+    else:
+        model = spec.builder(weights=spec.weights if pretrained else None)
+    return spec.extract(model).eval(), spec
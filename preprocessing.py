@@ -0,0 +1,350 @@
+"""
+Allocation-free preprocessing for the Sports Captioner.
+
+BufferPool hands out preallocated batch tensors that images are written
+into in place, straight from a NumPy view of the PIL pixel data.
+
+The uint8 pipeline goes further: instead of converting every image to
+float before cropping, it decodes straight to a uint8 tensor, resizes
+and crops in uint8, and copies the crop into a preallocated
+channels-last float buffer. The mean/std normalization is folded into the weights and
+bias of the backbone's first convolution, so the raw 0-255 pixels can be
+fed to the model without any per-request normalization pass.
+"""
+import copy
+import threading
+import warnings
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchvision.transforms.functional as TF
+from PIL import Image
+from torchvision.io import ImageReadMode, decode_image, read_file
+
+from utils.image_utils import ImageSource
+
+# ImageNet statistics used by SportsCaptioner.transform
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def normalization_constants(
+    mean: Sequence[float] = IMAGENET_MEAN, std: Sequence[float] = IMAGENET_STD
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Per-channel scale and shift equivalent to ToTensor followed by Normalize.
+
+    ``(x / 255 - mean) / std == x * scale - shift`` with
+    ``scale = 1 / (255 * std)`` and ``shift = mean / std``.
+
+    Returns:
+        Tuple of (scale, shift) tensors of shape (3, 1, 1)
+    """
+    mean_t = torch.tensor(mean, dtype=torch.float32).view(-1, 1, 1)
+    std_t = torch.tensor(std, dtype=torch.float32).view(-1, 1, 1)
+    return 1.0 / (255.0 * std_t), mean_t / std_t
+
+
+def pil_to_tensor_(
+    image: Image.Image, out: torch.Tensor, scale: torch.Tensor, shift: torch.Tensor
+) -> torch.Tensor:
+    """
+    Write a normalized RGB image into an existing (3, H, W) float tensor.
+
+    The pixels are read through a NumPy view of the PIL buffer and
+    converted to float by copy_ directly into `out`; normalization is done
+    in place, so no intermediate tensors are allocated.
+
+    Args:
+        image: RGB image with the same size as `out`
+        out: Destination float tensor, e.g. one slot of a pooled batch
+        scale: Per-channel scale from normalization_constants
+        shift: Per-channel shift from normalization_constants
+
+    Returns:
+        `out`
+    """
+    array = np.asarray(image)
+    with warnings.catch_warnings():
+        # The view is read-only; torch warns even though it is only read
+        warnings.simplefilter("ignore", UserWarning)
+        pixels = torch.from_numpy(array)
+    out.copy_(pixels.permute(2, 0, 1))
+    return out.mul_(scale).sub_(shift)
+
+
+class BufferPool:
+    """Pool of preallocated, fixed-shape batch tensors.
+
+    Buffers are handed out by acquire() and go back to the pool when the
+    block exits, so steady-state preprocessing allocates nothing. The pool
+    grows to the peak number of concurrent users and never shrinks.
+    """
+
+    def __init__(
+        self, batch_size: int = 8, image_size: int = 224, channels_last: bool = False
+    ):
+        """
+        Args:
+            batch_size: Number of images per buffer
+            image_size: Side of the square model input
+            channels_last: Allocate buffers in channels-last layout, which
+                matches the HWC layout of PIL pixels
+        """
+        self.batch_size = batch_size
+        self.shape = (batch_size, 3, image_size, image_size)
+        self.memory_format = (
+            torch.channels_last if channels_last else torch.contiguous_format
+        )
+        self.allocated = 0
+        self._free: List[torch.Tensor] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self) -> Iterator[torch.Tensor]:
+        """Borrow a buffer of shape (batch_size, 3, image_size, image_size)."""
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+            if buffer is None:
+                self.allocated += 1
+        if buffer is None:
+            buffer = torch.empty(
+                self.shape, dtype=torch.float32, memory_format=self.memory_format
+            )
+        try:
+            yield buffer
+        finally:
+            with self._lock:
+                self._free.append(buffer)
+
+
+def decode_to_uint8(source: ImageSource) -> torch.Tensor:
+    """
+    Decode an image file or encoded bytes straight to a uint8 RGB tensor.
+
+    Args:
+        source: Path to an image file or its encoded bytes
+
+    Returns:
+        uint8 tensor of shape (3, H, W)
+    """
+    if isinstance(source, str):
+        data = read_file(source)
+    else:
+        data = torch.frombuffer(bytearray(source), dtype=torch.uint8)
+    return decode_image(data, mode=ImageReadMode.RGB)
+
+
+def resize_and_crop_uint8(
+    image: torch.Tensor,
+    resize: int = 256,
+    crop: int = 224,
+    interpolation: TF.InterpolationMode = TF.InterpolationMode.BILINEAR,
+) -> torch.Tensor:
+    """
+    Resize the shorter side and center crop, staying in uint8.
+
+    Args:
+        image: uint8 tensor of shape (3, H, W)
+        resize: Target length of the shorter side
+        crop: Side of the square center crop
+        interpolation: Resampling filter, the backbone's (BackboneSpec.interpolation)
+
+    Returns:
+        uint8 tensor of shape (3, crop, crop); a view into the resized image
+    """
+    image = TF.resize(image, [resize], interpolation=interpolation, antialias=True)
+    return TF.center_crop(image, [crop])
+
+
+class FoldedInputConv(nn.Module):
+    """First convolution of a backbone with input normalization folded in.
+
+    For a convolution ``w`` applied to ``(x / 255 - mean) / std`` the
+    equivalent convolution on raw pixels ``x`` has weights
+    ``w / (255 * std)`` and bias ``-sum(w * mean / std)``. The identity only
+    holds where the kernel does not overlap the zero padding, so padding is
+    removed from the layer and callers pad the input with the per-channel
+    mean pixel instead (which normalizes to exactly zero).
+    """
+
+    def __init__(
+        self,
+        conv: nn.Conv2d,
+        mean: Sequence[float] = IMAGENET_MEAN,
+        std: Sequence[float] = IMAGENET_STD,
+    ):
+        super().__init__()
+        if conv.padding_mode != "zeros" or isinstance(conv.padding, str):
+            raise ValueError("Only explicitly zero-padded convolutions can be folded")
+        mean_t = torch.tensor(mean, dtype=conv.weight.dtype).view(1, -1, 1, 1)
+        std_t = torch.tensor(std, dtype=conv.weight.dtype).view(1, -1, 1, 1)
+
+        weight = conv.weight.detach() / (255.0 * std_t)
+        bias = -(conv.weight.detach() * (mean_t / std_t)).sum(dim=(1, 2, 3))
+        if conv.bias is not None:
+            bias = bias + conv.bias.detach()
+
+        self.padding = tuple(conv.padding)
+        self.fill = tuple(255.0 * m for m in mean)
+        self.conv = nn.Conv2d(
+            conv.in_channels,
+            conv.out_channels,
+            conv.kernel_size,
+            stride=conv.stride,
+            padding=0,
+            dilation=conv.dilation,
+            groups=conv.groups,
+            bias=True,
+        )
+        self.conv.weight.data.copy_(weight)
+        self.conv.bias.data.copy_(bias)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.conv(x)
+
+    def pad(self, x: torch.Tensor) -> torch.Tensor:
+        """Pad raw pixels with the mean pixel (inputs not built in a padded buffer)."""
+        padded = [
+            F.pad(
+                x[:, c : c + 1],
+                (self.padding[1],) * 2 + (self.padding[0],) * 2,
+                value=v,
+            )
+            for c, v in enumerate(self.fill)
+        ]
+        return torch.cat(padded, dim=1)
+
+
+def fold_normalization(
+    model: nn.Sequential,
+    mean: Sequence[float] = IMAGENET_MEAN,
+    std: Sequence[float] = IMAGENET_STD,
+) -> nn.Sequential:
+    """
+    Copy a backbone and fold the input normalization into its first layer.
+
+    Args:
+        model: Sequential backbone whose first module is a Conv2d
+        mean: Per-channel mean of the normalization
+        std: Per-channel standard deviation of the normalization
+
+    Returns:
+        New Sequential that expects raw, mean-padded 0-255 float input
+    """
+    if not isinstance(model[0], nn.Conv2d):
+        raise ValueError("The first layer of the backbone must be a Conv2d")
+    folded = copy.deepcopy(model)
+    folded[0] = FoldedInputConv(model[0], mean, std)
+    return folded.eval()
+
+
+class UInt8Pipeline:
+    """Preprocess in uint8 into a preallocated buffer and run the folded backbone."""
+
+    def __init__(
+        self,
+        model: nn.Sequential,
+        device: torch.device = torch.device("cpu"),
+        max_batch_size: int = 8,
+        resize: int = 256,
+        crop: int = 224,
+        mean: Sequence[float] = IMAGENET_MEAN,
+        std: Sequence[float] = IMAGENET_STD,
+        backend: Optional[Callable[[nn.Module], Any]] = None,
+        interpolation: TF.InterpolationMode = TF.InterpolationMode.BILINEAR,
+    ):
+        """
+        Fold the normalization into a copy of the model and allocate the input buffer.
+
+        Args:
+            model: Sequential backbone expecting normalized input
+            device: Device to run on
+            max_batch_size: Number of images the buffer holds
+            resize: Target length of the shorter side
+            crop: Side of the square center crop
+            mean: Per-channel mean of the normalization
+            std: Per-channel standard deviation of the normalization
+            backend: Factory wrapping the folded model in an inference backend
+                (see backends.create_backend); eager PyTorch if not given
+            interpolation: Resampling filter of the resize
+        """
+        self.device = device
+        self.resize = resize
+        self.crop = crop
+        self.interpolation = interpolation
+        self.max_batch_size = max_batch_size
+        self.model = (
+            fold_normalization(model, mean, std)
+            .to(device)
+            .to(memory_format=torch.channels_last)
+        )
+        stem = self.model[0]
+        self.pad_h, self.pad_w = stem.padding
+        self.backend = backend(self.model) if backend is not None else None
+
+        # The border is filled with the mean pixel once; only the interior
+        # is ever overwritten by incoming images.
+        self.buffer = torch.empty(
+            (max_batch_size, 3, crop + 2 * self.pad_h, crop + 2 * self.pad_w),
+            dtype=torch.float32,
+        ).to(memory_format=torch.channels_last)
+        for channel, value in enumerate(stem.fill):
+            self.buffer[:, channel].fill_(value)
+        self._lock = threading.Lock()
+
+    def prepare(self, source: ImageSource) -> torch.Tensor:
+        """Decode an image into its resized and cropped uint8 tensor."""
+        return resize_and_crop_uint8(
+            decode_to_uint8(source), self.resize, self.crop, self.interpolation
+        )
+
+    def load(self, index: int, source: Union[ImageSource, torch.Tensor]) -> None:
+        """Write an image, or a crop from prepare(), into slot `index` of the buffer."""
+        image = source if isinstance(source, torch.Tensor) else self.prepare(source)
+        # copy_ converts uint8 to float32 directly into the channels-last slot
+        self.buffer[
+            index,
+            :,
+            self.pad_h : self.pad_h + self.crop,
+            self.pad_w : self.pad_w + self.crop,
+        ].copy_(image)
+
+    def run(self, sources: List[Union[ImageSource, torch.Tensor]]) -> torch.Tensor:
+        """
+        Preprocess a batch of images and compute their backbone features.
+
+        Decoding stops at the first image that fails; callers that need
+        per-image errors decode with prepare() first and pass the crops.
+
+        Args:
+            sources: Image paths, encoded bytes or crops from prepare(),
+                at most max_batch_size
+
+        Returns:
+            Feature tensor of shape (len(sources), C, h, w)
+        """
+        if len(sources) > self.max_batch_size:
+            raise ValueError(f"At most {self.max_batch_size} images per batch")
+        with self._lock:
+            for index, source in enumerate(sources):
+                self.load(index, source)
+            return self._forward(len(sources))
+
+    def warmup(self, batch_sizes: Sequence[int]) -> None:
+        """Run the backbone on the buffer so it compiles before the first request."""
+        with self._lock:
+            for batch_size in batch_sizes:
+                self._forward(min(batch_size, self.max_batch_size))
+
+    def _forward(self, count: int) -> torch.Tensor:
+        # Called with the lock held, so the buffer is not rewritten mid-forward
+        if self.backend is not None:
+            return self.backend.run_batch(self.buffer[:count])
+        batch = self.buffer[:count].to(self.device, non_blocking=True)
+        with torch.inference_mode():
+            return self.model(batch)
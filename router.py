@@ -0,0 +1,594 @@
+"""
+Cache-affine router in front of several captioner nodes.
+
+Every app.py instance keeps its own caption cache keyed by the SHA-256
+of the image bytes. Spread at random, each node ends up caching every
+popular image, so N nodes hold no more distinct captions than one. The
+router instead places the content digest on a consistent-hash ring:
+all uploads of the same bytes, and hash-first lookups of their digest,
+reach the same node, the caches partition the images between them and
+their capacities add up. Adding or removing a node only moves the keys
+of that node.
+
+A single hot image would pin its traffic to one node, so nodes are
+picked by consistent hashing with bounded loads (Mirrokni, Thorup and
+Zadimoghaddam, 2018): a node already serving ceil(load_factor *
+average) requests is passed over for the next node on the ring. A
+background thread probes GET /healthz on every node; nodes failing
+probes or connections leave the ring walk until a probe succeeds.
+Requests that cannot connect to a node are retried on the next one. A
+node that failed after the request was sent is not retried, as it may
+still be working on it: the client gets 504 on a timeout and 502
+otherwise.
+
+Usage:
+    python router.py --nodes http://127.0.0.1:5001 http://127.0.0.1:5002 [--port 8080]
+"""
+import argparse
+import bisect
+import hashlib
+import http.client
+import io
+import logging
+import math
+import threading
+from queue import Empty, Full, LifoQueue
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from flask import Flask, Response, g, jsonify, request
+from werkzeug.formparser import parse_form_data
+
+from config import ROUTER_CONFIG
+from structured_logging import (
+    current_request_id,
+    end_request,
+    setup_logging,
+    start_request,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Connection-level request headers that are not forwarded; Host and
+# Content-Length are set again for the node
+REQUEST_HEADERS_DROPPED = frozenset(
+    {
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+        "host",
+        "content-length",
+    }
+)
+# Connection-level response headers that are not passed back
+RESPONSE_HEADERS_DROPPED = REQUEST_HEADERS_DROPPED - {"content-length"}
+
+# Idle keep-alive connections kept open per node
+MAX_IDLE_CONNECTIONS = 32
+
+# Bytes per read when streaming a node's response back
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class NoHealthyNode(Exception):
+    """Raised when no node is available for a request."""
+
+
+class NodeUnreachable(Exception):
+    """Raised when a node could not be connected to, so the request was not sent."""
+
+
+def ring_point(key: str) -> int:
+    """64-bit position of a key or virtual node on the ring."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes."""
+
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = 160):
+        """
+        Args:
+            nodes: Node names (e.g. base URLs)
+            virtual_nodes: Points per node on the ring
+        """
+        self.virtual_nodes = virtual_nodes
+        self.nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def _build(self) -> None:
+        ring = sorted(
+            (ring_point(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(self.virtual_nodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def add(self, node: str) -> None:
+        if node not in self.nodes:
+            self.nodes.append(node)
+            self._build()
+
+    def remove(self, node: str) -> None:
+        if node in self.nodes:
+            self.nodes.remove(node)
+            self._build()
+
+    def walk(self, key: str) -> Iterator[str]:
+        """Distinct nodes clockwise from the key: its owner, then the fallbacks."""
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, ring_point(key))
+        seen = set()
+        for offset in range(len(self._points)):
+            node = self._owners[(start + offset) % len(self._points)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+    def node_for(self, key: str) -> Optional[str]:
+        """Owner of a key, or None for an empty ring."""
+        return next(self.walk(key), None)
+
+
+class Node:
+    """A captioner instance: its address, health, load and idle connections."""
+
+    def __init__(self, url: str, timeout: float = 120.0):
+        parts = urlsplit(url)
+        self.url = url.rstrip("/")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.healthy = True
+        # Consecutive failed probes or connections
+        self.failures = 0
+        self.in_flight = 0
+        self.routed = 0
+        # Requests this node took because the key's owner was full or down
+        self.spilled = 0
+        self.errors = 0
+        self._idle: LifoQueue = LifoQueue(MAX_IDLE_CONNECTIONS)
+
+    def _connect(self, timeout: Optional[float] = None) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(
+            self.host, self.port, timeout=timeout or self.timeout
+        )
+
+    def _open(self) -> http.client.HTTPConnection:
+        """A new, connected connection."""
+        connection = self._connect()
+        try:
+            connection.connect()
+        except OSError as e:
+            connection.close()
+            raise NodeUnreachable(f"Cannot connect to {self.url}: {e}") from e
+        return connection
+
+    def send(
+        self, method: str, path: str, headers: Dict[str, str], body: Optional[bytes]
+    ) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """
+        Send a request, reusing an idle keep-alive connection if there is one.
+
+        Returns:
+            The connection, to pass to release_connection() once the
+            response has been read, and the response
+
+        Raises:
+            NodeUnreachable: If connecting failed
+            OSError, http.client.HTTPException: If the request failed once sent
+        """
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except Empty:
+            connection, reused = self._open(), False
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            return connection, connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            connection.close()
+            if not reused:
+                raise
+        except OSError:
+            connection.close()
+            raise
+        # The node had closed the idle connection; try once more on a new one
+        connection = self._open()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            return connection, connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+
+    def release_connection(
+        self, connection: http.client.HTTPConnection, reusable: bool
+    ) -> None:
+        """Keep a connection whose response was fully read for the next request."""
+        if reusable:
+            try:
+                self._idle.put_nowait(connection)
+                return
+            except Full:
+                pass
+        connection.close()
+
+    def probe(self, timeout: float) -> bool:
+        """GET /healthz on a fresh connection."""
+        connection = self._connect(timeout)
+        try:
+            connection.request("GET", "/healthz")
+            response = connection.getresponse()
+            response.read()
+            return response.status == 200
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    def stats(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "routed": self.routed,
+            "spilled": self.spilled,
+            "errors": self.errors,
+        }
+
+
+class Router:
+    """Picks a node per content key by consistent hashing with bounded loads."""
+
+    def __init__(
+        self,
+        nodes: Iterable[str],
+        virtual_nodes: int = 160,
+        load_factor: float = 2.0,
+        health_interval: float = 2.0,
+        health_timeout: float = 1.0,
+        unhealthy_after: int = 2,
+        timeout: float = 120.0,
+    ):
+        """
+        Args:
+            nodes: Base URLs of the captioner instances
+            virtual_nodes: Points per node on the hash ring
+            load_factor: A node takes at most ceil(load_factor * average
+                in-flight requests) before its keys spill over (>= 1)
+            health_interval: Seconds between health probes
+            health_timeout: Seconds to wait for a probe
+            unhealthy_after: Consecutive failures that take a node out
+            timeout: Seconds to wait for a node's response
+        """
+        if load_factor < 1:
+            raise ValueError("load_factor must be at least 1")
+        self.nodes = {node.url: node for node in (Node(url, timeout) for url in nodes)}
+        if not self.nodes:
+            raise ValueError("The router needs at least one node")
+        self.ring = HashRing(self.nodes, virtual_nodes)
+        self.load_factor = load_factor
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.unhealthy_after = unhealthy_after
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        self.unavailable = 0
+
+    def acquire(self, key: str, exclude: Iterable[str] = ()) -> Node:
+        """
+        Pick the node for a key and count a request in flight on it.
+
+        The key goes to the first healthy node clockwise from it that is
+        below capacity. Capacity is at least the average load, so some
+        healthy node always qualifies.
+
+        Args:
+            key: Routing key, usually the image's hex SHA-256
+            exclude: URLs of nodes this request already failed on
+
+        Raises:
+            NoHealthyNode: If every node is down or excluded
+        """
+        with self._lock:
+            candidates = {
+                url
+                for url, node in self.nodes.items()
+                if node.healthy and url not in exclude
+            }
+            if not candidates:
+                self.unavailable += 1
+                raise NoHealthyNode("No healthy node available")
+            total = sum(self.nodes[url].in_flight for url in candidates) + 1
+            capacity = math.ceil(self.load_factor * total / len(candidates))
+            for position, url in enumerate(self.ring.walk(key)):
+                node = self.nodes[url]
+                if url in candidates and node.in_flight < capacity:
+                    break
+            node.in_flight += 1
+            node.routed += 1
+            if position:
+                node.spilled += 1
+            return node
+
+    def release(self, node: Node) -> None:
+        with self._lock:
+            node.in_flight -= 1
+
+    def record_failure(self, node: Node) -> None:
+        with self._lock:
+            node.failures += 1
+            if node.healthy and node.failures >= self.unhealthy_after:
+                node.healthy = False
+                logger.warning(
+                    f"Node {node.url} is down after {node.failures} failures"
+                )
+
+    def record_success(self, node: Node) -> None:
+        with self._lock:
+            node.failures = 0
+            if not node.healthy:
+                node.healthy = True
+                logger.info(f"Node {node.url} is back up")
+
+    def forward(
+        self,
+        key: str,
+        method: str,
+        path: str,
+        headers: Dict[str, str],
+        body: Optional[bytes],
+    ) -> Tuple[Node, http.client.HTTPConnection, http.client.HTTPResponse]:
+        """
+        Send a request to the node for its key, failing over along the ring.
+
+        Only connection failures move on to the next node; a node that
+        fails after the request was sent may still be processing it.
+
+        The caller must release() the node and release_connection() the
+        connection once the response has been read.
+
+        Raises:
+            NoHealthyNode: If no node could be reached
+            OSError, http.client.HTTPException: If the node failed after
+                the request was sent
+        """
+        tried = set()
+        while True:
+            node = self.acquire(key, tried)
+            try:
+                connection, response = node.send(method, path, headers, body)
+            except NodeUnreachable as e:
+                self.release(node)
+                with self._lock:
+                    node.errors += 1
+                self.record_failure(node)
+                tried.add(node.url)
+                logger.warning(f"{e}, trying the next node")
+                continue
+            except (OSError, http.client.HTTPException):
+                self.release(node)
+                with self._lock:
+                    node.errors += 1
+                raise
+            return node, connection, response
+
+    def check_health(self) -> None:
+        """Probe every node once."""
+        for node in self.nodes.values():
+            if node.probe(self.health_timeout):
+                self.record_success(node)
+            else:
+                self.record_failure(node)
+
+    def _check_periodically(self) -> None:
+        while not self._stopped.wait(self.health_interval):
+            self.check_health()
+
+    def start(self) -> None:
+        """Probe the nodes, then keep probing them on a background thread."""
+        self.check_health()
+        self._health_thread = threading.Thread(
+            target=self._check_periodically, name="router-health", daemon=True
+        )
+        self._health_thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+
+    def stats(self) -> Dict:
+        """Per-node health and load, and requests no node was available for."""
+        with self._lock:
+            return {
+                "nodes": {url: node.stats() for url, node in self.nodes.items()},
+                "load_factor": self.load_factor,
+                "unavailable": self.unavailable,
+            }
+
+
+def routing_key(path: str, args, body: bytes, environ: Dict) -> str:
+    """
+    Key a request is routed by: the SHA-256 of the uploaded image, the
+    digest of a hash-first lookup, or the whole body for other requests.
+    """
+    if path == "/generate_caption/lookup":
+        return args.get("sha256", "").lower()
+    if path == "/generate_caption" and environ.get("CONTENT_TYPE", "").startswith(
+        "multipart/form-data"
+    ):
+        # Hash the image itself, as the node does, so the multipart and raw
+        # uploads of an image and its lookups all reach the same node
+        _, _, files = parse_form_data(
+            dict(
+                environ,
+                **{"wsgi.input": io.BytesIO(body), "CONTENT_LENGTH": str(len(body))},
+            )
+        )
+        image = files.get("image")
+        if image is not None:
+            return hashlib.sha256(image.read()).hexdigest()
+    if not body:
+        return path
+    return hashlib.sha256(body).hexdigest()
+
+
+def create_app(router: Router) -> Flask:
+    """Flask app proxying every request to the node chosen by `router`."""
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = (
+        16 * 1024 * 1024
+    )  # 16MB max file size, as on the nodes
+
+    @app.route("/healthz", methods=["GET"])
+    def healthz():
+        """Healthy while any node is."""
+        healthy = any(node.healthy for node in router.nodes.values())
+        return (
+            jsonify({"status": "ok" if healthy else "unavailable"}),
+            200 if healthy else 503,
+        )
+
+    @app.route("/router/metrics", methods=["GET"])
+    def metrics():
+        return jsonify(router.stats())
+
+    @app.route("/", defaults={"path": ""}, methods=["GET", "HEAD", "POST"])
+    @app.route("/<path:path>", methods=["GET", "HEAD", "POST"])
+    def proxy(path):
+        body = request.get_data()
+        key = routing_key(request.path, request.args, body, request.environ)
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower()
+            not in REQUEST_HEADERS_DROPPED | {"x-request-id", "x-forwarded-for"}
+        }
+        headers["X-Request-ID"] = current_request_id()
+        headers["X-Forwarded-For"] = ", ".join(
+            filter(None, [request.headers.get("X-Forwarded-For"), request.remote_addr])
+        )
+        try:
+            node, connection, response = router.forward(
+                key,
+                request.method,
+                request.full_path.rstrip("?"),
+                headers,
+                body or None,
+            )
+        except NoHealthyNode as e:
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = str(math.ceil(router.health_interval))
+            return response, 503
+        except TimeoutError:
+            logger.warning(f"Timed out waiting for a node on {request.path}")
+            return jsonify({"error": "The node timed out"}), 504
+        except (OSError, http.client.HTTPException) as e:
+            logger.warning(f"Node failed on {request.path}: {e}")
+            return jsonify({"error": "The node failed to respond"}), 502
+
+        headers = [
+            (name, value)
+            for name, value in response.getheaders()
+            if name.lower() not in RESPONSE_HEADERS_DROPPED
+        ]
+        headers.append(("X-Routed-To", node.url))
+        if not response.chunked:
+            # Read sized responses here, so the node's load drops as soon as it is done
+            try:
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+            finally:
+                router.release(node)
+            node.release_connection(connection, not response.will_close)
+            return Response(data, status=response.status, headers=headers)
+
+        complete = False
+
+        def stream():
+            # Chunked responses (NDJSON batches) are passed on as they arrive
+            nonlocal complete
+            while chunk := response.read1(STREAM_CHUNK_SIZE):
+                yield chunk
+            complete = True
+
+        def finish():
+            # Runs when the server closes the response, even if it was
+            # never iterated (HEAD, client gone before the body)
+            router.release(node)
+            node.release_connection(connection, complete and not response.will_close)
+
+        streamed = Response(stream(), status=response.status, headers=headers)
+        streamed.call_on_close(finish)
+        return streamed
+
+    @app.before_request
+    def begin_request_logging():
+        g.logging_tokens = start_request(request.headers.get("X-Request-ID"))
+
+    @app.teardown_request
+    def end_request_logging(exc):
+        end_request(g.pop("logging_tokens", None))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--nodes",
+        nargs="+",
+        default=ROUTER_CONFIG["nodes"],
+        help="Base URLs of the nodes",
+    )
+    parser.add_argument("--host", default=ROUTER_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=ROUTER_CONFIG["port"])
+    args = parser.parse_args()
+    if not args.nodes:
+        parser.error("no nodes given (--nodes or ROUTER_CONFIG['nodes'])")
+
+    setup_logging()
+    router = Router(
+        args.nodes,
+        **{
+            key: ROUTER_CONFIG[key]
+            for key in (
+                "virtual_nodes",
+                "load_factor",
+                "health_interval",
+                "health_timeout",
+                "unhealthy_after",
+                "timeout",
+            )
+        },
+    )
+    router.start()
+    logger.info(f"Routing to {', '.join(router.nodes)} on port {args.port}")
+    try:
+        create_app(router).run(
+            host=args.host, port=args.port, threaded=True, debug=False
+        )
+    finally:
+        router.stop()
+
+
+if __name__ == "__main__":
+    main()
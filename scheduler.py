@@ -0,0 +1,226 @@
+"""
+Priority lanes and deadline-aware scheduling for inference.
+
+Requests are queued per priority lane and picked by smooth weighted
+round-robin, so a busy low-priority lane (e.g. bulk backfill) only gets
+its share of the model. Requests whose deadline has passed are dropped
+when they reach the front of the queue instead of being run.
+Handlers run in the context (contextvars) of the submitting thread, so
+request ids and stage timings follow the request into the workers.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Deque, Dict, Optional
+
+from structured_logging import record_stage
+from utils.stats import percentile
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Number of recent queue wait times kept per lane for percentiles
+WAIT_SAMPLES = 1024
+
+
+class DeadlineExceeded(Exception):
+    """Raised for requests dropped because their deadline passed while queued."""
+
+
+class UnknownLane(ValueError):
+    """Raised when submitting to a lane that does not exist."""
+
+
+class _Request:
+    __slots__ = ("payload", "deadline", "enqueued", "future", "context")
+
+    def __init__(self, payload: Any, deadline: Optional[float]):
+        self.payload = payload
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.future: Future = Future()
+        self.context = contextvars.copy_context()
+
+
+class _Lane:
+    def __init__(self, name: str, weight: int):
+        self.name = name
+        self.weight = weight
+        self.current = 0
+        self.queue: Deque[_Request] = deque()
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.submitted = 0
+        self.completed = 0
+        self.expired = 0
+
+
+class InferenceScheduler:
+    """Runs a handler on queued requests from weighted priority lanes."""
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Any],
+        lanes: Optional[Dict[str, int]] = None,
+        num_workers: int = 1,
+    ):
+        """
+        Start the worker threads.
+
+        Args:
+            handler: Function run on each request payload
+            lanes: Lane name to scheduling weight, highest priority first
+            num_workers: Number of worker threads calling the handler
+        """
+        self.handler = handler
+        lanes = lanes or {"interactive": 4, "batch": 1}
+        self._lanes = {name: _Lane(name, weight) for name, weight in lanes.items()}
+        self.default_lane = next(iter(self._lanes))
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = [
+            threading.Thread(
+                target=self._work, name=f"inference-worker-{i}", daemon=True
+            )
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def resolve_lane(self, lane: Optional[str] = None) -> str:
+        """
+        Name of the lane a request for `lane` is queued in.
+
+        Raises:
+            UnknownLane: If the lane is not configured
+        """
+        lane = lane or self.default_lane
+        if lane not in self._lanes:
+            raise UnknownLane(
+                f"Unknown priority lane '{lane}'. Available: {', '.join(self._lanes)}"
+            )
+        return lane
+
+    def submit(
+        self, payload: Any, lane: Optional[str] = None, timeout: Optional[float] = None
+    ) -> Future:
+        """
+        Queue a request.
+
+        Args:
+            payload: Passed to the handler
+            lane: Priority lane (the first configured lane by default)
+            timeout: Seconds from now after which the request is dropped
+
+        Returns:
+            Future resolved with the handler result, or with DeadlineExceeded
+        """
+        lane = self.resolve_lane(lane)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        request = _Request(payload, deadline)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            self._lanes[lane].queue.append(request)
+            self._lanes[lane].submitted += 1
+            self._cond.notify()
+        return request.future
+
+    def run(
+        self, payload: Any, lane: Optional[str] = None, timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Queue a request and wait for its result.
+
+        Raises:
+            DeadlineExceeded: If no result is available within `timeout`
+        """
+        future = self.submit(payload, lane, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Drop it from the queue if it has not started yet
+            future.cancel()
+            raise DeadlineExceeded(f"No result within {timeout:.2f}s")
+
+    def _next_lane(self) -> Optional[_Lane]:
+        """Smooth weighted round-robin over the lanes with queued work."""
+        ready = [lane for lane in self._lanes.values() if lane.queue]
+        if not ready:
+            return None
+        total = sum(lane.weight for lane in ready)
+        for lane in ready:
+            lane.current += lane.weight
+        chosen = max(ready, key=lambda lane: lane.current)
+        chosen.current -= total
+        return chosen
+
+    def _take(self) -> Optional[tuple]:
+        """Pop the next live request, expiring stale ones. Caller holds the lock."""
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                return None
+            request = lane.queue.popleft()
+            now = time.monotonic()
+            if request.future.cancelled():
+                lane.expired += 1
+                continue
+            if request.deadline is not None and now >= request.deadline:
+                lane.expired += 1
+                request.future.set_exception(
+                    DeadlineExceeded("Deadline passed while queued")
+                )
+                continue
+            lane.waits.append(now - request.enqueued)
+            request.context.run(record_stage, "queue_wait", now - request.enqueued)
+            return lane, request
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                taken = self._take()
+                while taken is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    taken = self._take()
+            lane, request = taken
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                request.future.set_result(
+                    request.context.run(self.handler, request.payload)
+                )
+            except BaseException as e:
+                request.future.set_exception(e)
+            with self._cond:
+                lane.completed += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-lane counters, queue depth and queue wait percentiles in milliseconds."""
+        with self._cond:
+            return {
+                lane.name: {
+                    "weight": lane.weight,
+                    "queued": len(lane.queue),
+                    "submitted": lane.submitted,
+                    "completed": lane.completed,
+                    "expired": lane.expired,
+                    "wait_p50_ms": percentile(list(lane.waits), 0.50) * 1000,
+                    "wait_p95_ms": percentile(list(lane.waits), 0.95) * 1000,
+                }
+                for lane in self._lanes.values()
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting requests; workers exit once the queues are drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,207 @@
+"""
+Serving state and request helpers shared by the Flask and ASGI apps.
+
+Importing this module has no side effects. get_services() builds the
+captioner (which loads the model), the caption cache, the priority
+scheduler with its worker threads and the concurrency limiter on first
+use, and app.py and asgi.py both take them from there, so a process
+serving either app, or both, holds one runtime.
+"""
+import logging
+import math
+import re
+import threading
+from typing import Optional
+
+import numpy as np
+from werkzeug.http import parse_etags
+
+from config import CAPTION_CACHE_CONFIG, LIMITER_CONFIG, SCHEDULER_CONFIG
+from limiter import ConcurrencyLimiter
+from scheduler import InferenceScheduler
+from sports_captioner import SportsCaptioner
+from utils.embeddings import encode_matrix, l2_normalize, to_base64
+from utils.result_cache import ResultCache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Allowed file extensions
+ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+
+# Largest accepted request body
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+
+
+class Services:
+    """The captioner and the state the request handlers share around it."""
+
+    def __init__(self):
+        # Initialize the captioner
+        self.captioner = SportsCaptioner()
+
+        # Captions by image digest, so repeat content skips inference (and, via
+        # /generate_caption/lookup, the upload itself)
+        self.caption_cache = ResultCache(CAPTION_CACHE_CONFIG["max_entries"])
+
+        # Queues inference by priority lane so bulk traffic cannot starve
+        # interactive users
+        self.inference_scheduler = InferenceScheduler(
+            lambda job: job(),
+            lanes=SCHEDULER_CONFIG["lanes"],
+            num_workers=SCHEDULER_CONFIG["workers"],
+        )
+
+        # Rejects requests beyond an adaptive concurrency limit instead of queueing them
+        self.concurrency_limiter = ConcurrencyLimiter.from_config(LIMITER_CONFIG)
+
+
+_services: Optional[Services] = None
+_services_lock = threading.Lock()
+
+
+def get_services() -> Services:
+    """The process-wide Services, created on first call."""
+    global _services
+    with _services_lock:
+        if _services is None:
+            _services = Services()
+        return _services
+
+
+def allowed_file(filename):
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def parse_timeout(value):
+    """
+    Time budget from an X-Request-Timeout value, clamped to
+    SCHEDULER_CONFIG["max_timeout"].
+
+    Raises:
+        ValueError: If the value is not a finite, positive number of seconds
+    """
+    if value is None:
+        return SCHEDULER_CONFIG["default_timeout"]
+    timeout = float(value)
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise ValueError(f"Invalid timeout: {value}")
+    return min(timeout, SCHEDULER_CONFIG["max_timeout"])
+
+
+def lookup_response(
+    caption_cache, sha256, size=None, if_none_match=None, max_size=MAX_CONTENT_LENGTH
+):
+    """
+    Answer a caption lookup by image digest, shared by the Flask and ASGI apps.
+
+    A hit carries the digest as its ETag and may be cached by HTTP caches;
+    If-None-Match revalidation answers 304. A miss (404) tells the client
+    to upload the image.
+
+    Args:
+        caption_cache: ResultCache of captions by digest
+        sha256: Hex SHA-256 of the image bytes
+        size: Image size in bytes as a string, or None
+        if_none_match: If-None-Match header value, or None
+        max_size: Largest image size accepted for upload
+
+    Returns:
+        Tuple of (status, JSON payload or None for 304, headers)
+    """
+    digest = sha256.lower()
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return 400, {"error": "sha256 must be 64 hex digits"}, {}
+    if size is not None:
+        if not size.isdigit():
+            return 400, {"error": "Invalid size"}, {}
+        size = int(size)
+        if size > max_size:
+            return 413, {"error": "Image too large"}, {}
+
+    caption = caption_cache.get(digest, size)
+    if caption is None:
+        # Not cacheable: the caption exists as soon as the image is uploaded
+        return (
+            404,
+            {
+                "error": "Caption not found, upload the image",
+                "upload": "/generate_caption/raw",
+            },
+            {"Cache-Control": "no-store"},
+        )
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": f"public, max-age={CAPTION_CACHE_CONFIG['max_age']}",
+    }
+    if if_none_match and parse_etags(if_none_match).contains(digest):
+        return 304, None, headers
+    return 200, {"caption": caption, "sha256": digest}, headers
+
+
+def embedding_response(
+    filenames, valid, captions, vectors, fmt, normalize=False, with_captions=False
+):
+    """
+    Build the /embeddings response, shared by the Flask and ASGI apps.
+
+    Args:
+        filenames: Uploaded filenames
+        valid: Indices of the uploads that were run through the model
+        captions, vectors: Results for the valid uploads, in order
+        fmt: Key of EMBEDDING_FORMATS
+
+    Returns:
+        Tuple of (status, JSON dict or raw body, extra headers)
+    """
+    if normalize:
+        vectors = [None if v is None else l2_normalize(v) for v in vectors]
+
+    results = [
+        {"index": i, "filename": name, "error": "File type not allowed"}
+        for i, name in enumerate(filenames)
+    ]
+    for index, caption, vector in zip(valid, captions, vectors):
+        if vector is None:
+            results[index]["error"] = caption
+            continue
+        del results[index]["error"]
+        results[index]["embedding"] = vector
+        if with_captions:
+            results[index]["caption"] = caption
+
+    if fmt != "base64":
+        # Binary formats are a plain (N, D) matrix, so every image must succeed
+        failed = [r["index"] for r in results if "error" in r]
+        if failed:
+            return (
+                422,
+                {"error": "Some images could not be processed", "failed": failed},
+                {},
+            )
+        matrix = np.stack([r["embedding"] for r in results])
+        body, content_type = encode_matrix(matrix, fmt)
+        return (
+            200,
+            body,
+            {
+                "Content-Type": content_type,
+                "X-Embedding-Shape": f"{matrix.shape[0]},{matrix.shape[1]}",
+                "X-Embedding-Dtype": "float16",
+            },
+        )
+
+    dim = next((len(r["embedding"]) for r in results if "embedding" in r), 0)
+    for r in results:
+        if "embedding" in r:
+            r["embedding"] = to_base64(r["embedding"])
+    return (
+        200,
+        {
+            "dtype": "float16",
+            "dim": dim,
+            "normalized": normalize,
+            "embeddings": results,
+        },
+        {},
+    )
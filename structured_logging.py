@@ -0,0 +1,316 @@
+"""
+Non-blocking, structured logging for the request path.
+
+setup_logging() builds the handlers of config.LOGGING_CONFIG and moves
+them behind a bounded queue: request threads only format the message
+and enqueue the record, while a QueueListener thread does the blocking
+console and file writes. When the listener falls behind, records are
+dropped and counted instead of stalling requests.
+
+Records carry the id of the request they were logged for and, through
+stage(), per-stage timings of that request, both kept in context
+variables so they follow the request into scheduler workers and
+asyncio tasks. JsonFormatter writes them as one JSON object per line.
+RateLimitFilter caps repetitive warnings and errors (e.g. a flood of
+bad uploads) per call site and reports how many were suppressed.
+"""
+import atexit
+import json
+import logging
+import logging.config
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from config import LOG_QUEUE_CONFIG, LOGGING_CONFIG
+
+# Id of the request being handled, and its stage timings in milliseconds
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+}
+
+# Longest client-supplied X-Request-ID that is kept
+MAX_REQUEST_ID_LENGTH = 128
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_rate_limiter: Optional["RateLimitFilter"] = None
+
+
+def start_request(request_id: Optional[str] = None) -> Tuple[Token, Token]:
+    """
+    Enter the logging context of a request.
+
+    Args:
+        request_id: Id supplied by the client (e.g. X-Request-ID); a new
+            one is generated if missing or unusable
+
+    Returns:
+        Tokens to pass to end_request()
+    """
+    if (
+        not request_id
+        or len(request_id) > MAX_REQUEST_ID_LENGTH
+        or not request_id.isprintable()
+    ):
+        request_id = uuid.uuid4().hex
+    return _request_id.set(request_id), _timings.set({})
+
+
+def end_request(tokens: Optional[Tuple[Token, Token]]) -> None:
+    """Leave the logging context entered by start_request()."""
+    if tokens is not None:
+        _request_id.reset(tokens[0])
+        _timings.reset(tokens[1])
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add time spent in a stage to the current request's timings."""
+    timings = _timings.get()
+    if timings is not None:
+        key = f"{name}_ms"
+        timings[key] = round(timings.get(key, 0.0) + seconds * 1000, 3)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as a stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def stage_timings() -> Dict[str, float]:
+    """Copy of the current request's stage timings."""
+    return dict(_timings.get() or {})
+
+
+def log_access(
+    logger: logging.Logger, method: str, path: str, status: int, seconds: float
+) -> None:
+    """
+    Log a finished request with its stage timings.
+
+    Server errors are logged as errors and client errors as warnings, so
+    floods of either are rate limited; successes are sampled by
+    LOG_QUEUE_CONFIG["access_sample_rate"].
+    """
+    level = (
+        logging.ERROR
+        if status >= 500
+        else logging.WARNING
+        if status >= 400
+        else logging.INFO
+    )
+    if level == logging.INFO and random.random() >= LOG_QUEUE_CONFIG.get(
+        "access_sample_rate", 1.0
+    ):
+        return
+    logger.log(
+        level,
+        f"{method} {path} {status}",
+        extra={
+            "http": {"method": method, "path": path, "status": status},
+            "duration_ms": round(seconds * 1000, 3),
+            "timings": stage_timings(),
+        },
+    )
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request id (in the logging thread)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site for records at or above a level."""
+
+    def __init__(self, rate: float = 1.0, burst: int = 10, min_level: str = "WARNING"):
+        """
+        Args:
+            rate: Sustained records per second let through per call site
+            burst: Records let through at once before the rate applies
+            min_level: Records below this level are never limited
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.min_level = (
+            logging.getLevelName(min_level) if isinstance(min_level, str) else min_level
+        )
+        # (logger, file, line, level) ->
+        #     [tokens, last refill, suppressed since the last record passed]
+        self._buckets: Dict[Tuple[str, str, int, int], list] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.pathname, record.lineno, record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(
+                float(self.burst), bucket[0] + (now - bucket[1]) * self.rate
+            )
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1.0
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops and counts records when the queue is full."""
+
+    def __init__(self, record_queue: queue.Queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments and render the traceback here, keeping the
+        # message and the traceback apart for the formatters
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room rather than fail when stopping with a full queue
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, request id
+    and extras.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(
+    config: Optional[Dict] = None, queue_config: Optional[Dict] = None
+) -> QueueListener:
+    """
+    Configure logging from LOGGING_CONFIG with the root handlers behind a queue.
+
+    Safe to call more than once; only the first call configures.
+
+    Args:
+        config: logging.config.dictConfig dictionary (LOGGING_CONFIG by default)
+        queue_config: Queue size and rate limits (LOG_QUEUE_CONFIG by default)
+
+    Returns:
+        The running listener
+    """
+    global _listener, _queue_handler, _rate_limiter
+    if _listener is not None:
+        return _listener
+    queue_config = queue_config or LOG_QUEUE_CONFIG
+    logging.config.dictConfig(config or LOGGING_CONFIG)
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    _queue_handler = DroppingQueueHandler(
+        queue.Queue(queue_config.get("queue_size", 10_000))
+    )
+    # Limit first, so suppressed records cost as little as possible
+    _rate_limiter = RateLimitFilter(**queue_config.get("rate_limit", {}))
+    _queue_handler.addFilter(_rate_limiter)
+    _queue_handler.addFilter(RequestContextFilter())
+    root.addHandler(_queue_handler)
+
+    _listener = _Listener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """
+    Flush the queue, stop the listener thread and give the root logger
+    its handlers back, so later records are written directly.
+    """
+    global _listener, _queue_handler, _rate_limiter
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = _queue_handler = _rate_limiter = None
+
+
+def logging_stats() -> Dict[str, int]:
+    """
+    Records waiting in the queue, dropped because it was full, and
+    suppressed by rate limiting.
+    """
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0, "suppressed": 0}
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "suppressed": _rate_limiter.suppressed,
+    }
@@ -1,327 +1,795 @@
-import unittest
+import hashlib
+import io
+import json
 import os
+import sys
 import tempfile
-import json
-from unittest.mock import patch, MagicMock
-import io
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
 from PIL import Image
 
-# Import the Flask app
-import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-from app import app
+# Import the Flask app
+from app import app  # noqa: E402
+from utils.embeddings import from_base64  # noqa: E402
+from utils.result_cache import ResultCache  # noqa: E402
 
 
 class TestFlaskApp(unittest.TestCase):
     """Test cases for the Flask web application."""
-    
+
     def setUp(self):
         """Set up test fixtures before each test method."""
         self.app = app
-        self.app.config['TESTING'] = True
+        self.app.config["TESTING"] = True
         self.client = self.app.test_client()
         self.test_dir = tempfile.mkdtemp()
-        
+        # Captions cached by one test must not answer another
+        cache_patcher = patch("app.caption_cache", ResultCache())
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
     def tearDown(self):
         """Clean up after each test method."""
         if os.path.exists(self.test_dir):
             import shutil
+
             shutil.rmtree(self.test_dir)
-    
-    def create_test_image_file(self, filename="test.jpg", size=(224, 224), color='red'):
+
+    def create_test_image_file(self, filename="test.jpg", size=(224, 224), color="red"):
         """Create a test image file for upload testing."""
         image_path = os.path.join(self.test_dir, filename)
-        image = Image.new('RGB', size, color=color)
+        image = Image.new("RGB", size, color=color)
         image.save(image_path)
         return image_path
-    
+
     def get_image_data(self, image_path):
         """Get image data as bytes for file upload."""
-        with open(image_path, 'rb') as f:
+        with open(image_path, "rb") as f:
             return io.BytesIO(f.read())
-    
+
     def test_index_page_loads(self):
         """Test that the index page loads successfully."""
-        response = self.client.get('/')
+        response = self.client.get("/")
         self.assertEqual(response.status_code, 200)
-        self.assertIn(b'html', response.data.lower())
-    
+        self.assertIn(b"html", response.data.lower())
+
     def test_allowed_file_function(self):
         """Test the allowed file validation function."""
         from app import allowed_file
-        
+
         # Test allowed extensions
-        self.assertTrue(allowed_file('test.jpg'))
-        self.assertTrue(allowed_file('test.jpeg'))
-        self.assertTrue(allowed_file('test.png'))
-        self.assertTrue(allowed_file('test.gif'))
-        
+        self.assertTrue(allowed_file("test.jpg"))
+        self.assertTrue(allowed_file("test.jpeg"))
+        self.assertTrue(allowed_file("test.png"))
+        self.assertTrue(allowed_file("test.gif"))
+
         # Test uppercase extensions
-        self.assertTrue(allowed_file('test.JPG'))
-        self.assertTrue(allowed_file('test.PNG'))
-        
+        self.assertTrue(allowed_file("test.JPG"))
+        self.assertTrue(allowed_file("test.PNG"))
+
         # Test disallowed extensions
-        self.assertFalse(allowed_file('test.txt'))
-        self.assertFalse(allowed_file('test.pdf'))
-        self.assertFalse(allowed_file('test.mp4'))
-        
+        self.assertFalse(allowed_file("test.txt"))
+        self.assertFalse(allowed_file("test.pdf"))
+        self.assertFalse(allowed_file("test.mp4"))
+
         # Test files without extensions
-        self.assertFalse(allowed_file('test'))
-        self.assertFalse(allowed_file('test.'))
-    
-    @patch('app.captioner.generate_caption')
+        self.assertFalse(allowed_file("test"))
+        self.assertFalse(allowed_file("test."))
+
+    @patch("app.captioner.generate_caption")
     def test_generate_caption_success(self, mock_generate):
         """Test successful caption generation."""
         # Mock the caption generation
         mock_generate.return_value = "A spectacular moment as the player scores!"
-        
+
         # Create test image
         image_path = self.create_test_image_file()
         image_data = self.get_image_data(image_path)
-        
+
         # Make POST request
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (image_data, 'test.jpg')},
-                                  content_type='multipart/form-data')
-        
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (image_data, "test.jpg")},
+            content_type="multipart/form-data",
+        )
+
         self.assertEqual(response.status_code, 200)
         response_data = json.loads(response.data)
-        self.assertIn('caption', response_data)
-        self.assertEqual(response_data['caption'], "A spectacular moment as the player scores!")
-    
+        self.assertIn("caption", response_data)
+        self.assertEqual(
+            response_data["caption"], "A spectacular moment as the player scores!"
+        )
+
     def test_generate_caption_no_file(self):
         """Test caption generation when no file is provided."""
-        response = self.client.post('/generate_caption', 
-                                  data={},
-                                  content_type='multipart/form-data')
-        
+        response = self.client.post(
+            "/generate_caption", data={}, content_type="multipart/form-data"
+        )
+
         self.assertEqual(response.status_code, 400)
         response_data = json.loads(response.data)
-        self.assertIn('error', response_data)
-        self.assertEqual(response_data['error'], 'No file part')
-    
+        self.assertIn("error", response_data)
+        self.assertEqual(response_data["error"], "No file part")
+
     def test_generate_caption_empty_filename(self):
         """Test caption generation with empty filename."""
-        image_data = io.BytesIO(b'fake image data')
-        
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (image_data, '')},
-                                  content_type='multipart/form-data')
-        
+        image_data = io.BytesIO(b"fake image data")
+
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (image_data, "")},
+            content_type="multipart/form-data",
+        )
+
         self.assertEqual(response.status_code, 400)
         response_data = json.loads(response.data)
-        self.assertIn('error', response_data)
-        self.assertEqual(response_data['error'], 'No selected file')
-    
+        self.assertIn("error", response_data)
+        self.assertEqual(response_data["error"], "No selected file")
+
     def test_generate_caption_invalid_file_type(self):
         """Test caption generation with invalid file type."""
         # Create a text file instead of image
-        text_data = io.BytesIO(b'This is not an image file')
-        
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (text_data, 'test.txt')},
-                                  content_type='multipart/form-data')
-        
+        text_data = io.BytesIO(b"This is not an image file")
+
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (text_data, "test.txt")},
+            content_type="multipart/form-data",
+        )
+
         self.assertEqual(response.status_code, 400)
         response_data = json.loads(response.data)
-        self.assertIn('error', response_data)
-        self.assertEqual(response_data['error'], 'File type not allowed')
-    
-    @patch('app.captioner.generate_caption')
+        self.assertIn("error", response_data)
+        self.assertEqual(response_data["error"], "File type not allowed")
+
+    @patch("app.captioner.generate_caption")
     def test_generate_caption_captioner_error(self, mock_generate):
         """Test caption generation when captioner raises an exception."""
         # Mock the caption generation to raise an exception
         mock_generate.side_effect = Exception("Model loading failed")
-        
+
         # Create test image
         image_path = self.create_test_image_file()
         image_data = self.get_image_data(image_path)
-        
+
         # Make POST request
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (image_data, 'test.jpg')},
-                                  content_type='multipart/form-data')
-        
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (image_data, "test.jpg")},
+            content_type="multipart/form-data",
+        )
+
         self.assertEqual(response.status_code, 500)
         response_data = json.loads(response.data)
-        self.assertIn('error', response_data)
-        self.assertIn('Model loading failed', response_data['error'])
-    
+        self.assertIn("error", response_data)
+        self.assertIn("Model loading failed", response_data["error"])
+
     def test_upload_folder_creation(self):
         """Test that upload folder is created."""
-        self.assertTrue(os.path.exists(app.config['UPLOAD_FOLDER']))
-    
-    @patch('app.captioner.generate_caption')
+        self.assertTrue(os.path.exists(app.config["UPLOAD_FOLDER"]))
+
+    @patch("app.captioner.generate_caption")
     def test_file_cleanup_after_success(self, mock_generate):
         """Test that temporary files are cleaned up after successful processing."""
         mock_generate.return_value = "Test caption"
-        
+
         # Create test image
         image_path = self.create_test_image_file()
         image_data = self.get_image_data(image_path)
-        
+
         # Make POST request
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (image_data, 'test_cleanup.jpg')},
-                                  content_type='multipart/form-data')
-        
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (image_data, "test_cleanup.jpg")},
+            content_type="multipart/form-data",
+        )
+
         self.assertEqual(response.status_code, 200)
-        
-        # Check that the temporary file was cleaned up
-        temp_file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'test_cleanup.jpg')
+
+        # The upload is captioned from memory, nothing is left on disk
+        temp_file_path = os.path.join(app.config["UPLOAD_FOLDER"], "test_cleanup.jpg")
         self.assertFalse(os.path.exists(temp_file_path))
-    
-    @patch('app.captioner.generate_caption')
+        self.assertEqual(
+            bytes(mock_generate.call_args[0][0]), self.get_image_data(image_path).read()
+        )
+
+    @patch("app.captioner.generate_caption")
     def test_file_cleanup_after_error(self, mock_generate):
         """Test that temporary files are cleaned up even when processing fails."""
         mock_generate.side_effect = Exception("Processing failed")
-        
+
         # Create test image
         image_path = self.create_test_image_file()
         image_data = self.get_image_data(image_path)
-        
+
         # Make POST request
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (image_data, 'test_error_cleanup.jpg')},
-                                  content_type='multipart/form-data')
-        
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (image_data, "test_error_cleanup.jpg")},
+            content_type="multipart/form-data",
+        )
+
         self.assertEqual(response.status_code, 500)
-        
+
         # Check that the temporary file was cleaned up even after error
-        temp_file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'test_error_cleanup.jpg')
+        temp_file_path = os.path.join(
+            app.config["UPLOAD_FOLDER"], "test_error_cleanup.jpg"
+        )
         self.assertFalse(os.path.exists(temp_file_path))
-    
+
+    def test_concurrent_identical_uploads_are_coalesced(self):
+        """Test that identical concurrent uploads share one inference."""
+        import threading
+
+        from app import caption_flight
+
+        release = threading.Event()
+
+        def slow_caption(filepath, seed=None):
+            release.wait(5)
+            return "Shared caption"
+
+        image_path = self.create_test_image_file()
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        before = caption_flight.stats()["coalesced"]
+        results = []
+
+        def upload():
+            response = self.app.test_client().post(
+                "/generate_caption",
+                data={"image": (io.BytesIO(image_bytes), "same.jpg")},
+                content_type="multipart/form-data",
+            )
+            results.append((response.status_code, json.loads(response.data)))
+
+        with patch(
+            "app.captioner.generate_caption", side_effect=slow_caption
+        ) as mock_generate:
+            threads = [threading.Thread(target=upload) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            deadline = time.time() + 5
+            while (
+                caption_flight.stats()["coalesced"] - before < 3
+                and time.time() < deadline
+            ):
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(results, [(200, {"caption": "Shared caption"})] * 4)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(
+            json.loads(response.data)["coalescing"]["coalesced"], before + 3
+        )
+
+    def test_coalescing_respects_lane_and_timeout(self):
+        """Test that coalescing is per lane and each waiter keeps its own timeout."""
+        import threading
+
+        from app import caption_flight
+
+        release = threading.Event()
+        data = os.urandom(1024)
+
+        def post(priority, timeout):
+            return self.app.test_client().post(
+                "/generate_caption/raw",
+                data=data,
+                content_type="image/jpeg",
+                headers={"X-Priority": priority, "X-Request-Timeout": timeout},
+            )
+
+        results = []
+        with patch(
+            "app.captioner.generate_caption",
+            side_effect=lambda *args, **kwargs: release.wait(5) and "Shared caption",
+        ) as mock_generate:
+            leader = threading.Thread(
+                target=lambda: results.append(post("interactive", "10"))
+            )
+            leader.start()
+            while mock_generate.call_count == 0:
+                time.sleep(0.01)
+            before = caption_flight.stats()["coalesced"]
+
+            self.assertEqual(post("vip", "10").status_code, 400)
+            # A batch request runs on its own and expires in the queue
+            self.assertEqual(post("batch", "0.2").status_code, 504)
+            self.assertEqual(caption_flight.stats()["coalesced"], before)
+            # A same-lane request shares the call but gives up at its own deadline
+            start = time.monotonic()
+            self.assertEqual(post("interactive", "0.2").status_code, 504)
+            self.assertLess(time.monotonic() - start, 2)
+            self.assertEqual(caption_flight.stats()["coalesced"], before + 1)
+
+            release.set()
+            leader.join()
+        self.assertEqual(results[0].status_code, 200)
+        self.assertEqual(mock_generate.call_count, 1)
+
+    @patch("app.captioner.generate_caption")
+    def test_priority_lanes(self, mock_generate):
+        """Test that requests are routed to priority lanes."""
+        mock_generate.return_value = "Backfill caption"
+        from app import inference_scheduler
+
+        before = inference_scheduler.stats()["batch"]["completed"]
+
+        image_path = self.create_test_image_file()
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (self.get_image_data(image_path), "test.jpg")},
+            headers={"X-Priority": "batch", "X-Request-Timeout": "10"},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(inference_scheduler.stats()["batch"]["completed"], before + 1)
+
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (self.get_image_data(image_path), "test.jpg")},
+            headers={"X-Priority": "vip"},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        for timeout in ("inf", "nan", "-1", "0", "soon"):
+            with self.subTest(timeout=timeout):
+                response = self.client.post(
+                    "/generate_caption/raw",
+                    data=b"image bytes",
+                    headers={"X-Request-Timeout": timeout},
+                    content_type="image/jpeg",
+                )
+                self.assertEqual(response.status_code, 400)
+        from app import parse_timeout
+        from config import SCHEDULER_CONFIG
+
+        self.assertEqual(parse_timeout("1e308"), SCHEDULER_CONFIG["max_timeout"])
+        self.assertEqual(parse_timeout(None), SCHEDULER_CONFIG["default_timeout"])
+
+        metrics = json.loads(self.client.get("/metrics").data)
+        self.assertIn("wait_p95_ms", metrics["scheduler"]["interactive"])
+
+    def test_overload_is_rejected_fast(self):
+        """Test that requests beyond the concurrency limit get 503 with Retry-After."""
+        from limiter import ConcurrencyLimiter, StaticLimit
+
+        with patch(
+            "app.concurrency_limiter", ConcurrencyLimiter(StaticLimit(initial_limit=0))
+        ):
+            with patch("app.captioner.generate_caption") as mock_generate:
+                image_path = self.create_test_image_file()
+                response = self.client.post(
+                    "/generate_caption",
+                    data={"image": (self.get_image_data(image_path), "test.jpg")},
+                    content_type="multipart/form-data",
+                )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        mock_generate.assert_not_called()
+
+    def test_generate_captions_releases_limiter_slot(self):
+        """Test that a batch stream releases its slot on every path."""
+        from werkzeug.datastructures import FileStorage
+        from werkzeug.test import EnvironBuilder
+
+        from limiter import ConcurrencyLimiter, StaticLimit
+
+        limiter = ConcurrencyLimiter(StaticLimit(initial_limit=4))
+        image_path = self.create_test_image_file()
+
+        def environ():
+            return EnvironBuilder(
+                method="POST",
+                path="/generate_captions",
+                data={"images": [(self.get_image_data(image_path), "a.jpg")]},
+            ).get_environ()
+
+        with patch("app.concurrency_limiter", limiter):
+            # Closed by the server before the first line was produced
+            body = app(environ(), lambda status, headers: None)
+            self.assertEqual(limiter.stats()["in_flight"], 1)
+            body.close()
+            self.assertEqual(limiter.stats()["in_flight"], 0)
+
+            # An upload that cannot be read never takes a slot
+            with patch.object(
+                FileStorage, "read", side_effect=OSError("reset"), create=True
+            ):
+                with self.assertRaises(OSError):
+                    self.client.post(
+                        "/generate_captions",
+                        data={"images": [(self.get_image_data(image_path), "a.jpg")]},
+                        content_type="multipart/form-data",
+                    )
+            self.assertEqual(limiter.stats()["in_flight"], 0)
+        self.assertEqual(limiter.stats()["accepted"], 1)
+
+    @patch("app.captioner.generate_captions")
+    def test_generate_captions_streams_ndjson(self, mock_generate):
+        """Test that multi-image uploads stream one JSON line per image."""
+        mock_generate.side_effect = lambda images, seeds: [
+            "Caption: An image" if i == 0 else "Error: Unable to process image"
+            for i in range(len(images))
+        ]
+        red = self.create_test_image_file("red.jpg")
+        blue = self.create_test_image_file("blue.jpg", color="blue")
+
+        response = self.client.post(
+            "/generate_captions",
+            data={
+                "images": [
+                    (self.get_image_data(red), "a.jpg"),
+                    (io.BytesIO(b"text"), "notes.txt"),
+                    (self.get_image_data(blue), "b.jpg"),
+                    (self.get_image_data(red), "c.jpg"),
+                ]
+            },
+            content_type="multipart/form-data",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [
+            json.loads(line) for line in response.data.decode("utf-8").splitlines()
+        ]
+        by_index = {line["index"]: line for line in lines}
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3])
+        self.assertEqual(by_index[0]["caption"], "Caption: An image")
+        self.assertIn("elapsed_ms", by_index[0]["timings"])
+        self.assertEqual(by_index[1]["error"], "File type not allowed")
+        self.assertIn("error", by_index[2])
+        # The repeated image shares the first one's inference
+        self.assertEqual(by_index[3]["caption"], "Caption: An image")
+
+        # Images are passed in memory, once each
+        images, _ = mock_generate.call_args.args
+        self.assertEqual(
+            [bytes(image) for image in images],
+            [self.get_image_data(red).read(), self.get_image_data(blue).read()],
+        )
+
+        # The caption is cached for later batches and single uploads
+        response = self.client.post(
+            "/generate_captions",
+            data={"images": [(self.get_image_data(red), "d.jpg")]},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(json.loads(response.data)["caption"], "Caption: An image")
+        self.assertEqual(mock_generate.call_count, 1)
+        response = self.client.post(
+            "/generate_caption/raw",
+            data=self.get_image_data(red).read(),
+            content_type="image/jpeg",
+        )
+        self.assertEqual(json.loads(response.data)["caption"], "Caption: An image")
+
+    @patch("app.captioner.generate_caption")
+    def test_generate_caption_raw_body(self, mock_generate):
+        """Test captioning an image sent as a raw request body."""
+        mock_generate.return_value = "Raw caption"
+        image_path = self.create_test_image_file()
+        data = self.get_image_data(image_path).getvalue()
+
+        response = self.client.post(
+            "/generate_caption/raw", data=data, content_type="image/jpeg"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["caption"], "Raw caption")
+        self.assertEqual(bytes(mock_generate.call_args[0][0]), data)
+
+    @patch("app.captioner.generate_caption")
+    def test_hash_first_upload(self, mock_generate):
+        """Test the digest lookup before and after an upload, with ETag revalidation."""
+        mock_generate.return_value = "Caption: Hashed"
+        data = self.get_image_data(self.create_test_image_file()).getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        query = {"sha256": digest, "size": len(data)}
+
+        response = self.client.get("/generate_caption/lookup", query_string=query)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data)["upload"], "/generate_caption/raw")
+        self.assertEqual(response.headers["Cache-Control"], "no-store")
+
+        response = self.client.post(
+            "/generate_caption/raw", data=data, content_type="image/jpeg"
+        )
+        self.assertEqual(response.headers["ETag"], f'"{digest}"')
+
+        response = self.client.get("/generate_caption/lookup", query_string=query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.data), {"caption": "Caption: Hashed", "sha256": digest}
+        )
+        self.assertEqual(response.headers["ETag"], f'"{digest}"')
+        self.assertIn("max-age", response.headers["Cache-Control"])
+
+        response = self.client.get(
+            "/generate_caption/lookup",
+            query_string=query,
+            headers={"If-None-Match": f'"{digest}"'},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        # A repeat upload is answered from the cache
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (io.BytesIO(data), "again.jpg")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(json.loads(response.data)["caption"], "Caption: Hashed")
+        mock_generate.assert_called_once()
+
+        # The size must match too
+        response = self.client.get(
+            "/generate_caption/lookup", query_string={"sha256": digest, "size": 1}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_hash_first_lookup_rejected(self):
+        """Test malformed digests and sizes."""
+        for query, status in (
+            ({"sha256": "abc"}, 400),
+            ({}, 400),
+            ({"sha256": "0" * 64, "size": "-1"}, 400),
+            ({"sha256": "0" * 64, "size": 10**9}, 413),
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(
+                    "/generate_caption/lookup", query_string=query
+                )
+                self.assertEqual(response.status_code, status)
+
+    def test_request_id_header(self):
+        """Test that request ids are echoed or generated."""
+        response = self.client.get("/metrics", headers={"X-Request-ID": "trace-42"})
+        self.assertEqual(response.headers["X-Request-ID"], "trace-42")
+        self.assertIn("logging", json.loads(response.data))
+        self.assertEqual(len(self.client.get("/metrics").headers["X-Request-ID"]), 32)
+
+    def test_healthz(self):
+        """Test the liveness probe used by the router."""
+        response = self.client.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {"status": "ok"})
+
+    def test_generate_caption_raw_body_rejected(self):
+        """Test content type, empty and oversized raw bodies."""
+        response = self.client.post(
+            "/generate_caption/raw", data=b"abc", content_type="text/plain"
+        )
+        self.assertEqual(response.status_code, 415)
+
+        # An empty body is sent without Content-Length
+        response = self.client.post(
+            "/generate_caption/raw", data=b"", content_type="application/octet-stream"
+        )
+        self.assertEqual(response.status_code, 411)
+
+        with patch.dict(app.config, {"MAX_CONTENT_LENGTH": 2}):
+            response = self.client.post(
+                "/generate_caption/raw",
+                data=b"abc",
+                content_type="application/octet-stream",
+            )
+        self.assertEqual(response.status_code, 413)
+
+        # A body shorter than its Content-Length is rejected after reading what was sent
+        from app import read_body
+
+        with app.test_request_context(
+            "/generate_caption/raw", method="POST", input_stream=io.BytesIO(b"abc")
+        ):
+            self.assertIsNone(read_body(10**6, 10**7))
+        with app.test_request_context(
+            "/generate_caption/raw", method="POST", input_stream=io.BytesIO(b"abc")
+        ):
+            self.assertEqual(read_body(3, 3), b"abc")
+            with self.assertRaises(ValueError):
+                read_body(4, 3)
+
+    @patch("app.captioner.generate_captions_with_embeddings")
+    def test_embeddings_endpoint(self, mock_generate):
+        """Test base64 and npy embedding exports."""
+        mock_generate.side_effect = lambda sources, seeds: (
+            ["Caption: A"] * len(sources),
+            [np.full(4, 2.0, dtype=np.float32) for _ in sources],
+        )
+        image_path = self.create_test_image_file()
+
+        response = self.client.post(
+            "/embeddings?normalize=1&captions=1",
+            data={
+                "images": [
+                    (self.get_image_data(image_path), "a.jpg"),
+                    (io.BytesIO(b"text"), "notes.txt"),
+                ]
+            },
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        payload = json.loads(response.data)
+        self.assertEqual(payload["dim"], 4)
+        self.assertEqual(payload["embeddings"][0]["caption"], "Caption: A")
+        self.assertTrue(
+            np.allclose(from_base64(payload["embeddings"][0]["embedding"]), 0.5)
+        )
+        self.assertIn("error", payload["embeddings"][1])
+
+        response = self.client.post(
+            "/embeddings?format=npy",
+            data={"image": (self.get_image_data(image_path), "a.jpg")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Embedding-Shape"], "1,4")
+        self.assertEqual(np.load(io.BytesIO(response.data)).shape, (1, 4))
+
+        # A matrix cannot have holes
+        response = self.client.post(
+            "/embeddings?format=float16",
+            data={"images": [(io.BytesIO(b"text"), "notes.txt")]},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 422)
+
     def test_max_file_size_config(self):
         """Test that max file size is properly configured."""
-        self.assertEqual(app.config['MAX_CONTENT_LENGTH'], 16 * 1024 * 1024)  # 16MB
-    
+        self.assertEqual(app.config["MAX_CONTENT_LENGTH"], 16 * 1024 * 1024)  # 16MB
+
     def test_different_image_formats(self):
         """Test that different image formats are accepted."""
         formats = [
-            ('test.jpg', 'JPEG'),
-            ('test.jpeg', 'JPEG'),
-            ('test.png', 'PNG'),
-            ('test.gif', 'GIF')
+            ("test.jpg", "JPEG"),
+            ("test.jpeg", "JPEG"),
+            ("test.png", "PNG"),
+            ("test.gif", "GIF"),
         ]
-        
+
         for filename, format_name in formats:
             with self.subTest(format=format_name):
                 # Create test image
-                image_path = self.create_test_image_file(filename=filename, color='blue')
+                image_path = self.create_test_image_file(
+                    filename=filename, color="blue"
+                )
                 image_data = self.get_image_data(image_path)
-                
+
                 # Mock caption generation
-                with patch('app.captioner.generate_caption') as mock_generate:
+                with patch("app.captioner.generate_caption") as mock_generate:
                     mock_generate.return_value = f"Caption for {format_name}"
-                    
-                    response = self.client.post('/generate_caption', 
-                                              data={'image': (image_data, filename)},
-                                              content_type='multipart/form-data')
-                    
+
+                    response = self.client.post(
+                        "/generate_caption",
+                        data={"image": (image_data, filename)},
+                        content_type="multipart/form-data",
+                    )
+
                     self.assertEqual(response.status_code, 200)
                     response_data = json.loads(response.data)
-                    self.assertIn('caption', response_data)
-    
+                    self.assertIn("caption", response_data)
+
     def test_secure_filename_handling(self):
         """Test that filenames are properly secured."""
         # Test with potentially dangerous filename
         dangerous_names = [
-            '../../../etc/passwd.jpg',
-            'test file with spaces.jpg',
-            'test@file.jpg',
-            'test#file.jpg'
+            "../../../etc/passwd.jpg",
+            "test file with spaces.jpg",
+            "test@file.jpg",
+            "test#file.jpg",
         ]
-        
+
         for dangerous_name in dangerous_names:
             with self.subTest(filename=dangerous_name):
-                image_path = self.create_test_image_file(filename='safe.jpg')
+                image_path = self.create_test_image_file(filename="safe.jpg")
                 image_data = self.get_image_data(image_path)
-                
-                with patch('app.captioner.generate_caption') as mock_generate:
+
+                with patch("app.captioner.generate_caption") as mock_generate:
                     mock_generate.return_value = "Test caption"
-                    
-                    response = self.client.post('/generate_caption', 
-                                              data={'image': (image_data, dangerous_name)},
-                                              content_type='multipart/form-data')
-                    
+
+                    response = self.client.post(
+                        "/generate_caption",
+                        data={"image": (image_data, dangerous_name)},
+                        content_type="multipart/form-data",
+                    )
+
                     # Should still work (filename is secured in the backend)
                     self.assertEqual(response.status_code, 200)
 
 
 class TestFlaskAppIntegration(unittest.TestCase):
     """Integration tests for the Flask application."""
-    
+
     def setUp(self):
         """Set up integration test fixtures."""
         self.app = app
-        self.app.config['TESTING'] = True
+        self.app.config["TESTING"] = True
         self.client = self.app.test_client()
         self.test_dir = tempfile.mkdtemp()
-    
+
     def tearDown(self):
         """Clean up after integration tests."""
         if os.path.exists(self.test_dir):
             import shutil
+
             shutil.rmtree(self.test_dir)
-    
+
     def test_full_workflow_integration(self):
         """Test the complete workflow from file upload to caption generation."""
         # Create a realistic test image
         image_path = os.path.join(self.test_dir, "integration_test.jpg")
-        image = Image.new('RGB', (256, 256), color='green')
+        image = Image.new("RGB", (256, 256), color="green")
         image.save(image_path)
-        
+
         # Upload image and get caption
-        with open(image_path, 'rb') as f:
+        with open(image_path, "rb") as f:
             image_data = io.BytesIO(f.read())
-        
-        response = self.client.post('/generate_caption', 
-                                  data={'image': (image_data, 'integration_test.jpg')},
-                                  content_type='multipart/form-data')
-        
+
+        response = self.client.post(
+            "/generate_caption",
+            data={"image": (image_data, "integration_test.jpg")},
+            content_type="multipart/form-data",
+        )
+
         # Should get a successful response
         self.assertEqual(response.status_code, 200)
         response_data = json.loads(response.data)
-        self.assertIn('caption', response_data)
-        self.assertIsInstance(response_data['caption'], str)
-        self.assertTrue(len(response_data['caption']) > 0)
-    
+        self.assertIn("caption", response_data)
+        self.assertIsInstance(response_data["caption"], str)
+        self.assertTrue(len(response_data["caption"]) > 0)
+
     def test_concurrent_requests(self):
         """Test handling of multiple concurrent requests."""
         import threading
-        import time
-        
+
         results = []
-        
+
         def make_request():
-            image_path = os.path.join(self.test_dir, f"concurrent_{threading.get_ident()}.jpg")
-            image = Image.new('RGB', (100, 100), color='red')
+            image_path = os.path.join(
+                self.test_dir, f"concurrent_{threading.get_ident()}.jpg"
+            )
+            image = Image.new("RGB", (100, 100), color="red")
             image.save(image_path)
-            
-            with open(image_path, 'rb') as f:
+
+            with open(image_path, "rb") as f:
                 image_data = io.BytesIO(f.read())
-            
-            response = self.client.post('/generate_caption', 
-                                      data={'image': (image_data, f'concurrent_{threading.get_ident()}.jpg')},
-                                      content_type='multipart/form-data')
+
+            response = self.client.post(
+                "/generate_caption",
+                data={"image": (image_data, f"concurrent_{threading.get_ident()}.jpg")},
+                content_type="multipart/form-data",
+            )
             results.append(response.status_code)
-        
+
         # Create multiple threads
         threads = []
         for i in range(5):
             thread = threading.Thread(target=make_request)
             threads.append(thread)
             thread.start()
-        
+
         # Wait for all threads to complete
         for thread in threads:
             thread.join()
-        
+
         # All requests should succeed
         self.assertEqual(len(results), 5)
         for status_code in results:
             self.assertEqual(status_code, 200)
 
 
-if __name__ == '__main__':
+if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,360 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+# Import the ASGI app
+import asgi  # noqa: E402
+from utils.result_cache import ResultCache  # noqa: E402
+
+
+def image_bytes(color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color=color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def multipart(fields):
+    """Encode {'name': [(data, filename), ...]} as (content type, body)."""
+    builder = EnvironBuilder(
+        method="POST",
+        data={
+            name: [(io.BytesIO(data), filename) for data, filename in parts]
+            for name, parts in fields.items()
+        },
+    )
+    environ = builder.get_environ()
+    return environ["CONTENT_TYPE"], environ["wsgi.input"].read()
+
+
+async def call(method, path, body=b"", headers=None, chunk_size=None, query_string=b""):
+    """Run one request through the ASGI app, returning (status, headers, body)."""
+    headers = dict(headers or {})
+    chunk_size = chunk_size or max(1, len(body))
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)] or [
+        b""
+    ]
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+
+    async def receive():
+        if chunks:
+            chunk = chunks.pop(0)
+            return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+        return {"type": "http.disconnect"}
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.app(scope, receive, send)
+    start = messages[0]
+    return (
+        start["status"],
+        dict(start["headers"]),
+        b"".join(m.get("body", b"") for m in messages[1:]),
+    )
+
+
+class TestAsgiApp(unittest.TestCase):
+    """Test cases for the asyncio serving mode."""
+
+    def setUp(self):
+        cache = ResultCache()
+        for target in ("app.caption_cache", "asgi.caption_cache"):
+            patcher = patch(target, cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def request(self, *args, **kwargs):
+        return asyncio.run(call(*args, **kwargs))
+
+    @patch("asgi.captioner.generate_caption")
+    def test_generate_caption_multipart(self, mock_generate):
+        """Test a chunked multipart upload captioned from memory."""
+        mock_generate.return_value = "Caption: async"
+        data = image_bytes()
+        content_type, body = multipart({"image": [(data, "test.jpg")]})
+
+        status, _, payload = self.request(
+            "POST",
+            "/generate_caption",
+            body,
+            {"Content-Type": content_type},
+            chunk_size=100,
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(payload)["caption"], "Caption: async")
+        self.assertEqual(mock_generate.call_args[0][0], data)
+
+    @patch("asgi.captioner.generate_caption")
+    def test_multipart_is_parsed_as_it_arrives(self, mock_generate):
+        """Test that multipart chunks are parsed as they arrive, not buffered."""
+        mock_generate.return_value = "Caption: async"
+        content_type, body = multipart({"image": [(image_bytes(), "test.jpg")]})
+
+        with patch.object(
+            asgi.MultipartParser,
+            "feed",
+            autospec=True,
+            side_effect=asgi.MultipartParser.feed,
+        ) as mock_feed, patch.object(asgi.Request, "body") as mock_body:
+            status, _, _ = self.request(
+                "POST",
+                "/generate_caption",
+                body,
+                {"Content-Type": content_type},
+                chunk_size=100,
+            )
+
+        self.assertEqual(status, 200)
+        mock_body.assert_not_called()
+        # One call per chunk, plus the end of the body
+        self.assertEqual(mock_feed.call_count, -(-len(body) // 100) + 1)
+
+    def test_shares_services_without_importing_flask_app(self):
+        """Test that asgi uses the shared runtime and does not import app."""
+        import subprocess
+
+        import app
+
+        self.assertIs(asgi.captioner, app.captioner)
+        self.assertIs(asgi.inference_scheduler, app.inference_scheduler)
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, "-c", 'import sys, asgi; print("app" in sys.modules)'],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+        self.assertEqual(result.stdout.strip(), "False", result.stderr)
+
+    def test_generate_caption_errors(self):
+        """Test the same validation errors as the Flask routes."""
+        content_type, body = multipart({"image": [(b"text", "notes.txt")]})
+        status, _, payload = self.request(
+            "POST", "/generate_caption", body, {"Content-Type": content_type}
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(payload)["error"], "File type not allowed")
+
+        status, _, _ = self.request(
+            "POST", "/generate_caption/raw", b"abc", {"Content-Type": "text/plain"}
+        )
+        self.assertEqual(status, 415)
+
+        with patch("asgi.MAX_CONTENT_LENGTH", 2):
+            status, _, _ = self.request(
+                "POST", "/generate_caption/raw", b"abc", {"Content-Type": "image/jpeg"}
+            )
+        self.assertEqual(status, 413)
+
+        self.assertEqual(self.request("GET", "/nope")[0], 404)
+        self.assertEqual(self.request("GET", "/generate_caption")[0], 405)
+
+    @patch("asgi.captioner.generate_caption")
+    def test_hash_first_upload(self, mock_generate):
+        """Test the digest lookup shares the cache filled by uploads."""
+        mock_generate.return_value = "Caption: hashed"
+        data = image_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        query = f"sha256={digest}&size={len(data)}".encode()
+
+        self.assertEqual(
+            self.request("GET", "/generate_caption/lookup", query_string=query)[0], 404
+        )
+        status, headers, _ = self.request(
+            "POST", "/generate_caption/raw", data, {"Content-Type": "image/jpeg"}
+        )
+        self.assertEqual(headers[b"etag"], f'"{digest}"'.encode())
+
+        status, headers, body = self.request(
+            "GET", "/generate_caption/lookup", query_string=query
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["caption"], "Caption: hashed")
+        status, _, body = self.request(
+            "GET",
+            "/generate_caption/lookup",
+            query_string=query,
+            headers={"If-None-Match": headers[b"etag"].decode()},
+        )
+        self.assertEqual((status, body), (304, b""))
+        mock_generate.assert_called_once()
+
+    @patch("asgi.captioner.generate_caption")
+    def test_generate_caption_raw(self, mock_generate):
+        """Test a raw body upload and the metrics route."""
+        mock_generate.return_value = "Caption: raw"
+        status, _, payload = self.request(
+            "POST",
+            "/generate_caption/raw",
+            image_bytes(),
+            {"Content-Type": "image/jpeg"},
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(payload)["caption"], "Caption: raw")
+
+        status, _, payload = self.request("GET", "/metrics")
+        self.assertEqual(status, 200)
+        self.assertIn("limiter", json.loads(payload))
+        status, _, payload = self.request("GET", "/healthz")
+        self.assertEqual((status, json.loads(payload)), (200, {"status": "ok"}))
+
+    @patch("asgi.captioner.generate_captions")
+    def test_generate_captions_streams_ndjson(self, mock_generate):
+        """Test that the multi-image route streams one line per image."""
+        mock_generate.side_effect = lambda sources, seeds: ["Caption: ok"] * len(
+            sources
+        )
+        content_type, body = multipart(
+            {
+                "images": [
+                    (image_bytes(), "a.jpg"),
+                    (b"x", "b.txt"),
+                    (image_bytes("blue"), "c.png"),
+                ]
+            }
+        )
+
+        status, headers, payload = self.request(
+            "POST", "/generate_captions", body, {"Content-Type": content_type}
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"content-type"], b"application/x-ndjson")
+        lines = {
+            line["index"]: line
+            for line in map(json.loads, payload.decode().splitlines())
+        }
+        self.assertEqual(lines[0]["caption"], "Caption: ok")
+        self.assertIn("error", lines[1])
+        self.assertIn("batch_ms", lines[2]["timings"])
+
+    @patch("asgi.captioner.generate_captions_with_embeddings")
+    def test_embeddings_float16(self, mock_generate):
+        """Test the raw float16 embedding export."""
+        mock_generate.side_effect = lambda sources, seeds: (
+            ["Caption: A"] * len(sources),
+            [np.arange(4, dtype=np.float32) for _ in sources],
+        )
+        content_type, body = multipart(
+            {"images": [(image_bytes(), "a.jpg"), (image_bytes("blue"), "b.jpg")]}
+        )
+
+        status, headers, payload = self.request(
+            "POST",
+            "/embeddings",
+            body,
+            {"Content-Type": content_type},
+            query_string=b"format=float16",
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"x-embedding-shape"], b"2,4")
+        self.assertTrue(
+            np.array_equal(
+                np.frombuffer(payload, dtype="<f2").reshape(2, 4)[1], np.arange(4)
+            )
+        )
+
+        mock_generate.side_effect = RuntimeError("backend failed")
+        status, _, payload = self.request(
+            "POST", "/embeddings", body, {"Content-Type": content_type}
+        )
+        self.assertEqual(status, 500)
+        self.assertEqual(json.loads(payload), {"error": "backend failed"})
+
+    def test_overload_is_rejected(self):
+        """Test that the shared concurrency limiter rejects with 503."""
+        from limiter import ConcurrencyLimiter, StaticLimit
+
+        with patch(
+            "asgi.concurrency_limiter", ConcurrencyLimiter(StaticLimit(initial_limit=0))
+        ):
+            status, headers, _ = self.request(
+                "POST", "/generate_caption/raw", b"abc", {"Content-Type": "image/jpeg"}
+            )
+        self.assertEqual(status, 503)
+        self.assertIn(b"retry-after", headers)
+
+    @patch("asgi.captioner.generate_caption")
+    def test_limiter_slot_held_only_for_inference(self, mock_generate):
+        """Test that receiving and parsing the upload holds no limiter slot."""
+        from limiter import ConcurrencyLimiter, StaticLimit
+
+        limiter = ConcurrencyLimiter(StaticLimit(initial_limit=1))
+        in_flight = []
+
+        def feed(parser, data):
+            in_flight.append(("feed", limiter.stats()["in_flight"]))
+            return original_feed(parser, data)
+
+        def generate(data, seed=None):
+            in_flight.append(("inference", limiter.stats()["in_flight"]))
+            return "Caption: limited"
+
+        original_feed = asgi.MultipartParser.feed
+        mock_generate.side_effect = generate
+        content_type, body = multipart({"image": [(image_bytes(), "test.jpg")]})
+        with patch("asgi.concurrency_limiter", limiter), patch.object(
+            asgi.MultipartParser, "feed", feed
+        ):
+            status, _, _ = self.request(
+                "POST",
+                "/generate_caption",
+                body,
+                {"Content-Type": content_type},
+                chunk_size=100,
+            )
+            # Cache hits need no slot at all
+            limiter.algorithm.limit = 0
+            status_cached, _, _ = self.request(
+                "POST", "/generate_caption", body, {"Content-Type": content_type}
+            )
+
+        self.assertEqual((status, status_cached), (200, 200))
+        self.assertTrue(
+            all(count == 0 for stage, count in in_flight if stage == "feed")
+        )
+        self.assertIn(("inference", 1), in_flight)
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+    @patch("asgi.captioner.generate_caption")
+    def test_priority_form_field(self, mock_generate):
+        """Test that the priority form field picks the lane, as in app.py."""
+        environ = EnvironBuilder(
+            method="POST",
+            data={"image": (io.BytesIO(image_bytes()), "a.jpg"), "priority": "nope"},
+        ).get_environ()
+        status, _, payload = self.request(
+            "POST",
+            "/generate_caption",
+            environ["wsgi.input"].read(),
+            {"Content-Type": environ["CONTENT_TYPE"]},
+        )
+        self.assertEqual(status, 400)
+        self.assertIn("nope", json.loads(payload)["error"])
+        mock_generate.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
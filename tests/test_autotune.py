@@ -0,0 +1,124 @@
+"""
+Tests for autotune.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import torch
+
+# Import the module to test
+import autotune
+
+
+class TestAutotune(unittest.TestCase):
+    """Test cases for the inference autotuner."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 3, padding=1),
+            torch.nn.ReLU(),
+            torch.nn.AdaptiveAvgPool2d(1),
+        ).eval()
+        self.threads = torch.get_num_threads()
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        torch.set_num_threads(self.threads)
+        shutil.rmtree(self.temp_dir)
+
+    def test_host_key_identifies_host(self):
+        """Test that the cache key names the CPU and torch version."""
+        key = autotune.host_key()
+        self.assertIn(torch.__version__.replace("+", "_"), key)
+        self.assertNotIn("/", key)
+        self.assertTrue(autotune.profile_path(self.temp_dir).name.endswith(".json"))
+
+    @patch("autotune.platform.machine", return_value="x86_64")
+    def test_bf16_support_from_cpu_flags(self, _):
+        """Test native bf16 detection from the CPU flags."""
+        with patch(
+            "autotune.cpu_flags", return_value=["avx2", "avx512f", "avx512_bf16"]
+        ):
+            self.assertTrue(autotune.bf16_supported())
+        with patch("autotune.cpu_flags", return_value=["avx2", "avx512f"]):
+            self.assertFalse(autotune.bf16_supported())
+
+    def test_autotune_picks_fastest_setting(self):
+        """Test that the chosen profile is the fastest measurement."""
+        profile = autotune.autotune(
+            self.model,
+            thread_counts=[1],
+            batch_sizes=(1, 2),
+            input_size=32,
+            iterations=1,
+        )
+
+        fastest = min(profile["measurements"], key=lambda m: m["ms_per_image"])
+        self.assertEqual(profile["ms_per_image"], fastest["ms_per_image"])
+        self.assertEqual(profile["batch_size"], fastest["batch_size"])
+        # 1 thread count x 2 formats x 2 modes, then one extra batch size
+        self.assertEqual(len(profile["measurements"]), 5)
+        self.assertEqual(torch.get_num_threads(), self.threads)
+
+    def test_profile_is_cached(self):
+        """Test that the autotuner only runs on a cache miss."""
+        kwargs = dict(thread_counts=[1], batch_sizes=(1,), input_size=32, iterations=1)
+        first = autotune.load_or_autotune(self.model, self.temp_dir, **kwargs)
+        with open(autotune.profile_path(self.temp_dir)) as f:
+            self.assertEqual(json.load(f)["batch_size"], first["batch_size"])
+
+        with patch("autotune.autotune") as mock_autotune:
+            second = autotune.load_or_autotune(self.model, self.temp_dir, **kwargs)
+        mock_autotune.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_concurrent_workers_autotune_once(self):
+        """Test that workers starting together run the benchmark once."""
+        calls = []
+
+        def slow_autotune(model, **kwargs):
+            calls.append(threading.get_ident())
+            time.sleep(0.2)
+            return dict(autotune.DEFAULT_PROFILE, ms_per_image=1.0)
+
+        results = []
+        with patch("autotune.autotune", side_effect=slow_autotune):
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        autotune.load_or_autotune(self.model, self.temp_dir)
+                    )
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertFalse([n for n in os.listdir(self.temp_dir) if n.endswith(".tmp")])
+
+    def test_apply_profile(self):
+        """Test that a profile sets threads and memory format."""
+        profile = dict(autotune.DEFAULT_PROFILE, num_threads=1, channels_last=True)
+        autotune.apply_profile(profile, self.model)
+
+        self.assertEqual(torch.get_num_threads(), 1)
+        self.assertTrue(
+            self.model[0].weight.is_contiguous(memory_format=torch.channels_last)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
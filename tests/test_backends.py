@@ -0,0 +1,196 @@
+"""
+Tests for backends.py
+"""
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import torch
+from torchvision import models
+
+# Import the module to test
+from backends import (
+    CompiledTorchBackend,
+    InferenceBackend,
+    OnnxRuntimeBackend,
+    TorchBackend,
+    create_backend,
+    model_fingerprint,
+    pooled_cosine_similarity,
+)
+
+HAS_ONNXRUNTIME = (
+    importlib.util.find_spec("onnxruntime") is not None
+    and importlib.util.find_spec("onnx") is not None
+)
+
+
+def make_backbone():
+    torch.manual_seed(0)
+    model = models.resnet18(weights=None)
+    return torch.nn.Sequential(*(list(model.children())[:-2])).eval()
+
+
+class TestBackends(unittest.TestCase):
+    """Test cases for the inference backends."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = make_backbone()
+        cls.batch = torch.randn(2, 3, 224, 224)
+        with torch.no_grad():
+            cls.expected = cls.model(cls.batch)
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_torch_backend(self):
+        """Test eager execution in both memory formats."""
+        for channels_last in (False, True):
+            with self.subTest(channels_last=channels_last):
+                backend = create_backend(
+                    "torch",
+                    self.model,
+                    channels_last=channels_last,
+                    inference_mode=True,
+                )
+                self.assertIsInstance(backend, TorchBackend)
+                torch.testing.assert_close(
+                    backend.run_batch(self.batch), self.expected, rtol=1e-4, atol=1e-4
+                )
+
+    def test_unknown_backend(self):
+        """Test that unknown backend names are rejected."""
+        with self.assertRaises(ValueError):
+            create_backend("tensorflow", self.model)
+
+    def test_warmup_runs_each_batch_size(self):
+        """Test that warmup runs one batch per size."""
+        backend = TorchBackend(self.model)
+        with patch.object(backend, "run_batch") as mock_run:
+            backend.warmup(batch_sizes=(1, 4), input_size=32)
+        self.assertEqual([c.args[0].shape[0] for c in mock_run.call_args_list], [1, 4])
+
+    def test_base_backend_is_abstract(self):
+        """Test that the interface cannot run batches."""
+        with self.assertRaises(NotImplementedError):
+            InferenceBackend().run_batch(self.batch)
+
+    def test_fingerprint_tracks_weights(self):
+        """Test that the export key changes with the weights."""
+        other = make_backbone()
+        self.assertEqual(model_fingerprint(self.model), model_fingerprint(other))
+        with torch.no_grad():
+            other[0].weight.add_(1)
+        self.assertNotEqual(model_fingerprint(self.model), model_fingerprint(other))
+
+    def test_bf16_precision(self):
+        """Test bf16 weights with autocast, and the fp32 fallbacks."""
+        with patch("backends.bf16_supported", return_value=True):
+            backend = create_backend(
+                "torch", self.model, precision="bf16", inference_mode=True
+            )
+            self.assertEqual(backend.precision, "bf16")
+            self.assertEqual(backend.model[0].weight.dtype, torch.bfloat16)
+            self.assertEqual(self.model[0].weight.dtype, torch.float32)
+            features = backend.run_batch(self.batch)
+            self.assertEqual(features.dtype, torch.float32)
+            self.assertGreater(pooled_cosine_similarity(features, self.expected), 0.99)
+
+            # Parity check failure
+            backend = create_backend(
+                "torch", self.model, precision="bf16", parity_threshold=1.01
+            )
+            self.assertEqual(backend.precision, "fp32")
+            self.assertIs(backend.model, self.model)
+
+        with patch("backends.bf16_supported", return_value=False):
+            backend = create_backend("torch", self.model, precision="bf16")
+        self.assertEqual(backend.precision, "fp32")
+
+        with self.assertRaises(ValueError):
+            TorchBackend(self.model, precision="fp8")
+
+    def test_compiled_backend_uses_persistent_cache(self):
+        """Test that the backend compiles the backbone with a persistent cache."""
+        cache_dir = os.path.join(self.temp_dir, "compile_cache")
+        # Compiling ResNet takes minutes on small CPUs, so stand in for torch.compile
+        with patch.dict(os.environ, clear=False) as environ, patch(
+            "torch.compile", side_effect=lambda model, **kwargs: model
+        ) as mock_compile:
+            environ.pop("TORCHINDUCTOR_CACHE_DIR", None)
+            backend = create_backend(
+                "torch_compile",
+                self.model,
+                cache_dir=cache_dir,
+                mode="max-autotune",
+                inference_mode=True,
+                fullgraph=True,
+                options={"epilogue_fusion": True},
+            )
+            self.assertIsInstance(backend, CompiledTorchBackend)
+            self.assertEqual(environ["TORCHINDUCTOR_CACHE_DIR"], cache_dir)
+        self.assertTrue(os.path.isdir(cache_dir))
+        self.assertEqual(mock_compile.call_args.kwargs["mode"], "max-autotune")
+        self.assertTrue(mock_compile.call_args.kwargs["fullgraph"])
+        self.assertEqual(
+            mock_compile.call_args.kwargs["options"], {"epilogue_fusion": True}
+        )
+        with self.assertRaises(TypeError):
+            CompiledTorchBackend(self.model, full_graph=True)
+        torch.testing.assert_close(
+            backend.run_batch(self.batch), self.expected, rtol=1e-4, atol=1e-4
+        )
+
+    def test_onnxruntime_backend_reports_unsupported_options(self):
+        """Test that torch-only options are reported rather than silently dropped."""
+        with self.assertLogs("backends", level="INFO") as logs:
+            OnnxRuntimeBackend(
+                self.model,
+                model_dir=self.temp_dir,
+                precision="bf16",
+                device=torch.device("meta"),
+                channels_last=True,
+                inference_mode=True,
+            )
+        self.assertEqual(
+            [r.levelname for r in logs.records], ["WARNING", "WARNING", "INFO"]
+        )
+        self.assertIn("bf16", logs.records[0].getMessage())
+
+        with self.assertRaises(TypeError):
+            OnnxRuntimeBackend(self.model, model_dir=self.temp_dir, fullgraph=True)
+        with self.assertRaises(ValueError):
+            OnnxRuntimeBackend(self.model, model_dir=self.temp_dir, precision="fp8")
+
+    @unittest.skipUnless(HAS_ONNXRUNTIME, "onnxruntime is not installed")
+    def test_onnxruntime_backend_matches_torch(self):
+        """Test ONNX export and execution against eager PyTorch."""
+        backend = create_backend(
+            "onnxruntime",
+            self.model,
+            model_dir=self.temp_dir,
+            device=torch.device("cpu"),
+        )
+        self.assertTrue(backend.onnx_path.exists())
+        self.assertTrue(str(backend.onnx_path).startswith(self.temp_dir))
+        torch.testing.assert_close(
+            backend.run_batch(self.batch), self.expected, rtol=1e-3, atol=1e-3
+        )
+
+        # A second backend reuses the exported file
+        with patch.object(OnnxRuntimeBackend, "export") as mock_export:
+            create_backend("onnxruntime", self.model, model_dir=self.temp_dir)
+        mock_export.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Tests for caption_decoder.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+# Import the module to test
+from caption_decoder import CaptionDecoder, Vocabulary, tokenize
+
+WORDS = (
+    "the a player team ball goal scores kicks throws crowd erupts match game in on "
+    "with for fast slow big small red blue . ! ,"
+)
+
+
+def make_decoder(seed=0):
+    return CaptionDecoder(
+        Vocabulary(WORDS.split()), feature_dim=16, embed_dim=8, hidden_dim=12, seed=seed
+    )
+
+
+def blocked(tokens, n):
+    """Tokens that would repeat an n-gram of the sequence."""
+    if n <= 0 or len(tokens) < n:
+        return set()
+    prefix = tokens[len(tokens) - n + 1 :]
+    return {
+        tokens[i + n - 1]
+        for i in range(len(tokens) - n + 1)
+        if tokens[i : i + n - 1] == prefix
+    }
+
+
+def reference_beam_search(decoder, features, beams, max_length, n):
+    """Unbatched beam search re-running the GRU over the whole prefix every step."""
+    hypotheses = [(0.0, [Vocabulary.BOS], False)]
+    for _ in range(max_length):
+        candidates = []
+        for score, tokens, ended in hypotheses:
+            if ended:
+                candidates.append((score, tokens + [Vocabulary.PAD], True))
+                continue
+            hidden = decoder.start(features.unsqueeze(0))
+            for token in tokens:
+                logits, hidden = decoder.step(torch.tensor([token]), hidden)
+            logprobs = F.log_softmax(logits[0], dim=-1)
+            banned = blocked(tokens[1:], n)
+            for token, logprob in enumerate(logprobs.tolist()):
+                if token not in banned:
+                    candidates.append(
+                        (score + logprob, tokens + [token], token == Vocabulary.EOS)
+                    )
+        hypotheses = sorted(candidates, key=lambda c: c[0], reverse=True)[:beams]
+        if all(ended for _, _, ended in hypotheses):
+            break
+
+    def normalized(hypothesis):
+        score, tokens, _ = hypothesis
+        return score / max(1, len([t for t in tokens[1:] if t != Vocabulary.PAD]))
+
+    finished = [h for h in hypotheses if h[2]] or hypotheses
+    tokens = max(finished, key=normalized)[1][1:]
+    if Vocabulary.EOS in tokens:
+        tokens = tokens[: tokens.index(Vocabulary.EOS)]
+    return [t for t in tokens if t != Vocabulary.PAD]
+
+
+class TestVocabulary(unittest.TestCase):
+    """Test cases for the vocabulary."""
+
+    def test_round_trip(self):
+        """Test encoding and detokenizing a caption."""
+        vocab = Vocabulary.from_texts(
+            ["The player scores a goal!", "Crowd erupts, the team wins."]
+        )
+        self.assertEqual(tokenize("Goal, again!"), ["goal", ",", "again", "!"])
+        ids = vocab.encode("the crowd erupts, the player scores!")
+        self.assertEqual(
+            vocab.decode(ids + [Vocabulary.EOS, ids[0]]),
+            "The crowd erupts, the player scores!",
+        )
+        self.assertEqual(vocab.encode("zebra"), [Vocabulary.UNK])
+
+
+class TestCaptionDecoder(unittest.TestCase):
+    """Test cases for batched beam search."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.decoder = make_decoder()
+        self.features = torch.randn(3, 16, generator=torch.Generator().manual_seed(1))
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_random_init_is_deterministic(self):
+        """Test the same seed gives the same weights offline."""
+        other = make_decoder()
+        torch.testing.assert_close(other.output.weight, self.decoder.output.weight)
+        self.assertFalse(
+            torch.equal(make_decoder(seed=1).output.weight, self.decoder.output.weight)
+        )
+
+    def test_matches_unbatched_reference(self):
+        """Test the batched, cached search against a naive per-image search."""
+        for beams, n in ((1, 0), (3, 0), (4, 2)):
+            with self.subTest(beams=beams, no_repeat_ngram_size=n):
+                results = self.decoder.generate(
+                    self.features,
+                    num_beams=beams,
+                    max_length=12,
+                    no_repeat_ngram_size=n,
+                    early_stopping=False,
+                )
+                for features, result in zip(self.features, results):
+                    self.assertEqual(
+                        result,
+                        reference_beam_search(self.decoder, features, beams, 12, n),
+                    )
+
+    def test_batch_does_not_change_results(self):
+        """Test each image decodes the same alone and in a batch."""
+        batched = self.decoder.generate(
+            self.features, num_beams=4, max_length=15, no_repeat_ngram_size=2
+        )
+        for i in range(len(self.features)):
+            self.assertEqual(
+                self.decoder.generate(
+                    self.features[i : i + 1],
+                    num_beams=4,
+                    max_length=15,
+                    no_repeat_ngram_size=2,
+                )[0],
+                batched[i],
+            )
+
+    def test_no_repeated_ngrams(self):
+        """Test that n-gram blocking holds over long outputs."""
+        for n in (1, 2, 3):
+            for tokens in self.decoder.generate(
+                self.features, num_beams=2, max_length=30, no_repeat_ngram_size=n
+            ):
+                ngrams = [tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1)]
+                self.assertEqual(len(ngrams), len(set(ngrams)))
+
+    def test_save_and_load(self):
+        """Test checkpoints restore weights and vocabulary."""
+        path = os.path.join(self.temp_dir, "decoder.pt")
+        self.decoder.save(path)
+        loaded = CaptionDecoder.load(path)
+        self.assertEqual(loaded.vocab.itos, self.decoder.vocab.itos)
+        self.assertEqual(
+            loaded.generate_text(self.features),
+            self.decoder.generate_text(self.features),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests for caption_engine.py
+"""
+import threading
+import unittest
+
+# Import the module to test
+from caption_engine import CAPTION_TEMPLATES, CaptionEngine, seed_from_bytes
+
+
+class TestCaptionEngine(unittest.TestCase):
+    """Test cases for the template caption engine."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.engine = CaptionEngine(
+            sports_categories=["cricket", "football", "tennis"],
+            action_verbs=["playing", "kicking"],
+            emotion_phrases=["A spectacular moment as", "The crowd erupts as"],
+            sports_terms={
+                "football": ["goal", "free kick", "kick"],
+                "tennis": ["ace", "serve"],
+            },
+        )
+
+    def test_same_seed_same_caption(self):
+        """Test that seeded generation is reproducible."""
+        seeds = list(range(50))
+        self.assertEqual(
+            self.engine.generate_batch(seeds), self.engine.generate_batch(seeds)
+        )
+        self.assertEqual(self.engine.generate(7), self.engine.generate_batch([7])[0])
+
+    def test_batch_matches_single_generation(self):
+        """Test that batching does not change per-request results."""
+        seeds = [3, 1, 4, 1, 5]
+        self.assertEqual(
+            self.engine.generate_batch(seeds),
+            [self.engine.generate(seed) for seed in seeds],
+        )
+
+    def test_captions_use_vocabulary(self):
+        """Test that captions are built from the configured words."""
+        for caption in self.engine.generate_batch(list(range(200))):
+            lowered = caption.lower()
+            self.assertTrue(caption[0].isupper())
+            self.assertTrue(
+                any(sport in lowered for sport in self.engine.sports_categories)
+            )
+        # Every template is reachable
+        captions = " ".join(self.engine.generate_batch(list(range(500))))
+        self.assertIn("makes a move", captions)
+        self.assertIn("during the game", captions)
+        self.assertEqual(len(CAPTION_TEMPLATES), 5)
+
+    def test_detect_sport(self):
+        """Test the multi-pattern sport term matcher."""
+        self.assertEqual(self.engine.detect_sport("What a GOAL that was"), "football")
+        self.assertEqual(self.engine.detect_sport("Another ace on serve"), "tennis")
+        # Sports earlier in sports_terms win when several match
+        self.assertEqual(
+            self.engine.detect_sport("an ace from a free kick"), "football"
+        )
+        self.assertIsNone(self.engine.detect_sport("a quiet afternoon"))
+
+    def test_seed_from_bytes_is_stable(self):
+        """Test that content-derived seeds are stable."""
+        self.assertEqual(seed_from_bytes(b"image"), seed_from_bytes("image"))
+        self.assertNotEqual(seed_from_bytes(b"image"), seed_from_bytes(b"other"))
+
+    def test_thread_safety(self):
+        """Test that concurrent callers get the same seeded results."""
+        expected = self.engine.generate_batch(list(range(100)))
+        results = []
+
+        def worker():
+            results.append(self.engine.generate_batch(list(range(100))))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for result in results:
+            self.assertEqual(result, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Tests for embeddings.py
+"""
+import io
+import unittest
+
+import numpy as np
+
+# Import the module to test
+from utils.embeddings import (
+    encode_matrix,
+    from_base64,
+    l2_normalize,
+    to_base64,
+    to_float16_bytes,
+    to_npy,
+)
+
+
+class TestEmbeddings(unittest.TestCase):
+    """Test cases for embedding serialization."""
+
+    def setUp(self):
+        self.embeddings = np.random.default_rng(0).random((3, 16), dtype=np.float32)
+
+    def test_l2_normalize(self):
+        """Test rows get unit norm and zero rows stay zero."""
+        embeddings = np.vstack([self.embeddings, np.zeros(16, dtype=np.float32)])
+        normalized = l2_normalize(embeddings)
+        self.assertTrue(np.allclose(np.linalg.norm(normalized[:3], axis=1), 1.0))
+        self.assertTrue(np.all(normalized[3] == 0))
+        self.assertAlmostEqual(
+            float(np.linalg.norm(l2_normalize(self.embeddings[0]))), 1.0, places=5
+        )
+
+    def test_base64_round_trip(self):
+        """Test base64 encoding keeps float16 precision."""
+        decoded = from_base64(to_base64(self.embeddings[0]))
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertTrue(np.allclose(decoded, self.embeddings[0], atol=1e-3))
+
+    def test_binary_formats(self):
+        """Test raw float16 and .npy encodings of a matrix."""
+        body, content_type = encode_matrix(self.embeddings, "float16")
+        self.assertEqual(content_type, "application/octet-stream")
+        self.assertEqual(len(body), 3 * 16 * 2)
+        self.assertEqual(body, to_float16_bytes(self.embeddings))
+
+        body, content_type = encode_matrix(self.embeddings, "npy")
+        self.assertEqual(content_type, "application/x-npy")
+        loaded = np.load(io.BytesIO(body))
+        self.assertEqual(loaded.dtype, np.float16)
+        self.assertTrue(np.allclose(loaded, self.embeddings, atol=1e-3))
+        self.assertEqual(to_npy(self.embeddings), body)
+
+        with self.assertRaises(ValueError):
+            encode_matrix(self.embeddings, "base64")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+"""
+Tests for file_utils.py
+"""
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+# Import the module to test
+from utils.file_utils import (
+    REFCOUNT_SUFFIX,
+    _store_lock,
+    content_addressed_path,
+    delete_file,
+    get_reference_count,
+    save_uploaded_file,
+    store_content_addressed,
+)
+
+
+def store_in_process(directory, count):
+    """Worker process of the cross-process reference counting test."""
+    for _ in range(count):
+        store_content_addressed(io.BytesIO(b"shared by processes"), directory)
+
+
+class FakeUpload:
+    """Minimal stand-in for werkzeug's FileStorage."""
+
+    def __init__(self, data, filename):
+        self.stream = io.BytesIO(data)
+        self.filename = filename
+
+    def save(self, dst):
+        with open(dst, "wb") as f:
+            f.write(self.stream.read())
+
+
+class TestContentAddressedStore(unittest.TestCase):
+    """Test cases for the content-addressed upload store."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.allowed = {".jpg", ".png"}
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_store_uses_fanout_path(self):
+        """Test that blobs are stored under their digest."""
+        path, created = store_content_addressed(io.BytesIO(b"abc"), self.temp_dir)
+        digest = "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+        self.assertTrue(created)
+        self.assertEqual(path, content_addressed_path(self.temp_dir, digest))
+        self.assertEqual(path.name, digest)
+        self.assertEqual(path.parent.name, digest[2:4])
+        self.assertEqual(path.read_bytes(), b"abc")
+
+    def test_identical_uploads_are_deduplicated(self):
+        """Test that identical content is stored once and reference counted."""
+        self.allowed.add(".jpeg")
+        ok1, path1 = save_uploaded_file(
+            FakeUpload(b"same", "a.jpg"), self.temp_dir, self.allowed
+        )
+        ok2, path2 = save_uploaded_file(
+            FakeUpload(b"same", "b.jpeg"), self.temp_dir, self.allowed
+        )
+
+        self.assertTrue(ok1 and ok2)
+        self.assertEqual(path1, path2)
+        self.assertEqual(get_reference_count(path1), 2)
+
+    def test_different_uploads_do_not_collide(self):
+        """Test that uploads in the same second get distinct files."""
+        for content_addressed in (True, False):
+            with self.subTest(content_addressed=content_addressed):
+                _, path1 = save_uploaded_file(
+                    FakeUpload(b"one", "a.jpg"),
+                    self.temp_dir,
+                    self.allowed,
+                    content_addressed=content_addressed,
+                )
+                _, path2 = save_uploaded_file(
+                    FakeUpload(b"two", "a.jpg"),
+                    self.temp_dir,
+                    self.allowed,
+                    content_addressed=content_addressed,
+                )
+
+                self.assertNotEqual(path1, path2)
+                self.assertEqual(Path(path1).read_bytes(), b"one")
+                self.assertEqual(Path(path2).read_bytes(), b"two")
+
+    def test_delete_releases_references(self):
+        """Test that the blob survives until its last reference is deleted."""
+        _, path = save_uploaded_file(
+            FakeUpload(b"shared", "a.png"), self.temp_dir, self.allowed
+        )
+        save_uploaded_file(FakeUpload(b"shared", "b.png"), self.temp_dir, self.allowed)
+
+        self.assertTrue(delete_file(path))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(get_reference_count(path), 1)
+
+        self.assertTrue(delete_file(path))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(get_reference_count(path), 0)
+
+    def test_delete_checks_references_under_the_store_lock(self):
+        """Test that a reference added while a delete waits keeps the blob."""
+        path, _ = store_content_addressed(io.BytesIO(b"racing"), self.temp_dir)
+        refs = path.with_name(path.name + REFCOUNT_SUFFIX)
+        refs.unlink()
+
+        with _store_lock(path.parent):
+            deleter = threading.Thread(target=delete_file, args=(path,))
+            deleter.start()
+            deleter.join(0.2)
+            self.assertTrue(deleter.is_alive())
+            # As a store_content_addressed of the same content would
+            refs.write_text("2")
+        deleter.join(5)
+
+        self.assertTrue(path.exists())
+        self.assertEqual(get_reference_count(path), 1)
+
+    def test_large_upload_spools_to_disk(self):
+        """Test that uploads larger than the spool limit are stored intact."""
+        data = os.urandom(300 * 1024)
+        path, created = store_content_addressed(
+            io.BytesIO(data), self.temp_dir, spool_max_size=1024
+        )
+
+        self.assertTrue(created)
+        self.assertEqual(path.read_bytes(), data)
+        leftovers = [p for p in Path(self.temp_dir).rglob("*.part")]
+        self.assertEqual(leftovers, [])
+
+    def test_concurrent_identical_uploads(self):
+        """Test that concurrent identical uploads share one blob."""
+        paths = []
+
+        def upload():
+            paths.append(store_content_addressed(io.BytesIO(b"race"), self.temp_dir)[0])
+
+        threads = [threading.Thread(target=upload) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(get_reference_count(paths[0]), 8)
+
+    def test_concurrent_processes_share_reference_count(self):
+        """Test that worker processes storing the same bytes do not lose references."""
+        context = multiprocessing.get_context(
+            "fork" if hasattr(os, "fork") else "spawn"
+        )
+        workers = [
+            context.Process(target=store_in_process, args=(self.temp_dir, 25))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        path, _ = store_content_addressed(
+            io.BytesIO(b"shared by processes"), self.temp_dir
+        )
+        self.assertEqual(get_reference_count(path), 101)
+
+
+if __name__ == "__main__":
+    unittest.main()
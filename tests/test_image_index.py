@@ -0,0 +1,85 @@
+"""
+Tests for image_index.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+# Import the module to test
+from utils.image_index import ImageIndex, scan_archive
+from utils.image_utils import probe_image
+
+
+class TestImageIndex(unittest.TestCase):
+    """Test cases for the archive scanner and its index."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.temp_dir, "archive")
+        os.makedirs(os.path.join(self.archive, "nested"))
+        for i, size in enumerate([(64, 48), (32, 32)]):
+            Image.new("RGB", size, color="red").save(
+                os.path.join(self.archive, f"img_{i}.jpg")
+            )
+        Image.new("RGB", (10, 20)).save(
+            os.path.join(self.archive, "nested", "deep.png")
+        )
+        with open(os.path.join(self.archive, "broken.jpg"), "wb") as f:
+            f.write(b"not an image")
+        with open(os.path.join(self.archive, "notes.txt"), "w") as f:
+            f.write("ignored")
+        self.index = ImageIndex(os.path.join(self.temp_dir, "index.sqlite3"))
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        self.index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_probe_image_reads_header(self):
+        """Test that probing returns metadata without decoding pixels."""
+        path = os.path.join(self.archive, "img_0.jpg")
+        with patch("PIL.ImageFile.ImageFile.load") as mock_load:
+            result = probe_image(path)
+
+        mock_load.assert_not_called()
+        self.assertTrue(result["valid"])
+        self.assertEqual(result["format"], "JPEG")
+        self.assertEqual((result["width"], result["height"]), (64, 48))
+
+    def test_scan_indexes_archive(self):
+        """Test that a scan records valid and invalid images."""
+        stats = scan_archive(self.archive, self.index, max_workers=4)
+
+        self.assertEqual(stats["seen"], 4)
+        self.assertEqual(stats["probed"], 4)
+        self.assertEqual(stats["invalid"], 1)
+        self.assertEqual(len(self.index), 4)
+        record = self.index.get(os.path.join(self.archive, "nested", "deep.png"))
+        self.assertTrue(record["valid"])
+        self.assertEqual((record["width"], record["height"]), (10, 20))
+        self.assertEqual(len(list(self.index.valid_paths())), 3)
+
+    def test_rescan_only_probes_changed_files(self):
+        """Test that unchanged files are skipped and deleted files pruned."""
+        scan_archive(self.archive, self.index)
+        changed = os.path.join(self.archive, "img_1.jpg")
+        Image.new("RGB", (128, 96)).save(changed)
+        os.utime(changed, ns=(0, 1))
+        os.remove(os.path.join(self.archive, "img_0.jpg"))
+
+        stats = scan_archive(self.archive, self.index)
+
+        self.assertEqual(stats["probed"], 1)
+        self.assertEqual(stats["unchanged"], 2)
+        self.assertEqual(stats["removed"], 1)
+        self.assertEqual(self.index.get(changed)["width"], 128)
+        self.assertIsNone(self.index.get(os.path.join(self.archive, "img_0.jpg")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,74 +1,101 @@
-""
+"""
 Tests for image_utils.py
 """
 import os
-import unittest
+import shutil
 import tempfile
+import unittest
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
 
 # Import the module to test
-from utils.image_utils import validate_image, get_image_metadata, resize_image
+from utils.image_utils import (
+    get_image_metadata,
+    probe_image,
+    resize_image,
+    validate_image,
+)
+
 
 class TestImageUtils(unittest.TestCase):
     """Test cases for image utilities."""
-    
+
     def setUp(self):
         """Set up test fixtures."""
         self.test_dir = os.path.dirname(os.path.abspath(__file__))
-        self.test_image = os.path.join(self.test_dir, '..', 'static', 'test_image.jpg')
+        self.test_image = os.path.join(self.test_dir, "..", "static", "test_image.jpg")
         self.temp_dir = tempfile.mkdtemp()
-        
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
     def test_validate_image_nonexistent(self):
         """Test validation of non-existent image."""
         result, message = validate_image("nonexistent.jpg")
         self.assertFalse(result)
         self.assertIn("does not exist", message.lower())
-        
-    @patch('PIL.Image.open')
-    def test_validate_image_invalid(self, mock_open):
+
+    @patch("os.path.isfile", return_value=True)
+    @patch("os.path.exists", return_value=True)
+    @patch("PIL.Image.open")
+    def test_validate_image_invalid(self, mock_open, mock_exists, mock_isfile):
         """Test validation of invalid image."""
         mock_open.side_effect = Exception("Invalid image")
         result, message = validate_image("dummy.jpg")
         self.assertFalse(result)
         self.assertIn("invalid", message.lower())
-        
-    @patch('PIL.Image.open')
+        mock_open.assert_called_once_with("dummy.jpg")
+
+    @patch("PIL.Image.open")
+    def test_probe_image_invalid(self, mock_open):
+        """Test that probe_image reports unreadable images of an existing file."""
+        mock_open.side_effect = Exception("Invalid image")
+        path = os.path.join(self.temp_dir, "dummy.jpg")
+        Path(path).write_bytes(b"not an image")
+        result = probe_image(path)
+        self.assertFalse(result["valid"])
+        self.assertIn("invalid", result["error"].lower())
+        self.assertEqual(result["file_size"], 12)
+
+    @patch("PIL.Image.open")
     def test_get_image_metadata(self, mock_open):
         """Test getting image metadata."""
         # Create a mock image
         mock_img = MagicMock()
-        mock_img.format = 'JPEG'
-        mock_img.mode = 'RGB'
+        mock_img.format = "JPEG"
+        mock_img.mode = "RGB"
         mock_img.size = (800, 600)
         mock_img.width = 800
         mock_img.height = 600
         mock_open.return_value.__enter__.return_value = mock_img
-        
+
         # Mock file size
-        with patch('os.path.getsize', return_value=1024):
+        with patch("os.path.getsize", return_value=1024):
             metadata = get_image_metadata("dummy.jpg")
-            
-        self.assertEqual(metadata['format'], 'JPEG')
-        self.assertEqual(metadata['mode'], 'RGB')
-        self.assertEqual(metadata['size'], (800, 600))
-        self.assertEqual(metadata['file_size'], 1024)
-        
-    @patch('PIL.Image.Image.thumbnail')
-    @patch('PIL.Image.open')
-    def test_resize_image(self, mock_open, mock_thumbnail):
+
+        self.assertEqual(metadata["format"], "JPEG")
+        self.assertEqual(metadata["mode"], "RGB")
+        self.assertEqual(metadata["size"], (800, 600))
+        self.assertEqual(metadata["file_size"], 1024)
+
+    @patch("PIL.Image.open")
+    def test_resize_image(self, mock_open):
         """Test image resizing."""
         # Setup mock
         mock_img = MagicMock()
         mock_open.return_value.__enter__.return_value = mock_img
-        
+
         # Call the function
         result = resize_image("input.jpg", "output.jpg")
-        
+
         # Assertions
         self.assertTrue(result)
-        mock_thumbnail.assert_called_once()
+        mock_img.thumbnail.assert_called_once_with((800, 800), Image.Resampling.LANCZOS)
         mock_img.save.assert_called_once_with("output.jpg")
 
-if __name__ == '__main__':
+
+if __name__ == "__main__":
     unittest.main()
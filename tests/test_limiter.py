@@ -0,0 +1,72 @@
+"""
+Tests for limiter.py
+"""
+import unittest
+
+# Import the module to test
+from limiter import AIMDLimit, ConcurrencyLimiter, GradientLimit, StaticLimit
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    """Test cases for concurrency limiting."""
+
+    def test_static_limit_rejects_excess(self):
+        """Test that requests beyond the limit are rejected immediately."""
+        limiter = ConcurrencyLimiter(StaticLimit(initial_limit=2))
+        first, second = limiter.try_acquire(), limiter.try_acquire()
+
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(limiter.try_acquire())
+
+        limiter.release(first)
+        self.assertIsNotNone(limiter.try_acquire())
+        self.assertEqual(limiter.stats()["rejected"], 1)
+        self.assertEqual(limiter.stats()["in_flight"], 2)
+
+    def test_aimd_backs_off_on_slow_responses(self):
+        """Test multiplicative decrease on latency above the target."""
+        algorithm = AIMDLimit(
+            initial_limit=10, min_limit=2, latency_target=1.0, backoff=0.5
+        )
+        algorithm.update(latency=2.0, in_flight=10, overloaded=False)
+        self.assertEqual(algorithm.limit, 5)
+        for _ in range(5):
+            algorithm.update(latency=0.1, in_flight=1, overloaded=True)
+        self.assertEqual(algorithm.limit, 2)
+
+    def test_aimd_grows_only_when_used(self):
+        """Test additive increase while the limit is in use."""
+        algorithm = AIMDLimit(initial_limit=4, max_limit=5, latency_target=1.0)
+        algorithm.update(latency=0.1, in_flight=1, overloaded=False)
+        self.assertEqual(algorithm.limit, 4)
+        for _ in range(100):
+            algorithm.update(latency=0.1, in_flight=4, overloaded=False)
+        self.assertEqual(algorithm.limit, 5)
+
+    def test_gradient_shrinks_when_latency_rises(self):
+        """Test that the gradient limit follows latency inflation."""
+        algorithm = GradientLimit(initial_limit=20, min_limit=1, max_limit=100)
+        for _ in range(50):
+            algorithm.update(latency=0.1, in_flight=20, overloaded=False)
+        steady = algorithm.limit
+        for _ in range(20):
+            algorithm.update(
+                latency=1.0, in_flight=int(algorithm.limit), overloaded=False
+            )
+        self.assertGreater(steady, 20)
+        self.assertLess(algorithm.limit, steady / 2)
+
+    def test_from_config(self):
+        """Test building limiters from configuration."""
+        limiter = ConcurrencyLimiter.from_config(
+            {"algorithm": "static", "initial_limit": 3, "retry_after": 1}
+        )
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(limiter.stats()["algorithm"], "static")
+        with self.assertRaises(ValueError):
+            ConcurrencyLimiter.from_config({"algorithm": "magic"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests for model_registry.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+# Import the module to test
+from model_registry import BACKBONES, get_backbone_spec, load_backbone
+from preprocessing import fold_normalization
+
+
+class TestModelRegistry(unittest.TestCase):
+    """Test cases for the backbone registry."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_feature_dimensions(self):
+        """Test every backbone yields spatial features of its declared width."""
+        batch = torch.randn(1, 3, 64, 64)
+        for name in BACKBONES:
+            with self.subTest(name=name):
+                model, spec = load_backbone(name, pretrained=False)
+                self.assertIsInstance(model[0], nn.Conv2d)
+                with torch.no_grad():
+                    features = model(batch)
+                self.assertEqual(features.dim(), 4)
+                self.assertEqual(features.shape[1], spec.feature_dim)
+                # The uint8 pipeline needs a foldable stem
+                fold_normalization(model, spec.mean, spec.std)
+
+    def test_preprocessing_follows_weights(self):
+        """Test per-model preprocessing comes from the weights presets."""
+        spec = get_backbone_spec("efficientnet_b0")
+        self.assertEqual(spec.crop, 224)
+        self.assertEqual(spec.interpolation, spec.weights.transforms().interpolation)
+        self.assertEqual(len(spec.mean), 3)
+
+    def test_aliases_and_unknown_names(self):
+        """Test the legacy default name and unknown names."""
+        self.assertEqual(get_backbone_spec("sports-captioner-v1").name, "resnet50")
+        with self.assertRaises(ValueError):
+            get_backbone_spec("vgg16")
+
+    def test_local_weights(self):
+        """Test loading weights from a local file for offline hosts."""
+        torch.manual_seed(0)
+        reference = BACKBONES["mobilenet_v3_small"].builder(weights=None)
+        path = os.path.join(self.temp_dir, "mobilenet.pth")
+        torch.save(reference.state_dict(), path)
+
+        model, _ = load_backbone("mobilenet_v3_small", weights_path=path)
+        torch.testing.assert_close(model[0].weight, reference.features[0][0].weight)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for phash.py
+"""
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Import the module to test
+from utils.phash import NearDuplicateIndex, dhash, hamming_distance
+
+
+def photo(seed=0, size=(640, 360)):
+    noise = np.random.default_rng(seed).random((9, 16, 3)) * 255
+    image = Image.fromarray(noise.astype(np.uint8)).resize(size, Image.BICUBIC)
+    return image.filter(ImageFilter.GaussianBlur(4))
+
+
+def jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class TestDHash(unittest.TestCase):
+    """Test cases for the difference hash."""
+
+    def test_near_duplicates_hash_close(self):
+        """Test re-encoded and resized copies stay within a few bits."""
+        image = photo()
+        base = dhash(jpeg(image))
+        self.assertLess(base, 1 << 64)
+        self.assertLessEqual(hamming_distance(base, dhash(jpeg(image, quality=50))), 4)
+        self.assertLessEqual(
+            hamming_distance(base, dhash(jpeg(image.resize((320, 180))))), 4
+        )
+        self.assertGreater(hamming_distance(base, dhash(jpeg(photo(seed=1)))), 10)
+
+    def test_hash_from_path(self):
+        """Test paths and bytes hash the same."""
+        data = jpeg(photo())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "photo.jpg")
+            with open(path, "wb") as f:
+                f.write(data)
+            self.assertEqual(dhash(path), dhash(data))
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    """Test cases for multi-index hash lookup."""
+
+    def test_lookup_within_radius(self):
+        """Test the closest entry within the radius is found, and nothing beyond it."""
+        rng = random.Random(0)
+        index = NearDuplicateIndex(radius=4)
+        stored = [rng.getrandbits(64) for _ in range(2000)]
+        for i, value in enumerate(stored):
+            index.add(value, i)
+
+        for distance in range(5):
+            query = stored[7]
+            for bit in rng.sample(range(64), distance):
+                query ^= 1 << bit
+            self.assertEqual(index.lookup(query), (distance, 7))
+
+        query = stored[7] ^ 0b11111  # five bits away
+        match = index.lookup(query)
+        self.assertTrue(match is None or match[1] != 7)
+
+        stats = index.stats()
+        self.assertEqual(stats["lookups"], 6)
+        self.assertGreaterEqual(stats["hits"], 5)
+        self.assertIn("lookup_p95_us", stats)
+
+    def test_eviction(self):
+        """Test the oldest entries are evicted beyond max_entries."""
+        index = NearDuplicateIndex(radius=2, max_entries=2)
+        index.add(0, "a")
+        index.add(0xFFFF0000FFFF0000, "b")
+        index.add(0x0000FFFF0000FFFF, "c")
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.lookup(0))
+        self.assertEqual(index.lookup(0x0000FFFF0000FFFF), (0, "c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
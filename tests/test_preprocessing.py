@@ -0,0 +1,204 @@
+"""
+Tests for preprocessing.py
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+from torchvision import models
+
+# Import the module to test
+from model_registry import get_backbone_spec
+from preprocessing import (
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    BufferPool,
+    UInt8Pipeline,
+    decode_to_uint8,
+    fold_normalization,
+    normalization_constants,
+    pil_to_tensor_,
+    resize_and_crop_uint8,
+)
+
+
+def make_backbone():
+    torch.manual_seed(0)
+    model = models.resnet18(weights=None)
+    return torch.nn.Sequential(*(list(model.children())[:-2])).eval()
+
+
+class TestUInt8Preprocessing(unittest.TestCase):
+    """Test cases for the uint8 pipeline and folded normalization."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = make_backbone()
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 256, (30, 40, 3), dtype=np.uint8)
+        # Smooth image so resampling differences stay small
+        self.image = Image.fromarray(base).resize((400, 300), Image.Resampling.BICUBIC)
+        self.image_path = os.path.join(self.temp_dir, "test.png")
+        self.image.save(self.image_path)
+        self.transform = transforms.Compose(
+            [
+                transforms.Resize(256),
+                transforms.CenterCrop(224),
+                transforms.ToTensor(),
+                transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+            ]
+        )
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_decode_matches_pil(self):
+        """Test decoding from a path and from bytes."""
+        expected = torch.from_numpy(np.array(self.image)).permute(2, 0, 1)
+        self.assertTrue(torch.equal(decode_to_uint8(self.image_path), expected))
+        buffer = io.BytesIO()
+        self.image.save(buffer, format="PNG")
+        self.assertTrue(torch.equal(decode_to_uint8(buffer.getvalue()), expected))
+
+    def test_uint8_resize_crop_parity(self):
+        """Test that uint8 resize/crop matches the current transform closely."""
+        crop = resize_and_crop_uint8(decode_to_uint8(self.image_path))
+        mean = torch.tensor(IMAGENET_MEAN).view(3, 1, 1)
+        std = torch.tensor(IMAGENET_STD).view(3, 1, 1)
+        actual = (crop.float() / 255 - mean) / std
+        expected = self.transform(self.image)
+
+        self.assertEqual(crop.dtype, torch.uint8)
+        self.assertEqual(tuple(crop.shape), (3, 224, 224))
+        # Within a couple of 8-bit levels of PIL's resampling
+        self.assertLess((actual - expected).abs().mul(std).mul(255).max().item(), 3.0)
+
+        for name in ("resnet50", "efficientnet_b0"):
+            with self.subTest(backbone=name):
+                spec = get_backbone_spec(name)
+                # The transform SportsCaptioner builds for the "pil" path
+                transform = transforms.Compose(
+                    [
+                        transforms.Resize(
+                            spec.resize, interpolation=spec.interpolation
+                        ),
+                        transforms.CenterCrop(spec.crop),
+                        transforms.PILToTensor(),
+                    ]
+                )
+                pipeline = UInt8Pipeline(
+                    self.model,
+                    resize=spec.resize,
+                    crop=spec.crop,
+                    mean=spec.mean,
+                    std=spec.std,
+                    interpolation=spec.interpolation,
+                )
+                crop = pipeline.prepare(self.image_path)
+                difference = crop.float() - transform(self.image).float()
+                self.assertLess(difference.abs().max().item(), 3.0)
+
+    def test_folded_normalization_is_exact(self):
+        """Test that the folded model matches the original on the same pixels."""
+        crop = resize_and_crop_uint8(decode_to_uint8(self.image_path))
+        mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+        raw = crop.unsqueeze(0).float()
+
+        folded = fold_normalization(self.model)
+        with torch.no_grad():
+            expected = self.model((raw / 255 - mean) / std)
+            actual = folded(folded[0].pad(raw))
+
+        torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
+
+    def test_pipeline_matches_current_transform(self):
+        """Test pipeline features against the current PIL transform path."""
+        pipeline = UInt8Pipeline(self.model, max_batch_size=2)
+        features = pipeline.run([self.image_path, self.image_path])
+        with torch.no_grad():
+            expected = self.model(self.transform(self.image).unsqueeze(0))
+
+        self.assertEqual(features.shape[0], 2)
+        self.assertEqual(features.shape[1:], expected.shape[1:])
+        similarity = torch.nn.functional.cosine_similarity(
+            features[0].flatten(), expected[0].flatten(), dim=0
+        )
+        self.assertGreater(similarity.item(), 0.99)
+
+    def test_pipeline_keeps_border_and_layout(self):
+        """Test that loads only touch the buffer interior."""
+        pipeline = UInt8Pipeline(self.model, max_batch_size=1)
+        pipeline.run([self.image_path])
+
+        self.assertTrue(
+            pipeline.buffer.is_contiguous(memory_format=torch.channels_last)
+        )
+        for channel, mean in enumerate(IMAGENET_MEAN):
+            border = pipeline.buffer[0, channel, : pipeline.pad_h]
+            self.assertTrue(torch.allclose(border, torch.full_like(border, 255 * mean)))
+
+    def test_pipeline_rejects_oversized_batch(self):
+        """Test the batch size limit."""
+        pipeline = UInt8Pipeline(self.model, max_batch_size=1)
+        with self.assertRaises(ValueError):
+            pipeline.run([self.image_path, self.image_path])
+
+
+class TestBufferPool(unittest.TestCase):
+    """Test cases for pooled buffers and in-place conversion."""
+
+    def test_buffers_are_reused(self):
+        """Test that released buffers are handed out again."""
+        pool = BufferPool(batch_size=4, image_size=32)
+        with pool.acquire() as first:
+            self.assertEqual(tuple(first.shape), (4, 3, 32, 32))
+        with pool.acquire() as second:
+            self.assertIs(second, first)
+        self.assertEqual(pool.allocated, 1)
+
+    def test_concurrent_users_get_distinct_buffers(self):
+        """Test that nested acquisitions never share a buffer."""
+        pool = BufferPool(batch_size=1, image_size=8, channels_last=True)
+        with pool.acquire() as first, pool.acquire() as second:
+            self.assertIsNot(first, second)
+            self.assertTrue(first.is_contiguous(memory_format=torch.channels_last))
+        self.assertEqual(pool.allocated, 2)
+
+    def test_pil_to_tensor_matches_transform(self):
+        """Test in-place conversion against ToTensor + Normalize."""
+        image = Image.fromarray(
+            np.random.default_rng(1).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+        )
+        expected = transforms.Compose(
+            [
+                transforms.ToTensor(),
+                transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+            ]
+        )(image)
+        scale, shift = normalization_constants()
+        for channels_last in (False, True):
+            with self.subTest(channels_last=channels_last):
+                pool = BufferPool(batch_size=2, channels_last=channels_last)
+                with pool.acquire() as buffer:
+                    slot = buffer[1]
+                    result = pil_to_tensor_(image, slot, scale, shift)
+                    self.assertEqual(result.data_ptr(), slot.data_ptr())
+                    torch.testing.assert_close(
+                        buffer[1], expected, rtol=1e-5, atol=1e-5
+                    )
+
+
+if __name__ == "__main__":
+    unittest.main()
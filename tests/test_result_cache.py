@@ -0,0 +1,42 @@
+"""
+Tests for utils/result_cache.py
+"""
+import unittest
+
+# Import the module to test
+from utils.result_cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    """Test cases for the digest-keyed result cache."""
+
+    def test_get_and_put(self):
+        """Test hits, misses and the size check."""
+        cache = ResultCache(max_entries=10)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 3, "Caption: A")
+        self.assertEqual(cache.get("a"), "Caption: A")
+        self.assertEqual(cache.get("a", 3), "Caption: A")
+        self.assertIsNone(cache.get("a", 4))
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 2, "misses": 2})
+
+    def test_evicts_least_recently_used(self):
+        """Test that reads keep an entry alive."""
+        cache = ResultCache(max_entries=2)
+        cache.put("a", 1, "A")
+        cache.put("b", 1, "B")
+        cache.get("a")
+        cache.put("c", 1, "C")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "A")
+
+    def test_disabled(self):
+        """Test that zero entries disables caching."""
+        cache = ResultCache(max_entries=0)
+        cache.put("a", 1, "A")
+        self.assertIsNone(cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
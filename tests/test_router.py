@@ -0,0 +1,260 @@
+"""
+Tests for router.py
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+import unittest
+from collections import Counter
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+from werkzeug.test import EnvironBuilder
+
+# Import the module to test
+from router import HashRing, NoHealthyNode, Router, create_app
+
+
+def start_node(name):
+    """
+    Fake captioner node on a free local port: it answers with its name and
+    the image digest.
+    """
+    node = Flask(name)
+    node.healthy = True
+    # Seconds the raw upload route waits before answering
+    node.delay = 0
+
+    @node.route("/healthz")
+    def healthz():
+        return jsonify({"status": "ok"}), 200 if node.healthy else 503
+
+    @node.route("/generate_caption", methods=["POST"])
+    def generate_caption():
+        data = request.files["image"].read()
+        return jsonify({"node": name, "sha256": hashlib.sha256(data).hexdigest()})
+
+    @node.route("/generate_caption/raw", methods=["POST"])
+    def generate_caption_raw():
+        time.sleep(node.delay)
+        return jsonify(
+            {
+                "node": name,
+                "sha256": hashlib.sha256(request.get_data()).hexdigest(),
+                "request_id": request.headers.get("X-Request-ID"),
+            }
+        )
+
+    @node.route("/generate_captions", methods=["POST"])
+    def generate_captions():
+        return Response(
+            (json.dumps({"index": i}) + "\n" for i in range(3)),
+            mimetype="application/x-ndjson",
+        )
+
+    @node.route("/generate_caption/lookup")
+    def lookup():
+        return jsonify({"node": name, "sha256": request.args["sha256"]})
+
+    server = make_server("127.0.0.1", 0, node, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return node, server, f"http://127.0.0.1:{server.server_port}"
+
+
+class TestHashRing(unittest.TestCase):
+    """Test cases for the consistent-hash ring."""
+
+    def setUp(self):
+        self.keys = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(6000)]
+
+    def test_keys_spread_over_nodes(self):
+        """Test every node owns a fair share of the keys."""
+        ring = HashRing(["a", "b", "c"])
+        shares = Counter(ring.node_for(key) for key in self.keys)
+        for node in "abc":
+            self.assertGreater(shares[node] / len(self.keys), 0.25)
+            self.assertLess(shares[node] / len(self.keys), 0.42)
+
+    def test_membership_changes_move_few_keys(self):
+        """Test that adding or removing a node only moves that node's keys."""
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in self.keys}
+
+        ring.add("d")
+        after = {key: ring.node_for(key) for key in self.keys}
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(all(after[key] == "d" for key in moved))
+        self.assertLess(len(moved) / len(self.keys), 0.35)
+
+        ring.remove("b")
+        for key in self.keys:
+            if after[key] != "b":
+                self.assertEqual(ring.node_for(key), after[key])
+        self.assertEqual(list(HashRing().walk("key")), [])
+
+    def test_walk_visits_every_node_once(self):
+        """Test that the walk starts at the owner and lists each node once."""
+        ring = HashRing(["a", "b", "c"])
+        order = list(ring.walk(self.keys[0]))
+        self.assertEqual(sorted(order), ["a", "b", "c"])
+        self.assertEqual(order[0], ring.node_for(self.keys[0]))
+
+
+class TestRouter(unittest.TestCase):
+    """Test cases for node selection, health checking and proxying."""
+
+    def setUp(self):
+        self.nodes = [start_node(name) for name in ("node-a", "node-b", "node-c")]
+        self.urls = [url for _, _, url in self.nodes]
+        self.router = Router(self.urls, unhealthy_after=1, health_timeout=2)
+        self.client = create_app(self.router).test_client()
+
+    def tearDown(self):
+        for _, server, _ in self.nodes:
+            server.shutdown()
+            server.server_close()
+
+    def test_bounded_load_spills_hot_keys(self):
+        """Test that a busy owner passes requests on until loads even out."""
+        router = Router(["a", "b", "c"], load_factor=1.25)
+        held = [router.acquire("hot") for _ in range(30)]
+        loads = Counter(node.url for node in held)
+        # Capacity is ceil(1.25 * 30 / 3) = 13 when the last request arrives
+        self.assertLessEqual(max(loads.values()), 13)
+        self.assertEqual(sum(loads.values()), 30)
+        owner = router.nodes[router.ring.node_for("hot")]
+        self.assertEqual(owner.spilled, 0)
+        self.assertEqual(
+            sum(node.spilled for node in router.nodes.values()), 30 - owner.routed
+        )
+        for node in held:
+            router.release(node)
+        self.assertEqual(router.acquire("hot"), owner)
+        with self.assertRaises(ValueError):
+            Router(["a"], load_factor=0.5)
+
+    def test_same_image_reaches_same_node(self):
+        """Test that raw and multipart uploads and lookups of an image share a node."""
+        image = b"\xff\xd8" + bytes(range(256)) * 40
+        digest = hashlib.sha256(image).hexdigest()
+        raw = self.client.post(
+            "/generate_caption/raw",
+            data=image,
+            headers={"Content-Type": "image/jpeg", "X-Request-ID": "trace-1"},
+        )
+        self.assertEqual(raw.status_code, 200)
+        self.assertEqual(raw.get_json()["sha256"], digest)
+        self.assertEqual(raw.get_json()["request_id"], "trace-1")
+        node = raw.get_json()["node"]
+
+        multipart = self.client.post(
+            "/generate_caption",
+            content_type="multipart/form-data",
+            data={"image": (io.BytesIO(image), "photo.jpg")},
+        )
+        lookup = self.client.get(f"/generate_caption/lookup?sha256={digest}")
+        self.assertEqual(multipart.get_json(), {"node": node, "sha256": digest})
+        self.assertEqual(lookup.get_json()["node"], node)
+        self.assertEqual(
+            lookup.headers["X-Routed-To"], self.router.ring.node_for(digest)
+        )
+
+        # Different images spread over the nodes
+        owners = {
+            self.client.post("/generate_caption/raw", data=bytes([i]) * 100).get_json()[
+                "node"
+            ]
+            for i in range(30)
+        }
+        self.assertEqual(len(owners), 3)
+        stats = self.router.stats()["nodes"]
+        self.assertEqual(sum(s["routed"] for s in stats.values()), 33)
+        self.assertTrue(all(s["in_flight"] == 0 for s in stats.values()))
+
+    def test_streams_chunked_responses(self):
+        """Test that NDJSON batches are passed on and release the node when done."""
+        response = self.client.post("/generate_captions", data=b"batch")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in response.data.splitlines()],
+            [{"index": 0}, {"index": 1}, {"index": 2}],
+        )
+        response.close()
+        self.assertTrue(
+            all(s["in_flight"] == 0 for s in self.router.stats()["nodes"].values())
+        )
+
+    def test_unread_stream_releases_node(self):
+        """Test that a stream closed before its body was read releases the node."""
+        # Call the app directly, as the test client starts iterating the body
+        environ = EnvironBuilder(
+            path="/generate_captions", method="POST", data=b"batch"
+        ).get_environ()
+        body = self.client.application(environ, lambda status, headers: None)
+        self.assertEqual(
+            sum(s["in_flight"] for s in self.router.stats()["nodes"].values()), 1
+        )
+        body.close()
+        self.assertTrue(
+            all(s["in_flight"] == 0 for s in self.router.stats()["nodes"].values())
+        )
+
+    def test_timeout_is_not_retried(self):
+        """Test that a request is not sent elsewhere after its node times out."""
+        router = Router(self.urls, timeout=0.2)
+        client = create_app(router).test_client()
+        for node, _, _ in self.nodes:
+            node.delay = 1
+        response = client.post("/generate_caption/raw", data=b"slow upload")
+        self.assertEqual(response.status_code, 504)
+        stats = router.stats()["nodes"]
+        self.assertEqual(sum(s["routed"] for s in stats.values()), 1)
+        self.assertEqual(sum(s["errors"] for s in stats.values()), 1)
+        self.assertTrue(
+            all(s["healthy"] and s["in_flight"] == 0 for s in stats.values())
+        )
+
+    def test_failover_and_health_checks(self):
+        """Test that a failed node's keys move on and come back after it recovers."""
+        image = b"image bytes" * 100
+        owner = self.router.ring.node_for(hashlib.sha256(image).hexdigest())
+        index = self.urls.index(owner)
+        fallback = list(self.router.ring.walk(hashlib.sha256(image).hexdigest()))[1]
+
+        # A node that stopped answering is skipped on the first failed connection
+        _, server, _ = self.nodes[index]
+        server.shutdown()
+        server.server_close()
+        response = self.client.post("/generate_caption/raw", data=image)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Routed-To"], fallback)
+        self.assertFalse(self.router.nodes[owner].healthy)
+        self.assertEqual(self.router.nodes[owner].errors, 1)
+
+        # Probes bring a recovered node back and take failing ones out
+        self.nodes[index] = start_node("node-restarted")
+        self.router.nodes[owner].port = self.nodes[index][1].server_port
+        self.nodes[(index + 1) % 3][0].healthy = False
+        self.router.check_health()
+        self.assertTrue(self.router.nodes[owner].healthy)
+        self.assertFalse(self.router.nodes[self.urls[(index + 1) % 3]].healthy)
+        self.assertEqual(
+            self.client.post("/generate_caption/raw", data=image).get_json()["node"],
+            "node-restarted",
+        )
+
+        for node, _, _ in self.nodes:
+            node.healthy = False
+        self.router.check_health()
+        response = self.client.post("/generate_caption/raw", data=image)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertEqual(self.client.get("/healthz").status_code, 503)
+        with self.assertRaises(NoHealthyNode):
+            self.router.acquire("key")
+
+
+if __name__ == "__main__":
+    unittest.main()
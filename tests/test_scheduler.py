@@ -0,0 +1,105 @@
+"""
+Tests for scheduler.py
+"""
+import threading
+import time
+import unittest
+
+# Import the module to test
+from scheduler import DeadlineExceeded, InferenceScheduler, UnknownLane
+
+
+class TestInferenceScheduler(unittest.TestCase):
+    """Test cases for priority lanes and deadlines."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.gate = threading.Event()
+        self.order = []
+
+        def handler(payload):
+            self.gate.wait(5)
+            self.order.append(payload)
+            return payload
+
+        self.scheduler = InferenceScheduler(
+            handler, lanes={"interactive": 3, "batch": 1}
+        )
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        self.gate.set()
+        self.scheduler.shutdown()
+
+    def block_worker(self):
+        """Occupy the worker so that later submissions queue up."""
+        future = self.scheduler.submit("blocker")
+        while self.scheduler.stats()["interactive"]["queued"]:
+            time.sleep(0.01)
+        return future
+
+    def test_weighted_share_between_lanes(self):
+        """Test that lanes are served in proportion to their weights."""
+        self.block_worker()
+        futures = [self.scheduler.submit(f"b{i}", "batch") for i in range(4)]
+        futures += [self.scheduler.submit(f"i{i}", "interactive") for i in range(6)]
+        self.gate.set()
+        for future in futures:
+            future.result(5)
+
+        served = self.order[1:]
+        # The first four picks contain three interactive requests for one batch request
+        self.assertEqual(sum(1 for p in served[:4] if p.startswith("i")), 3)
+        self.assertEqual(sorted(served), sorted(f.result() for f in futures))
+
+    def test_expired_requests_are_dropped(self):
+        """Test that requests past their deadline never reach the handler."""
+        self.block_worker()
+        expired = self.scheduler.submit("late", "batch", timeout=0.01)
+        live = self.scheduler.submit("on-time", "batch", timeout=10)
+        time.sleep(0.05)
+        self.gate.set()
+
+        with self.assertRaises(DeadlineExceeded):
+            expired.result(5)
+        self.assertEqual(live.result(5), "on-time")
+        self.assertNotIn("late", self.order)
+        self.assertEqual(self.scheduler.stats()["batch"]["expired"], 1)
+
+    def test_run_times_out(self):
+        """Test that run() gives up after the timeout and cancels the request."""
+        self.block_worker()
+        with self.assertRaises(DeadlineExceeded):
+            self.scheduler.run("slow", timeout=0.05)
+        self.gate.set()
+        self.scheduler.run("next", timeout=5)
+        self.assertNotIn("slow", self.order)
+
+    def test_unknown_lane(self):
+        """Test that unknown lanes are rejected."""
+        with self.assertRaises(UnknownLane):
+            self.scheduler.submit("x", "vip")
+
+    def test_stats_report_queue_waits(self):
+        """Test the per-lane statistics."""
+        self.gate.set()
+        self.assertEqual(self.scheduler.run("a", "batch", timeout=5), "a")
+        stats = self.scheduler.stats()
+
+        self.assertEqual(stats["batch"]["completed"], 1)
+        self.assertEqual(stats["batch"]["submitted"], 1)
+        self.assertGreaterEqual(stats["batch"]["wait_p95_ms"], 0.0)
+        self.assertEqual(stats["interactive"]["weight"], 3)
+
+    def test_handler_errors_propagate(self):
+        """Test that handler exceptions reach the caller."""
+        scheduler = InferenceScheduler(lambda payload: 1 / 0)
+        try:
+            with self.assertRaises(ZeroDivisionError):
+                scheduler.run("x", timeout=5)
+        finally:
+            scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
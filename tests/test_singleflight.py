@@ -0,0 +1,273 @@
+"""
+Tests for singleflight.py
+"""
+import asyncio
+import threading
+import time
+import unittest
+
+# Import the module to test
+from utils.singleflight import AsyncSingleFlight, SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test cases for single-flight coalescing."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_work(self):
+        self.calls += 1
+        self.release.wait(5)
+        return "result"
+
+    def run_concurrently(self, count, key="key"):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(self.flight.do(key, self.slow_work))
+            )
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        # Wait until every follower has joined the in-flight call
+        deadline = time.time() + 5
+        while self.flight.stats()["coalesced"] < count - 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Test that concurrent identical calls run the work once."""
+        results = self.run_concurrently(10)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([r[0] for r in results], ["result"] * 10)
+        self.assertEqual(sum(1 for r in results if r[1]), 9)
+        self.assertEqual(
+            self.flight.stats(), {"executed": 1, "coalesced": 9, "in_flight": 0}
+        )
+
+    def test_sequential_calls_are_not_cached(self):
+        """Test that a finished call does not serve later calls."""
+        self.release.set()
+        self.flight.do("key", self.slow_work)
+        self.flight.do("key", self.slow_work)
+        self.assertEqual(self.calls, 2)
+
+    def test_errors_propagate_to_all_callers(self):
+        """Test that an exception reaches the leader and every follower."""
+        errors = []
+        started = threading.Event()
+
+        def failing():
+            started.set()
+            self.release.wait(5)
+            raise ValueError("boom")
+
+        def call():
+            try:
+                self.flight.do("key", failing)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=call) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while self.flight.stats()["coalesced"] < 3:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+    def test_followers_wait_at_most_their_timeout(self):
+        """Test that a follower times out on its own while the leader finishes."""
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(self.flight.do("key", self.slow_work))
+        )
+        leader.start()
+        while self.flight.stats()["in_flight"] == 0:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.flight.do("key", self.slow_work, timeout=0.05)
+        self.assertLess(time.monotonic() - start, 2)
+        self.release.set()
+        leader.join()
+        self.assertEqual(results, [("result", False)])
+        self.assertEqual(self.calls, 1)
+
+    def test_batch_runs_only_keys_not_in_flight(self):
+        """Test that do_batch shares in-flight and repeated keys and runs the rest."""
+        leader = threading.Thread(target=lambda: self.flight.do("a", self.slow_work))
+        leader.start()
+        while self.flight.stats()["in_flight"] == 0:
+            time.sleep(0.01)
+        batches = []
+
+        def run(keys):
+            batches.append(keys)
+            self.release.set()
+            return [key.upper() for key in keys]
+
+        results = self.flight.do_batch(["a", "b", "c", "b"], run)
+        leader.join()
+        self.assertEqual(batches, [["b", "c"]])
+        self.assertEqual(
+            results, [("result", True), ("B", False), ("C", False), ("B", True)]
+        )
+        self.assertEqual(
+            self.flight.stats(), {"executed": 3, "coalesced": 2, "in_flight": 0}
+        )
+
+        self.release.clear()
+        self.calls = 0
+        leader = threading.Thread(target=lambda: self.flight.do("a", self.slow_work))
+        leader.start()
+        while self.flight.stats()["in_flight"] == 0:
+            time.sleep(0.01)
+        with self.assertRaises(TimeoutError):
+            self.flight.do_batch(["a"], run, timeout=0.05)
+        self.release.set()
+        leader.join()
+
+    def test_batch_with_missing_results_fails_every_caller(self):
+        """Test that a batch returning too few results fails its followers."""
+        errors = []
+
+        def run(keys):
+            self.release.wait(5)
+            return [key.upper() for key in keys[:-1]]
+
+        def follow():
+            try:
+                self.flight.do("b", self.slow_work, timeout=5)
+            except RuntimeError as e:
+                errors.append(e)
+
+        leader = threading.Thread(
+            target=lambda: self.assertRaises(
+                RuntimeError, self.flight.do_batch, ["a", "b"], run
+            )
+        )
+        leader.start()
+        while self.flight.stats()["in_flight"] < 2:
+            time.sleep(0.01)
+        follower = threading.Thread(target=follow)
+        follower.start()
+        while self.flight.stats()["coalesced"] == 0:
+            time.sleep(0.01)
+        self.release.set()
+        leader.join()
+        follower.join(5)
+        self.assertFalse(follower.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    """Test cases for asyncio single-flight coalescing."""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Test that concurrent awaits of the same key run the work once."""
+        flight = AsyncSingleFlight()
+        runs = []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def main():
+            return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(runs), 1)
+        self.assertEqual([r[0] for r in results], ["result"] * 5)
+        self.assertEqual(sum(shared for _, shared in results), 4)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_followers_wait_at_most_their_timeout(self):
+        """Test that a follower times out without cancelling the shared call."""
+        flight = AsyncSingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.2)
+            return "result"
+
+        async def follower():
+            await asyncio.sleep(0)
+            with self.assertRaises(TimeoutError):
+                await flight.do("key", work, timeout=0.01)
+
+        async def main():
+            return (await asyncio.gather(flight.do("key", work), follower()))[0]
+
+        self.assertEqual(asyncio.run(main()), ("result", False))
+
+    def test_batch_runs_only_keys_not_in_flight(self):
+        """Test that an async batch shares in-flight keys and runs the rest once."""
+        flight = AsyncSingleFlight()
+        batches = []
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "a"
+
+        async def run(keys):
+            batches.append(keys)
+            return [key.upper() for key in keys]
+
+        async def main():
+            single = asyncio.ensure_future(flight.do("a", work))
+            await asyncio.sleep(0)
+            return await flight.do_batch(["a", "b", "b"], run), await single
+
+        results, single = asyncio.run(main())
+        self.assertEqual(batches, [["b"]])
+        self.assertEqual(results, [("a", True), ("B", False), ("B", True)])
+        self.assertEqual(single, ("a", False))
+        self.assertEqual(
+            flight.stats(), {"executed": 2, "coalesced": 2, "in_flight": 0}
+        )
+
+    def test_batch_with_missing_results_fails_every_caller(self):
+        """Test that an async batch returning too few results fails its followers."""
+        flight = AsyncSingleFlight()
+
+        async def run(keys):
+            await asyncio.sleep(0.05)
+            return [key.upper() for key in keys[:-1]]
+
+        async def work():
+            return "b"
+
+        async def main():
+            batch = asyncio.ensure_future(flight.do_batch(["a", "b"], run))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do("b", work, timeout=5))
+            return await asyncio.gather(batch, follower, return_exceptions=True)
+
+        batch, follower = asyncio.run(main())
+        self.assertIsInstance(batch, RuntimeError)
+        self.assertIsInstance(follower, RuntimeError)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
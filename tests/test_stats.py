@@ -0,0 +1,24 @@
+"""
+Tests for utils/stats.py
+"""
+import unittest
+
+# Import the module to test
+from utils.stats import percentile
+
+
+class TestPercentile(unittest.TestCase):
+    """Test cases for the nearest-rank percentile."""
+
+    def test_percentile(self):
+        """Test ranks, ordering and the empty window."""
+        samples = [5.0, 1.0, 4.0, 2.0, 3.0]
+        self.assertEqual(percentile(samples, 0.0), 1.0)
+        self.assertEqual(percentile(samples, 0.5), 3.0)
+        self.assertEqual(percentile(samples, 0.95), 5.0)
+        self.assertEqual(percentile(samples, 1.0), 5.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
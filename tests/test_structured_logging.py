@@ -0,0 +1,197 @@
+"""
+Tests for structured_logging.py
+"""
+import json
+import logging
+import queue
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+# Import the module to test
+from scheduler import InferenceScheduler
+from structured_logging import (
+    DroppingQueueHandler,
+    JsonFormatter,
+    RateLimitFilter,
+    RequestContextFilter,
+    current_request_id,
+    end_request,
+    log_access,
+    logging_stats,
+    record_stage,
+    setup_logging,
+    shutdown_logging,
+    stage,
+    stage_timings,
+    start_request,
+)
+
+
+def make_record(
+    message="something happened", level=logging.ERROR, lineno=10, args=(), **extra
+):
+    record = logging.LogRecord(
+        "test", level, "/app/module.py", lineno, message, args, None
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+class TestRequestContext(unittest.TestCase):
+    """Test cases for request ids and stage timings."""
+
+    def test_request_id_and_stages(self):
+        """Test ids are kept or generated and stages accumulate."""
+        tokens = start_request("client-id-1")
+        try:
+            self.assertEqual(current_request_id(), "client-id-1")
+            with stage("read"):
+                pass
+            record_stage("read", 0.5)
+            record_stage("backbone", 0.25)
+            timings = stage_timings()
+            self.assertGreaterEqual(timings["read_ms"], 500)
+            self.assertEqual(timings["backbone_ms"], 250)
+        finally:
+            end_request(tokens)
+        self.assertIsNone(current_request_id())
+        self.assertEqual(stage_timings(), {})
+
+        tokens = start_request("x" * 1000)
+        self.assertEqual(len(current_request_id()), 32)
+        end_request(tokens)
+
+    def test_context_follows_scheduler_jobs(self):
+        """Test that request ids and timings reach the inference workers."""
+        scheduler = InferenceScheduler(lambda job: job(), num_workers=1)
+        tokens = start_request("scheduled")
+        try:
+
+            def job():
+                record_stage("backbone", 0.1)
+                return current_request_id()
+
+            self.assertEqual(scheduler.run(job, timeout=5), "scheduled")
+            self.assertEqual(set(stage_timings()), {"queue_wait_ms", "backbone_ms"})
+        finally:
+            end_request(tokens)
+            scheduler.shutdown()
+
+    def test_access_log_levels(self):
+        """Test access records carry timings and escalate with the status."""
+        logger = logging.getLogger("test.access")
+        tokens = start_request()
+        try:
+            record_stage("read", 0.002)
+            with self.assertLogs(logger, level="INFO") as logs:
+                log_access(logger, "POST", "/generate_caption", 200, 0.1)
+                log_access(logger, "POST", "/generate_caption", 400, 0.1)
+                log_access(logger, "POST", "/generate_caption", 503, 0.1)
+        finally:
+            end_request(tokens)
+        self.assertEqual(
+            [r.levelname for r in logs.records], ["INFO", "WARNING", "ERROR"]
+        )
+        self.assertEqual(logs.records[0].timings, {"read_ms": 2.0})
+        self.assertEqual(logs.records[1].http["status"], 400)
+
+
+class TestHandlersAndFilters(unittest.TestCase):
+    """Test cases for the queue handler, filters and formatter."""
+
+    def test_json_formatter(self):
+        """Test records become one JSON object with their extras."""
+        record = make_record(
+            "took %d ms", args=(12,), request_id="abc", timings={"read_ms": 1.5}
+        )
+        try:
+            raise ValueError("bad upload")
+        except ValueError:
+            record.exc_info = sys.exc_info()
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "took 12 ms")
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["request_id"], "abc")
+        self.assertEqual(entry["timings"], {"read_ms": 1.5})
+        self.assertIn("ValueError: bad upload", entry["exception"])
+
+    def test_rate_limit_per_call_site(self):
+        """Test bursts pass, floods are suppressed and the count is reported."""
+        limiter = RateLimitFilter(rate=1.0, burst=3)
+        with patch("structured_logging.time.monotonic", return_value=100.0):
+            passed = [limiter.filter(make_record()) for _ in range(10)]
+            self.assertEqual(passed, [True] * 3 + [False] * 7)
+            # Other call sites and lower levels are not affected
+            self.assertTrue(limiter.filter(make_record(lineno=11)))
+            self.assertTrue(
+                all(limiter.filter(make_record(level=logging.INFO)) for _ in range(10))
+            )
+        with patch("structured_logging.time.monotonic", return_value=101.0):
+            record = make_record()
+            self.assertTrue(limiter.filter(record))
+            self.assertEqual(record.suppressed, 7)
+        self.assertEqual(limiter.suppressed, 7)
+
+    def test_queue_handler_drops_when_full(self):
+        """Test that a full queue drops records instead of blocking."""
+        handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+        handler.addFilter(RequestContextFilter())
+        tokens = start_request("queued")
+        try:
+            for i in range(5):
+                handler.handle(make_record("record %d", args=(i,)))
+        finally:
+            end_request(tokens)
+        self.assertEqual(handler.dropped, 3)
+        record = handler.queue.get_nowait()
+        self.assertEqual(
+            (record.msg, record.args, record.request_id), ("record 0", None, "queued")
+        )
+
+    def test_drops_counted_across_threads(self):
+        """Test that drops from concurrent threads are all counted."""
+        handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+        handler.queue.put_nowait(make_record())
+
+        def log_many():
+            for _ in range(2000):
+                handler.handle(make_record())
+
+        threads = [threading.Thread(target=log_many) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(handler.dropped, 16000)
+
+    def test_shutdown_detaches_queue_handler(self):
+        """Test that shutdown gives the root logger its own handlers back."""
+        shutdown_logging()
+        root = logging.getLogger()
+        saved_handlers, saved_level = root.handlers[:], root.level
+        config = {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "handlers": {"null": {"class": "logging.NullHandler"}},
+            "root": {"handlers": ["null"], "level": "INFO"},
+        }
+        try:
+            setup_logging(config, {"queue_size": 10})
+            self.assertEqual([type(h) for h in root.handlers], [DroppingQueueHandler])
+            shutdown_logging()
+            self.assertEqual([type(h) for h in root.handlers], [logging.NullHandler])
+            self.assertEqual(
+                logging_stats(), {"queued": 0, "dropped": 0, "suppressed": 0}
+            )
+            # A second shutdown is a no-op
+            shutdown_logging()
+            self.assertEqual(len(root.handlers), 1)
+        finally:
+            root.handlers[:] = saved_handlers
+            root.setLevel(saved_level)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Tests for thumbnails.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torchvision.transforms as transforms
+from PIL import Image
+
+# Import the module to test
+from model_registry import get_backbone_spec
+from utils.thumbnails import (
+    generate_thumbnails,
+    generate_thumbnails_batch,
+    model_input_from_image,
+)
+
+
+class TestThumbnails(unittest.TestCase):
+    """Test cases for the single-decode thumbnail pipeline."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.temp_dir, "out")
+        self.image_path = os.path.join(self.temp_dir, "photo.jpg")
+        gradient = (
+            np.linspace(0, 255, 1600 * 1200 * 3).astype(np.uint8).reshape(1200, 1600, 3)
+        )
+        Image.fromarray(gradient).save(self.image_path)
+
+    def tearDown(self):
+        """Clean up after each test method."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_generates_all_sizes(self):
+        """Test that every requested size is produced with the right aspect ratio."""
+        result = generate_thumbnails(
+            self.image_path, self.output_dir, sizes=[(160, 160), (800, 800), (400, 400)]
+        )
+
+        self.assertEqual(len(result["thumbnails"]), 3)
+        for box, expected in [
+            ((800, 800), (800, 600)),
+            ((400, 400), (400, 300)),
+            ((160, 160), (160, 120)),
+        ]:
+            with Image.open(result["thumbnails"][box]) as thumb:
+                self.assertEqual(thumb.size, expected)
+        self.assertIsNone(result["model_input"])
+
+    def test_decodes_once(self):
+        """Test that the source image is only decoded once."""
+        with patch("PIL.Image.open", wraps=Image.open) as mock_open:
+            generate_thumbnails(self.image_path, self.output_dir, model_input=True)
+        mock_open.assert_called_once()
+
+    def test_model_input_matches_captioner_transform(self):
+        """Test that generate_thumbnails matches SportsCaptioner's model input."""
+        with Image.open(self.image_path) as img:
+            image = img.convert("RGB")
+
+        for name in ("resnet50", "efficientnet_b0"):
+            with self.subTest(backbone=name):
+                spec = get_backbone_spec(name)
+                # The transform SportsCaptioner builds, on a full decode
+                transform = transforms.Compose(
+                    [
+                        transforms.Resize(
+                            spec.resize, interpolation=spec.interpolation
+                        ),
+                        transforms.CenterCrop(spec.crop),
+                        transforms.ToTensor(),
+                        transforms.Normalize(mean=spec.mean, std=spec.std),
+                    ]
+                )
+                expected = transform(image).numpy()
+                # Small thumbnails alone would let the JPEG decode at reduced scale
+                result = generate_thumbnails(
+                    self.image_path,
+                    self.output_dir,
+                    sizes=[(160, 160)],
+                    model_input=True,
+                    backbone=name,
+                )
+
+                self.assertEqual(result["model_input"].shape, (3, spec.crop, spec.crop))
+                np.testing.assert_allclose(result["model_input"], expected, atol=1e-4)
+                np.testing.assert_allclose(
+                    model_input_from_image(image, name), expected, atol=1e-4
+                )
+
+    def test_batch_reports_throughput_and_errors(self):
+        """Test batch generation across a process pool."""
+        missing = os.path.join(self.temp_dir, "missing.jpg")
+        results, stats = generate_thumbnails_batch(
+            [self.image_path, missing], self.output_dir, model_input=True, max_workers=2
+        )
+
+        self.assertEqual(results[0]["model_input"].shape, (3, 224, 224))
+        self.assertIn("error", results[1])
+        self.assertEqual(stats["images"], 2)
+        self.assertEqual(stats["failed"], 1)
+        self.assertGreater(stats["images_per_sec"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,23 +1,48 @@
-""
+"""
 Utility functions for file operations in the Sports Captioner application.
 """
-import os
-import shutil
+import hashlib
 import logging
-from pathlib import Path
-from typing import List, Optional, Union, Tuple
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: the store is only safe within one process
+    fcntl = None
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Size of the chunks read from an upload stream while hashing it
+CHUNK_SIZE = 64 * 1024
+
+# Uploads up to this size are hashed in memory, so duplicates never touch the disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Suffix of the sidecar file holding the reference count of a stored blob
+REFCOUNT_SUFFIX = ".refs"
+
+# Lock file in each fan-out directory, serialising blob creation and
+# reference count updates across processes
+LOCK_NAME = ".lock"
+
+# Serialises reference count updates within this process where fcntl is missing
+_refcount_lock = threading.Lock()
+
 
 def ensure_directory_exists(directory: Union[str, Path]) -> Path:
     """Ensure a directory exists, create it if it doesn't.
-    
+
     Args:
         directory: Path to the directory
-        
+
     Returns:
         Path: Path object of the directory
     """
@@ -28,10 +53,10 @@ def ensure_directory_exists(directory: Union[str, Path]) -> Path:
 
 def get_file_extension(filename: str) -> str:
     """Get the lowercase extension of a file.
-    
+
     Args:
         filename: Name of the file
-        
+
     Returns:
         str: File extension in lowercase (e.g., '.jpg', '.png')
     """
@@ -40,83 +65,261 @@ def get_file_extension(filename: str) -> str:
 
 def is_valid_image_file(filename: str, allowed_extensions: set) -> bool:
     """Check if a file has a valid image extension.
-    
+
     Args:
         filename: Name of the file to check
         allowed_extensions: Set of allowed file extensions (e.g., {'.jpg', '.png'})
-        
+
     Returns:
         bool: True if the file has a valid extension, False otherwise
     """
     return get_file_extension(filename) in allowed_extensions
 
 
-def save_uploaded_file(file, upload_folder: Union[str, Path], allowed_extensions: set) -> Tuple[bool, str]:
+def content_addressed_path(upload_folder: Union[str, Path], digest: str) -> Path:
+    """Get the location of a blob in the content-addressed store.
+
+    Blobs are fanned out over two directory levels taken from the digest
+    so that no single directory grows too large. The name is the digest
+    alone, so the same bytes uploaded as .jpg and .jpeg share one blob.
+
+    Args:
+        upload_folder: Root directory of the store
+        digest: Hex SHA-256 digest of the content
+
+    Returns:
+        Path: Path of the blob, e.g. ``<root>/ab/cd/abcd...``
+    """
+    return Path(upload_folder) / digest[:2] / digest[2:4] / digest
+
+
+@contextmanager
+def _store_lock(directory: Path) -> Iterator[None]:
+    """Exclusive lock on a fan-out directory, held across threads and processes."""
+    if fcntl is None:
+        with _refcount_lock:
+            yield
+        return
+    fd = os.open(directory / LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def _refcount_path(blob_path: Path) -> Path:
+    return blob_path.with_name(blob_path.name + REFCOUNT_SUFFIX)
+
+
+def get_reference_count(filepath: Union[str, Path]) -> int:
+    """Get the number of references held on a content-addressed blob.
+
+    Args:
+        filepath: Path to the blob
+
+    Returns:
+        int: Reference count, or 0 if the file is not a tracked blob
+    """
+    try:
+        return int(_refcount_path(Path(filepath)).read_text().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_reference_count(blob_path: Path, count: int) -> None:
+    # Write through a temporary file so readers never see a partial count
+    fd, tmp_name = tempfile.mkstemp(
+        dir=blob_path.parent, suffix=REFCOUNT_SUFFIX + ".tmp"
+    )
+    with os.fdopen(fd, "w") as f:
+        f.write(str(count))
+    os.replace(tmp_name, _refcount_path(blob_path))
+
+
+def store_content_addressed(
+    stream: BinaryIO,
+    upload_folder: Union[str, Path],
+    spool_max_size: int = SPOOL_MAX_SIZE,
+) -> Tuple[Path, bool]:
+    """Stream data into the content-addressed store.
+
+    The stream is hashed while it is read. Data up to ``spool_max_size``
+    is held in memory, so content that is already stored is never written
+    to disk; larger uploads are spooled to a temporary file inside the
+    store. New content is moved into place with an atomic rename, and
+    every call adds one reference to the resulting blob, under a file lock
+    so several worker processes can share the store.
+
+    Args:
+        stream: Binary file-like object to read from
+        upload_folder: Root directory of the store
+        spool_max_size: Maximum number of bytes to hash in memory
+
+    Returns:
+        Tuple[Path, bool]: (blob path, True if the content was newly written)
+    """
+    upload_path = ensure_directory_exists(upload_folder)
+    hasher = hashlib.sha256()
+    chunks: List[bytes] = []
+    buffered = 0
+    tmp_file = None
+    tmp_name = None
+
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            if tmp_file is None:
+                chunks.append(chunk)
+                buffered += len(chunk)
+                if buffered > spool_max_size:
+                    # Too large to hold in memory, spill to a temporary file
+                    fd, tmp_name = tempfile.mkstemp(dir=upload_path, suffix=".part")
+                    tmp_file = os.fdopen(fd, "wb")
+                    tmp_file.writelines(chunks)
+                    chunks = []
+            else:
+                tmp_file.write(chunk)
+        if tmp_file is not None:
+            tmp_file.close()
+
+        blob_path = content_addressed_path(upload_path, hasher.hexdigest())
+        ensure_directory_exists(blob_path.parent)
+        with _store_lock(blob_path.parent):
+            created = not blob_path.exists()
+            if created:
+                if tmp_name is None:
+                    fd, tmp_name = tempfile.mkstemp(
+                        dir=blob_path.parent, suffix=".part"
+                    )
+                    with os.fdopen(fd, "wb") as f:
+                        f.writelines(chunks)
+                os.replace(tmp_name, blob_path)
+                tmp_name = None
+            _write_reference_count(blob_path, get_reference_count(blob_path) + 1)
+        return blob_path, created
+    finally:
+        if tmp_file is not None and not tmp_file.closed:
+            tmp_file.close()
+        if tmp_name is not None and os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+def save_uploaded_file(
+    file,
+    upload_folder: Union[str, Path],
+    allowed_extensions: set,
+    content_addressed: bool = True,
+) -> Tuple[bool, str]:
     """Save an uploaded file to the specified folder.
-    
+
     Args:
         file: File object from request.files
         upload_folder: Directory to save the uploaded file
         allowed_extensions: Set of allowed file extensions
-        
+        content_addressed: Store the file under its SHA-256 digest, sharing
+            a single reference-counted copy between identical uploads
+            (release it with delete_file()); otherwise save it under a
+            unique timestamped name
+
     Returns:
         Tuple[bool, str]: (success status, message or filepath)
     """
-    if not file or file.filename == '':
-        return False, 'No file selected'
-    
+    if not file or file.filename == "":
+        return False, "No file selected"
+
     if not is_valid_image_file(file.filename, allowed_extensions):
-        return False, f'Invalid file type. Allowed types: {", ".join(allowed_extensions)}'
-    
+        return (
+            False,
+            f'Invalid file type. Allowed types: {", ".join(allowed_extensions)}',
+        )
+
     try:
         # Create upload directory if it doesn't exist
         upload_path = ensure_directory_exists(upload_folder)
-        
-        # Generate a unique filename to prevent overwriting
+
+        if content_addressed:
+            stream = getattr(file, "stream", file)
+            filepath, created = store_content_addressed(stream, upload_path)
+            if created:
+                logger.info(f"File saved successfully: {filepath}")
+            else:
+                logger.info(f"Duplicate upload, reusing stored file: {filepath}")
+            return True, str(filepath)
+
+        # Generate a unique filename to prevent overwriting; the random
+        # suffix keeps uploads within the same second apart
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         file_extension = get_file_extension(file.filename)
-        filename = f"upload_{timestamp}{file_extension}"
+        filename = f"upload_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
         filepath = upload_path / filename
-        
+
         # Save the file
         file.save(str(filepath))
         logger.info(f"File saved successfully: {filepath}")
         return True, str(filepath)
     except Exception as e:
         logger.error(f"Error saving file: {e}")
-        return False, f'Error saving file: {str(e)}'
+        return False, f"Error saving file: {str(e)}"
+
+
+def _release_reference(path: Path) -> bool:
+    """Drop one reference to a blob, or delete an untracked file outright."""
+    if _refcount_path(path).exists():
+        count = get_reference_count(path) - 1
+        if count > 0:
+            _write_reference_count(path, count)
+            logger.info(f"Released reference to {path} ({count} remaining)")
+            return True
+        _refcount_path(path).unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+        logger.info(f"Deleted file: {path}")
+        return True
+    if path.exists() and path.is_file():
+        path.unlink()
+        logger.info(f"Deleted file: {path}")
+    return True
 
 
 def delete_file(filepath: Union[str, Path]) -> bool:
     """Delete a file if it exists.
-    
+
+    Files from the content-addressed store only lose one reference; the
+    blob itself is removed once the last reference is released.
+
     Args:
         filepath: Path to the file to delete
-        
+
     Returns:
         bool: True if file was deleted or didn't exist, False otherwise
     """
     try:
         path = Path(filepath)
-        if path.exists() and path.is_file():
-            path.unlink()
-            logger.info(f"Deleted file: {filepath}")
-        return True
+        # Blobs are only ever written under their directory's lock file, so
+        # its presence marks a store directory whose references must be
+        # checked and released under the same lock as store_content_addressed
+        if (path.parent / LOCK_NAME).exists():
+            with _store_lock(path.parent):
+                return _release_reference(path)
+        return _release_reference(path)
     except Exception as e:
         logger.error(f"Error deleting file {filepath}: {e}")
         return False
 
 
-def clean_directory(directory: Union[str, Path], 
-                  extensions: Optional[set] = None,
-                  older_than_days: Optional[int] = None) -> bool:
+def clean_directory(
+    directory: Union[str, Path],
+    extensions: Optional[set] = None,
+    older_than_days: Optional[int] = None,
+) -> bool:
     """Clean files in a directory based on criteria.
-    
+
     Args:
         directory: Directory to clean
         extensions: Optional set of file extensions to include (None for all)
         older_than_days: Optional number of days (delete files older than this)
-        
+
     Returns:
         bool: True if operation completed successfully
     """
@@ -124,25 +327,25 @@ def clean_directory(directory: Union[str, Path],
         path = Path(directory)
         if not path.exists() or not path.is_dir():
             return False
-            
+
         current_time = datetime.now()
-        
+
         for item in path.iterdir():
             if item.is_file():
                 # Check file extension if filter is provided
                 if extensions and item.suffix.lower() not in extensions:
                     continue
-                    
+
                 # Check file age if filter is provided
                 if older_than_days is not None:
                     file_mtime = datetime.fromtimestamp(item.stat().st_mtime)
                     if (current_time - file_mtime).days < older_than_days:
                         continue
-                        
+
                 # Delete the file
                 item.unlink()
                 logger.info(f"Cleaned up file: {item}")
-                
+
         return True
     except Exception as e:
         logger.error(f"Error cleaning directory {directory}: {e}")
@@ -151,16 +354,16 @@ def clean_directory(directory: Union[str, Path],
 
 def get_directory_size(directory: Union[str, Path]) -> int:
     """Calculate the total size of a directory in bytes.
-    
+
     Args:
         directory: Path to the directory
-        
+
     Returns:
         int: Total size in bytes
     """
     try:
         path = Path(directory)
-        return sum(f.stat().st_size for f in path.glob('**/*') if f.is_file())
+        return sum(f.stat().st_size for f in path.glob("**/*") if f.is_file())
     except Exception as e:
         logger.error(f"Error calculating directory size {directory}: {e}")
         return 0
@@ -171,7 +374,7 @@ if __name__ == "__main__":
     upload_dir = Path("uploads")
     ensure_directory_exists(upload_dir)
     print(f"Directory exists: {upload_dir.exists()}")
-    
+
     # Example of getting directory size
     size_bytes = get_directory_size(upload_dir)
     print(f"Directory size: {size_bytes / (1024 * 1024):.2f} MB")
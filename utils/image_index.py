@@ -0,0 +1,259 @@
+"""
+Bulk image archive scanner backed by a persistent sqlite index.
+
+Walks an archive, probes image headers in a thread pool and records the
+results keyed by path. Files whose size and modification time match the
+index are skipped, so re-scanning a large archive only touches what
+changed.
+"""
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from utils.image_utils import VALID_EXTENSIONS, probe_image
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Number of probed files written to the index per transaction
+BATCH_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    valid INTEGER NOT NULL,
+    format TEXT,
+    mode TEXT,
+    width INTEGER,
+    height INTEGER,
+    error TEXT
+)
+"""
+
+_COLUMNS = (
+    "path",
+    "mtime_ns",
+    "file_size",
+    "valid",
+    "format",
+    "mode",
+    "width",
+    "height",
+    "error",
+)
+
+
+class ImageIndex:
+    """Persistent index of probed image metadata stored in sqlite."""
+
+    def __init__(self, index_path: Union[str, Path]):
+        """
+        Open (or create) the index.
+
+        Args:
+            index_path: Path to the sqlite database file
+        """
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.index_path))
+        # WAL keeps readers unblocked while a scan is writing
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self.conn.close()
+
+    def __enter__(self) -> "ImageIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def signatures(self, prefix: str = "") -> Dict[str, Tuple[int, int]]:
+        """
+        Get the (mtime_ns, file_size) of every indexed path under a prefix.
+
+        Args:
+            prefix: Only return paths starting with this prefix
+
+        Returns:
+            Dictionary mapping path to (mtime_ns, file_size)
+        """
+        rows = self.conn.execute(
+            "SELECT path, mtime_ns, file_size FROM images WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def upsert(self, records: List[dict]) -> None:
+        """
+        Insert or replace probe results in a single transaction.
+
+        Args:
+            records: Dictionaries as returned by probe_image
+        """
+        rows = [
+            (
+                r["path"],
+                r.get("mtime_ns", 0),
+                r.get("file_size", 0),
+                int(r["valid"]),
+                r.get("format"),
+                r.get("mode"),
+                r.get("width"),
+                r.get("height"),
+                r.get("error"),
+            )
+            for r in records
+        ]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO images ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                rows,
+            )
+
+    def remove(self, paths: List[str]) -> None:
+        """Remove paths from the index."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM images WHERE path = ?", [(p,) for p in paths]
+            )
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        Look up the indexed metadata of a path.
+
+        Returns:
+            Dictionary of the stored columns, or None if not indexed
+        """
+        row = self.conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM images WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(_COLUMNS, row))
+        record["valid"] = bool(record["valid"])
+        return record
+
+    def valid_paths(self) -> Iterator[str]:
+        """Iterate over all indexed paths that probed as valid images."""
+        for (path,) in self.conn.execute(
+            "SELECT path FROM images WHERE valid = 1 ORDER BY path"
+        ):
+            yield path
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+
+def _walk(root: str, extensions: Tuple[str, ...]) -> Iterator[Tuple[str, int, int]]:
+    """Yield (path, mtime_ns, size) for candidate image files under root."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and entry.name.lower().endswith(
+                            extensions
+                        ):
+                            st = entry.stat()
+                            yield entry.path, st.st_mtime_ns, st.st_size
+                    except OSError as e:
+                        logger.warning(f"Skipping {entry.path}: {e}")
+        except OSError as e:
+            logger.warning(f"Cannot scan directory {directory}: {e}")
+
+
+def scan_archive(
+    root: Union[str, Path],
+    index: ImageIndex,
+    max_workers: int = 16,
+    extensions: Tuple[str, ...] = VALID_EXTENSIONS,
+    prune: bool = True,
+) -> dict:
+    """
+    Scan an image archive and bring the index up to date.
+
+    Files are probed with probe_image (a single open, header only) in a
+    thread pool; the work is I/O bound so threads overlap the file opens.
+    Files whose mtime and size match the index are not opened at all.
+
+    Args:
+        root: Root directory of the archive
+        index: Index to update
+        max_workers: Number of probing threads
+        extensions: File extensions to consider
+        prune: Remove index entries for files that no longer exist
+
+    Returns:
+        Dictionary of scan statistics
+    """
+    start_time = time.perf_counter()
+    root = os.path.abspath(str(root))
+    known = index.signatures(prefix=root + os.sep)
+    stats = {"seen": 0, "probed": 0, "unchanged": 0, "invalid": 0, "removed": 0}
+
+    def flush(pending: List[str]) -> None:
+        results = list(executor.map(probe_image, pending))
+        index.upsert(results)
+        stats["probed"] += len(results)
+        stats["invalid"] += sum(1 for r in results if not r["valid"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: List[str] = []
+        for path, mtime_ns, size in _walk(root, extensions):
+            stats["seen"] += 1
+            if known.pop(path, None) == (mtime_ns, size):
+                stats["unchanged"] += 1
+                continue
+            pending.append(path)
+            if len(pending) >= BATCH_SIZE:
+                flush(pending)
+                pending = []
+        if pending:
+            flush(pending)
+
+    # Whatever is left in `known` was indexed before but no longer exists
+    if prune and known:
+        index.remove(list(known))
+        stats["removed"] = len(known)
+
+    stats["elapsed"] = time.perf_counter() - start_time
+    logger.info(
+        f"Scanned {stats['seen']} files under {root}: {stats['probed']} probed, "
+        f"{stats['unchanged']} unchanged, {stats['removed']} removed "
+        f"in {stats['elapsed']:.2f}s"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index the images in an archive")
+    parser.add_argument("root", help="Archive root directory")
+    parser.add_argument(
+        "--index", default="image_index.sqlite3", help="Path of the sqlite index"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=16, help="Number of probing threads"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with ImageIndex(args.index) as image_index:
+        print(scan_archive(args.root, image_index, max_workers=args.workers))
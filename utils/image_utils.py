@@ -1,30 +1,43 @@
-""
+"""
 Utility functions for image processing and validation.
 """
 import os
-from typing import Tuple, Optional
+import stat
+from typing import Optional, Tuple, Union
+
 from PIL import Image, UnidentifiedImageError
 
+# An image path or its encoded bytes
+ImageSource = Union[str, bytes, bytearray, memoryview]
+
+# File extensions accepted by validate_image and probe_image
+VALID_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
 def validate_image(file_path: str) -> Tuple[bool, Optional[str]]:
     """
     Validate if the file is a valid image.
-    
+
     Args:
         file_path: Path to the image file
-        
+
     Returns:
         Tuple of (is_valid, error_message)
     """
     if not os.path.exists(file_path):
         return False, "File does not exist"
-        
+
     if not os.path.isfile(file_path):
         return False, "Path is not a file"
-        
-    valid_extensions = ('.jpg', '.jpeg', '.png')
+
+    valid_extensions = VALID_EXTENSIONS
     if not file_path.lower().endswith(valid_extensions):
-        return False, f"Unsupported file format. Supported formats: {', '.join(valid_extensions)}"
-    
+        return (
+            False,
+            "Unsupported file format. "
+            f"Supported formats: {', '.join(valid_extensions)}",
+        )
+
     try:
         with Image.open(file_path) as img:
             img.verify()
@@ -32,42 +45,97 @@ def validate_image(file_path: str) -> Tuple[bool, Optional[str]]:
     except (UnidentifiedImageError, Exception) as e:
         return False, f"Invalid image file: {str(e)}"
 
+
 def get_image_metadata(file_path: str) -> dict:
     """
     Get metadata for an image file.
-    
+
     Args:
         file_path: Path to the image file
-        
+
     Returns:
         Dictionary containing image metadata
     """
     try:
         with Image.open(file_path) as img:
             return {
-                'format': img.format,
-                'mode': img.mode,
-                'size': img.size,
-                'width': img.width,
-                'height': img.height,
-                'file_size': os.path.getsize(file_path)
+                "format": img.format,
+                "mode": img.mode,
+                "size": img.size,
+                "width": img.width,
+                "height": img.height,
+                "file_size": os.path.getsize(file_path),
             }
     except Exception as e:
-        return {'error': str(e)}
+        return {"error": str(e)}
+
+
+def probe_image(
+    file_path: str, valid_extensions: Tuple[str, ...] = VALID_EXTENSIONS
+) -> dict:
+    """
+    Validate an image and read its metadata with a single open.
+
+    Only the image header is parsed; pixel data is never decoded, so this
+    is much cheaper than calling validate_image followed by
+    get_image_metadata. Unlike validate_image it does not verify the
+    integrity of the pixel data.
+
+    Args:
+        file_path: Path to the image file
+        valid_extensions: Accepted file extensions
+
+    Returns:
+        Dictionary with 'valid' and 'error' keys plus the metadata returned
+        by get_image_metadata and the file's 'mtime_ns' when available
+    """
+    result = {"path": file_path, "valid": False, "error": None}
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        result["error"] = "File does not exist"
+        return result
+
+    if not stat.S_ISREG(st.st_mode):
+        result["error"] = "Path is not a file"
+        return result
+
+    result["file_size"] = st.st_size
+    result["mtime_ns"] = st.st_mtime_ns
+    if not file_path.lower().endswith(valid_extensions):
+        result[
+            "error"
+        ] = f"Unsupported file format. Supported formats: {', '.join(valid_extensions)}"
+        return result
+
+    try:
+        with Image.open(file_path) as img:
+            result.update(
+                {
+                    "format": img.format,
+                    "mode": img.mode,
+                    "size": img.size,
+                    "width": img.width,
+                    "height": img.height,
+                }
+            )
+        result["valid"] = True
+    except (UnidentifiedImageError, Exception) as e:
+        result["error"] = f"Invalid image file: {str(e)}"
+    return result
+
 
 def resize_image(
-    file_path: str, 
-    output_path: str, 
-    max_size: Tuple[int, int] = (800, 800)
+    file_path: str, output_path: str, max_size: Tuple[int, int] = (800, 800)
 ) -> bool:
     """
     Resize an image while maintaining aspect ratio.
-    
+
     Args:
         file_path: Path to the source image
         output_path: Path to save the resized image
         max_size: Maximum (width, height) of the output image
-        
+
     Returns:
         bool: True if successful, False otherwise
     """
@@ -76,5 +144,5 @@ def resize_image(
             img.thumbnail(max_size, Image.Resampling.LANCZOS)
             img.save(output_path)
             return True
-    except Exception as e:
+    except Exception:
         return False
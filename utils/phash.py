@@ -0,0 +1,153 @@
+"""
+Perceptual hashing and near-duplicate lookup.
+
+dhash() reduces an image to a 64-bit difference hash from a tiny decode
+(JPEG draft mode decodes at 1/8 scale), so re-encoded, resized or lightly
+cropped copies of a photo hash to values a few bits apart.
+NearDuplicateIndex finds a stored hash within a Hamming radius using
+multi-index hashing: the hash is split into radius + 1 chunks and, by the
+pigeonhole principle, any match within the radius agrees exactly with the
+query on at least one chunk, so only those buckets are scanned.
+"""
+import io
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from utils.image_utils import ImageSource
+from utils.stats import percentile
+
+# Number of recent lookup latencies kept for the stats
+LATENCY_SAMPLES = 1024
+
+
+def dhash(source: ImageSource, hash_size: int = 8) -> int:
+    """
+    Difference hash of an image.
+
+    Args:
+        source: Path to an image file or its encoded bytes
+        hash_size: Side of the comparison grid; the hash has hash_size**2 bits
+
+    Returns:
+        Hash as an unsigned integer
+    """
+    if not isinstance(source, str):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        # Let the JPEG decoder skip most of the work
+        image.draft("L", ((hash_size + 1) * 4, hash_size * 4))
+        pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.BOX).load()
+    value = 0
+    for y in range(hash_size):
+        for x in range(hash_size):
+            value = (value << 1) | (pixels[x, y] > pixels[x + 1, y])
+    return value
+
+
+# int.bit_count is Python 3.10+
+_popcount = getattr(int, "bit_count", None) or (lambda value: bin(value).count("1"))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return _popcount(a ^ b)
+
+
+class NearDuplicateIndex:
+    """Bounded in-memory map from perceptual hash to value with radius lookup."""
+
+    def __init__(self, radius: int = 4, bits: int = 64, max_entries: int = 1_000_000):
+        """
+        Args:
+            radius: Largest Hamming distance treated as a near duplicate
+            bits: Hash length in bits
+            max_entries: Oldest entries are evicted beyond this many
+        """
+        self.radius = radius
+        self.max_entries = max_entries
+        # radius + 1 chunks, as equal as possible, covering all bits
+        chunks = radius + 1
+        widths = [
+            bits // chunks + (1 if i < bits % chunks else 0) for i in range(chunks)
+        ]
+        self._chunks: List[Tuple[int, int]] = []
+        shift = bits
+        for width in widths:
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+        # Per chunk: chunk value -> {entry id: full hash}
+        self._tables: List[Dict[int, Dict[int, int]]] = [{} for _ in self._chunks]
+        self._entries: "OrderedDict[int, Tuple[int, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _keys(self, value: int) -> List[int]:
+        return [(value >> shift) & mask for shift, mask in self._chunks]
+
+    def add(self, value: int, payload: Any) -> None:
+        """Store a payload under a hash, evicting the oldest entry when full."""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (value, payload)
+            for table, key in zip(self._tables, self._keys(value)):
+                table.setdefault(key, {})[entry_id] = value
+            while len(self._entries) > self.max_entries:
+                old_id, (old_value, _) = self._entries.popitem(last=False)
+                for table, key in zip(self._tables, self._keys(old_value)):
+                    bucket = table[key]
+                    del bucket[old_id]
+                    if not bucket:
+                        del table[key]
+
+    def lookup(self, value: int) -> Optional[Tuple[int, Any]]:
+        """
+        Find the closest stored hash within the radius.
+
+        Returns:
+            Tuple of (distance, payload), or None if nothing is close enough
+        """
+        best: Optional[Tuple[int, Any]] = None
+        with self._lock:
+            start = time.perf_counter()
+            best_id, best_distance = None, self.radius + 1
+            for table, key in zip(self._tables, self._keys(value)):
+                bucket = table.get(key)
+                if not bucket:
+                    continue
+                for entry_id, stored in bucket.items():
+                    distance = _popcount(value ^ stored)
+                    if distance < best_distance:
+                        best_id, best_distance = entry_id, distance
+            if best_id is not None:
+                best = (best_distance, self._entries[best_id][1])
+            self._lookups += 1
+            if best is not None:
+                self._hits += 1
+            self._latencies.append(time.perf_counter() - start)
+        return best
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Entries, lookups, hits (skipped inferences) and lookup latency in
+        microseconds.
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                "entries": len(self._entries),
+                "lookups": self._lookups,
+                "hits": self._hits,
+                "lookup_p50_us": percentile(latencies, 0.50) * 1e6,
+                "lookup_p95_us": percentile(latencies, 0.95) * 1e6,
+            }
@@ -0,0 +1,70 @@
+"""
+Bounded cache of results keyed by image content digest.
+
+Captions are reproducible per image (the seed is derived from the
+SHA-256 of its bytes), so a result can be served again for any later
+upload of the same bytes, or to a client that only sends the digest.
+Entries remember the image size and a lookup that gives a size must
+match it too.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class ResultCache:
+    """Thread-safe LRU map from content digest to result."""
+
+    def __init__(self, max_entries: int = 100_000):
+        """
+        Args:
+            max_entries: Least recently used entries are evicted beyond this
+                many (0 disables caching)
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, digest: str, size: Optional[int] = None) -> Optional[Any]:
+        """
+        Result stored for a digest.
+
+        Args:
+            digest: Hex SHA-256 of the image bytes
+            size: Image size in bytes, checked against the stored one if given
+
+        Returns:
+            The result, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or (size is not None and entry[0] != size):
+                self._misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, digest: str, size: int, result: Any) -> None:
+        """Store a result, evicting the least recently used entry when full."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = (size, result)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Entries, hits and misses."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
@@ -0,0 +1,330 @@
+"""
+Single-flight coalescing of concurrent identical work.
+
+While a call for a key is in flight, further calls for the same key wait
+for it and share its result instead of repeating the work. Nothing is
+cached: once the call finishes, the next call for the key runs again.
+
+Each caller waits for a shared call at most its own `timeout`, but the
+work itself runs under the caller that started it: a deadline enforced
+inside `fn` is the leader's, and an error it raises, such as the
+scheduler's DeadlineExceeded, is shared by every caller of the call.
+"""
+import asyncio
+import threading
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+
+def _check_results(results: Sequence[Any], expected: int) -> List[Any]:
+    """
+    Return the results of a batch call, checking there is one per key.
+
+    Raises:
+        RuntimeError: If the number of results is not `expected`
+    """
+    results = list(results)
+    if len(results) != expected:
+        raise RuntimeError(
+            f"Batch call returned {len(results)} results for {expected} keys"
+        )
+    return results
+
+
+class _Call:
+    """State of one in-flight call."""
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(
+        self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Run `fn` for `key`, or wait for the call already in flight.
+
+        Exceptions raised by `fn` propagate to every caller that shared
+        the call, including a timeout `fn` enforces for the caller that
+        started it.
+
+        Args:
+            key: Identity of the work, e.g. a content digest
+            fn: Function doing the work
+            timeout: Seconds a caller sharing another's call waits for it
+
+        Returns:
+            Tuple of (result, True if the result was shared from another caller)
+
+        Raises:
+            TimeoutError: If the shared call is not done within `timeout`
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Shared call not done within {timeout:.2f}s")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def do_batch(
+        self,
+        keys: Sequence[Hashable],
+        fn: Callable[[List[Hashable]], Sequence[Any]],
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[Any, bool]]:
+        """
+        Run `fn` once for the keys not already in flight and wait for the rest.
+
+        A key repeated within `keys` is run once and shared by its repeats.
+        Exceptions raised by `fn` propagate to every caller waiting on any
+        of its keys.
+
+        Args:
+            keys: Identities of the work items
+            fn: Function of the keys this caller runs, returning one result per key
+            timeout: Seconds this caller waits for calls run by other callers
+
+        Returns:
+            One (result, True if shared from another call) tuple per key, in order
+
+        Raises:
+            TimeoutError: If a shared call is not done within `timeout`
+            RuntimeError: If `fn` does not return one result per key
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        calls, owned = [], []
+        with self._lock:
+            for key in keys:
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    self._coalesced += 1
+                else:
+                    call = self._calls[key] = _Call()
+                    self._executed += 1
+                    owned.append(len(calls))
+                calls.append(call)
+
+        try:
+            if owned:
+                results = _check_results(fn([keys[i] for i in owned]), len(owned))
+                for i, result in zip(owned, results):
+                    calls[i].result = result
+        except BaseException as e:
+            for i in owned:
+                calls[i].error = e
+            raise
+        finally:
+            with self._lock:
+                for i in owned:
+                    del self._calls[keys[i]]
+            for i in owned:
+                calls[i].done.set()
+
+        owned = set(owned)
+        shared_results = []
+        for i, call in enumerate(calls):
+            if i not in owned:
+                remaining = (
+                    None if deadline is None else max(0.0, deadline - time.monotonic())
+                )
+                if not call.done.wait(remaining):
+                    raise TimeoutError(f"Shared call not done within {timeout:.2f}s")
+                if call.error is not None:
+                    raise call.error
+            shared_results.append((call.result, i not in owned))
+        return shared_results
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of executed and coalesced calls."""
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for use inside one event loop."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Future"] = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        Await `fn()` for `key`, or wait for the call already in flight.
+
+        Args:
+            key: Identity of the work, e.g. a content digest
+            fn: Coroutine function doing the work
+            timeout: Seconds a caller sharing another's call waits for it
+
+        Returns:
+            Tuple of (result, True if the result was shared from another caller)
+
+        Raises:
+            TimeoutError: If the shared call is not done within `timeout`
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            self._coalesced += 1
+            # shield: a waiter going away must not cancel the shared call
+            try:
+                return await asyncio.wait_for(asyncio.shield(call), timeout), True
+            except asyncio.TimeoutError:
+                raise TimeoutError(
+                    f"Shared call not done within {timeout:.2f}s"
+                ) from None
+
+        self._executed += 1
+        call = self._calls[key] = asyncio.ensure_future(fn())
+        # Forget the call once it finishes, even if the leader goes away first
+        call.add_done_callback(lambda _: self._forget(key, call))
+        return await asyncio.shield(call), False
+
+    async def do_batch(
+        self,
+        keys: Sequence[Hashable],
+        fn: Callable[[List[Hashable]], Awaitable[Sequence[Any]]],
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[Any, bool]]:
+        """
+        Await `fn` once for the keys not already in flight and wait for the rest.
+
+        Args:
+            keys: Identities of the work items
+            fn: Coroutine function of the keys this caller runs, returning one
+                result per key
+            timeout: Seconds this caller waits for calls run by other callers
+
+        Returns:
+            One (result, True if shared from another call) tuple per key, in order
+
+        Raises:
+            TimeoutError: If a shared call is not done within `timeout`
+            RuntimeError: If `fn` does not return one result per key
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        calls, owned = [], []
+        for key in keys:
+            call = self._calls.get(key)
+            if call is not None:
+                self._coalesced += 1
+                calls.append((call, True))
+                continue
+            self._executed += 1
+            call = self._calls[key] = loop.create_future()
+            call.add_done_callback(
+                lambda _, key=key, call=call: self._forget(key, call)
+            )
+            owned.append(call)
+            calls.append((call, False))
+
+        if owned:
+
+            async def run() -> List[Any]:
+                results = await fn(
+                    [key for key, (_, shared) in zip(keys, calls) if not shared]
+                )
+                return _check_results(results, len(owned))
+
+            batch = asyncio.ensure_future(run())
+
+            def settle(batch: "asyncio.Future") -> None:
+                for position, call in enumerate(owned):
+                    if batch.cancelled():
+                        call.cancel()
+                    elif batch.exception() is not None:
+                        call.set_exception(batch.exception())
+                        # Raised to this caller through `batch`; marks it retrieved
+                        call.exception()
+                    else:
+                        call.set_result(batch.result()[position])
+
+            batch.add_done_callback(settle)
+            await asyncio.shield(batch)
+
+        results = []
+        for call, shared in calls:
+            if shared:
+                remaining = (
+                    None if deadline is None else max(0.0, deadline - loop.time())
+                )
+                try:
+                    results.append(
+                        (await asyncio.wait_for(asyncio.shield(call), remaining), True)
+                    )
+                except asyncio.TimeoutError:
+                    raise TimeoutError(
+                        f"Shared call not done within {timeout:.2f}s"
+                    ) from None
+            else:
+                results.append((await call, False))
+        return results
+
+    def _forget(self, key: Hashable, call: "asyncio.Future") -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of executed and coalesced calls."""
+        return {
+            "executed": self._executed,
+            "coalesced": self._coalesced,
+            "in_flight": len(self._calls),
+        }
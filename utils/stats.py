@@ -0,0 +1,21 @@
+"""
+Summary statistics of the latency samples kept for /metrics.
+"""
+from typing import List
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of a sample window.
+
+    Args:
+        samples: Observed values, in any order
+        fraction: Percentile as a fraction, e.g. 0.95
+
+    Returns:
+        The value at that rank, or 0.0 without samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
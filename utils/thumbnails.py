@@ -0,0 +1,217 @@
+"""
+Multi-size thumbnail generation from a single decode.
+
+Each image is decoded once (at a reduced JPEG scale where the requested
+sizes allow it) and a cascade of thumbnails is produced from the largest
+to the smallest, each resized from the previous one. The model input for
+SportsCaptioner can be produced from the same decode; it then needs the
+full-resolution decode to match SportsCaptioner.transform, so no reduced
+decode is used. Batches are spread over a process pool.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Thumbnail bounding boxes served to the front-end
+DEFAULT_SIZES = ((800, 800), (400, 400), (160, 160))
+
+
+def _fit(size: Tuple[int, int], box: Tuple[int, int]) -> Tuple[int, int]:
+    """Largest size with the aspect ratio of `size` fitting in `box` (no upscaling)."""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _draft_size(
+    size: Tuple[int, int], sizes: Sequence[Tuple[int, int]]
+) -> Tuple[int, int]:
+    """Smallest decode size that still serves every requested thumbnail."""
+    needed = [_fit(size, box) for box in sizes]
+    return max(w for w, _ in needed), max(h for _, h in needed)
+
+
+def model_input_from_image(
+    image: Image.Image, backbone: Optional[str] = None
+) -> np.ndarray:
+    """
+    Produce the normalized model input from a full-resolution RGB image.
+
+    Equivalent to SportsCaptioner.transform for the backbone: resize the
+    shorter side, center crop and normalize with the resize, crop,
+    interpolation and statistics of its BackboneSpec.
+
+    Args:
+        image: RGB PIL image
+        backbone: Registered backbone name (MODEL_CONFIG["default_model"]
+            by default)
+
+    Returns:
+        float32 array of shape (3, crop, crop)
+    """
+    # Imported here so pool workers that only make thumbnails skip torch
+    from config import MODEL_CONFIG
+    from model_registry import get_backbone_spec
+
+    spec = get_backbone_spec(backbone or MODEL_CONFIG["default_model"])
+    resize, crop = spec.resize, spec.crop
+
+    width, height = image.size
+    # Same rounding as torchvision's Resize(int)
+    if width <= height:
+        size = (resize, int(resize * height / width))
+    else:
+        size = (int(resize * width / height), resize)
+    resized = image.resize(size, Image.Resampling[spec.interpolation.name])
+    left = int(round((resized.width - crop) / 2.0))
+    top = int(round((resized.height - crop) / 2.0))
+    cropped = resized.crop((left, top, left + crop, top + crop))
+    array = np.asarray(cropped, dtype=np.float32) / 255.0
+    array = (array - np.array(spec.mean, dtype=np.float32)) / np.array(
+        spec.std, dtype=np.float32
+    )
+    return np.ascontiguousarray(array.transpose(2, 0, 1))
+
+
+def generate_thumbnails(
+    file_path: str,
+    output_dir: str,
+    sizes: Sequence[Tuple[int, int]] = DEFAULT_SIZES,
+    model_input: bool = False,
+    quality: int = 85,
+    backbone: Optional[str] = None,
+) -> dict:
+    """
+    Generate several thumbnails (and optionally the model input) from one decode.
+
+    Args:
+        file_path: Path to the source image
+        output_dir: Directory to write the thumbnails to
+        sizes: Bounding boxes of the thumbnails to produce
+        model_input: Also return the normalized model input array; the
+            image is then decoded at full resolution
+        quality: JPEG quality of the thumbnails
+        backbone: Backbone whose preprocessing the model input follows
+
+    Returns:
+        Dictionary with 'path', 'thumbnails' mapping each box to its output
+        path, and 'model_input' (array or None)
+    """
+    sizes = sorted(sizes, key=lambda box: box[0] * box[1], reverse=True)
+    stem = Path(file_path).stem
+    ext = Path(file_path).suffix.lower() or ".jpg"
+    os.makedirs(output_dir, exist_ok=True)
+
+    with Image.open(file_path) as img:
+        if img.format == "JPEG" and not model_input:
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that is enough
+            img.draft("RGB", _draft_size(img.size, sizes))
+        decoded = img.convert("RGB")
+
+    thumbnails: Dict[Tuple[int, int], str] = {}
+    current = decoded
+    for box in sizes:
+        target = _fit(current.size, box)
+        if target != current.size:
+            current = current.resize(target, Image.Resampling.LANCZOS)
+        output_path = os.path.join(output_dir, f"{stem}_{box[0]}x{box[1]}{ext}")
+        current.save(output_path, quality=quality)
+        thumbnails[tuple(box)] = output_path
+
+    return {
+        "path": file_path,
+        "thumbnails": thumbnails,
+        "model_input": model_input_from_image(decoded, backbone)
+        if model_input
+        else None,
+    }
+
+
+def _generate_safe(args) -> dict:
+    file_path = args[0]
+    try:
+        return generate_thumbnails(*args)
+    except Exception as e:
+        return {"path": file_path, "error": str(e)}
+
+
+def generate_thumbnails_batch(
+    file_paths: List[str],
+    output_dir: str,
+    sizes: Sequence[Tuple[int, int]] = DEFAULT_SIZES,
+    model_input: bool = False,
+    max_workers: Optional[int] = None,
+    chunksize: int = 8,
+    quality: int = 85,
+    backbone: Optional[str] = None,
+) -> Tuple[List[dict], dict]:
+    """
+    Generate thumbnails for many images across a process pool.
+
+    Decoding and resampling are CPU bound, so processes rather than
+    threads are used to get past the GIL.
+
+    Args:
+        file_paths: Source images
+        output_dir: Directory to write the thumbnails to
+        sizes: Bounding boxes of the thumbnails to produce
+        model_input: Also return the normalized model input arrays
+        max_workers: Number of worker processes (defaults to the CPU count)
+        chunksize: Number of images handed to a worker at a time
+        quality: JPEG quality of the thumbnails
+        backbone: Backbone whose preprocessing the model inputs follow
+
+    Returns:
+        Tuple of (per-image results in input order, throughput statistics).
+        Failed images have an 'error' key instead of 'thumbnails'.
+    """
+    start_time = time.perf_counter()
+    jobs = [
+        (path, output_dir, sizes, model_input, quality, backbone) for path in file_paths
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_generate_safe, jobs, chunksize=chunksize))
+
+    elapsed = time.perf_counter() - start_time
+    failed = sum(1 for r in results if "error" in r)
+    stats = {
+        "images": len(results),
+        "failed": failed,
+        "thumbnails": (len(results) - failed) * len(sizes),
+        "elapsed": elapsed,
+        "images_per_sec": len(results) / elapsed if elapsed > 0 else 0.0,
+    }
+    logger.info(
+        f"Generated thumbnails for {stats['images'] - failed}/{stats['images']} images "
+        f"in {elapsed:.2f}s ({stats['images_per_sec']:.1f} images/s)"
+    )
+    return results, stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Generate thumbnails for a batch of images"
+    )
+    parser.add_argument("images", nargs="+", help="Source images")
+    parser.add_argument("--output", default="thumbnails", help="Output directory")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    _, batch_stats = generate_thumbnails_batch(
+        args.images, args.output, max_workers=args.workers
+    )
+    print(batch_stats)